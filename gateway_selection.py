@@ -1,5 +1,11 @@
+import signal
+import threading
+from array import array
 from enum import IntEnum
-from random import randint
+from heapq import heapify, heappop, heappush
+from itertools import compress
+from math import isqrt
+from random import Random
 
 class DeviceType(IntEnum):
     """
@@ -11,14 +17,19 @@ class DeviceType(IntEnum):
 
 class Gateway(object):
     """
-    This class describes an IOT gateway, with its bandwidth, shared among all the devices, and the reachability radius.
+    This class describes an IOT gateway, with its bandwidth, shared among all the devices, and the reachability radius.\n
+    The connected devices are kept in a set, together with the number of devices of each type.
+    The counter callbacks are called with the gateway, after each change of its counters,
+    and the connection callbacks with the device and the gateway, or None after a disconnection.
     """
+    __slots__ = ("__ID", "__bandwidth", "__radius", "__devices", "__counts", "__hash", "__callbacks", "__marginals", "__listeners")
     COUNTER = 0 # Autoincrement ID.
 
-    def __init__(self, bandwidth, radius=25):
+    def __init__(self, bandwidth, radius=25, ID=None):
         """
         Initialize a device given a bandwidth [Mbps] and an optional radius [m].\n
-        If the radius is omitted, it is assumed to be equal to 25 m.
+        If the radius is omitted, it is assumed to be equal to 25 m.\n
+        If the ID is omitted, it is taken from the class counter.
         """
         if bandwidth is None or bandwidth <= 0: # The bandwidth must be an integer greater than zero.
             raise ValueError("Bandwidth must be greater than zero.")
@@ -26,13 +37,20 @@ class Gateway(object):
         if radius is None or radius <= 0: # The radius must be an integer greater than zero. 
             raise ValueError("Radius must be greater than zero.")
         
-        Gateway.COUNTER += 1 # Increment the ID.
+        if ID is None:
+            Gateway.COUNTER += 1 # Increment the ID.
+            ID = Gateway.COUNTER
 
         # Assign the parameters or initialize to default values.
-        self.__ID = Gateway.COUNTER
+        self.__ID = ID
         self.__bandwidth = bandwidth
         self.__radius = radius
-        self.__devices = []
+        self.__devices = set()
+        self.__counts = {type: 0 for type in DeviceType} # Number of connected devices of each type.
+        self.__hash = hash((self.__ID, self.__bandwidth, self.__radius)) # The hashed fields never change.
+        self.__callbacks = ()
+        self.__listeners = ()
+        self.__marginals = {} # Marginal values of each type, cached until the counters change.
 
     def connect_device(self, device):
         """
@@ -41,7 +59,13 @@ class Gateway(object):
         if device is None or not isinstance(device, Device): # The device's class must be Device and it has to be not null.
             raise ValueError("The device must be not null.")
         if device not in self.__devices: # The device must not be already connected to the device.
-            self.__devices.append(device) # Insert the device.
+            self.__devices.add(device) # Insert the device.
+            self.__counts[device.type] += 1 # Update the counter of its type.
+            self.__marginals.clear()
+            for callback in self.__callbacks:
+                callback(self)
+            for listener in self.__listeners:
+                listener(device, self)
     
     def disconnect_device(self, device):
         """
@@ -51,21 +75,64 @@ class Gateway(object):
             raise ValueError("The device must be not null.")
         if device in self.__devices:# The device must be already connected to the device.
             self.__devices.remove(device) # Delete the device.
+            self.__counts[device.type] -= 1 # Update the counter of its type.
+            self.__marginals.clear()
+            for callback in self.__callbacks:
+                callback(self)
+            for listener in self.__listeners:
+                listener(device, None)
+
+    def add_counter_callback(self, callback):
+        """
+        Register a function to call with the gateway, each time a device connects or disconnects.
+        """
+        self.__callbacks += (callback,)
+
+    def remove_counter_callback(self, callback):
+        """
+        Unregister a function registered with add_counter_callback.
+        """
+        self.__callbacks = tuple(registered for registered in self.__callbacks if registered != callback)
+
+    def add_connection_callback(self, callback):
+        """
+        Register a function to call with the device and the gateway when it connects, or None when it disconnects.
+        """
+        self.__listeners += (callback,)
+
+    def remove_connection_callback(self, callback):
+        """
+        Unregister a function registered with add_connection_callback.
+        """
+        self.__listeners = tuple(registered for registered in self.__listeners if registered != callback)
     
     def get_device_count(self, type):
         """
         Return the number of devices connected to the gateway of the speciefied type.
         """
-        # Return the number of devices that their type is equal to the given one.
-        return len([device for device in self.__devices if device.type == type])
+        # Return the counter of the given type.
+        return self.__counts.get(type, 0)
+
+    def get_marginal_values(self, type):
+        """
+        Return the variations (join, leave) of the bandwidth of the given type, when one of its devices connects to the gateway
+        and when one of them disconnects from it.\n
+        The values are computed once for each state of the counters, and shared by all the devices of the type.
+        """
+        values = self.__marginals.get(type)
+        if values is None:
+            n = self.__counts.get(type, 0)
+            values = marginal_values(n, len(self.__devices) - n, self.__bandwidth)
+            self.__marginals[type] = values
+        return values
 
     def __eq__(self, other):
         # Compare the identifier of two instances.
         return other.ID == self.ID if isinstance(other, Gateway) else False
     
     def __hash__(self):
-        # Compute the hash using the ID, bandwidth and radius.
-        return hash((self.__ID, self.__bandwidth, self.__radius))
+        # Return the hash of the ID, bandwidth and radius, computed once.
+        return self.__hash
     
     def __repr__(self):
         # The string is 'Gateway15' for a gateway, having 15 as ID.
@@ -89,6 +156,8 @@ class Displacement(object):
     This class represents a displacement of a device or gateway in a two-dimensional space.\n
     This object is immutable.
     """
+    __slots__ = ("__x", "__y", "__element")
+
     def __init__(self, x, y, element):
         """
         Initialize the object given a position (x, y) and and element.
@@ -109,114 +178,608 @@ class Displacement(object):
     y = property(lambda self: self.__y)
     element = property(lambda self: self.__element)
 
+class CellPool(object):
+    """
+    This class holds a set of cells, identified by the key y * columns + x, to be sampled uniformly in constant time.\n
+    The cells taken after being added are not searched for: they are dropped when drawn, so each one costs a single extra draw.
+    """
+    __slots__ = ("__keys", "__pooled")
+
+    def __init__(self, bitmap):
+        """
+        Initialize the pool with the cells whose key is set in the bitmap.
+        """
+        self.__keys = array("l", compress(range(len(bitmap)), bitmap)) # Keys to sample from, in any order.
+        self.__pooled = bytearray(bitmap) # Keys currently in the array.
+
+    def add(self, key):
+        """
+        Add a cell to the pool, if it is not already present.
+        """
+        if not self.__pooled[key]:
+            self.__pooled[key] = 1
+            self.__keys.append(key)
+
+    def choice(self, rng, free):
+        """
+        Return a random key among the pooled cells for which free(key) holds, or None if there is none.
+        """
+        while self.__keys:
+            index = rng.randrange(len(self.__keys))
+            key = self.__keys[index]
+            if free(key):
+                return key
+            # Drop the taken cell, moving the last key in its place.
+            self.__keys[index] = self.__keys[-1]
+            self.__keys.pop()
+            self.__pooled[key] = 0
+        return None
+
 class Space(object):
     """
-    This class models a two-dimensional space where is possible to place devices and gateways.
+    This class models a two-dimensional space where is possible to place devices and gateways.\n
+    The elements are indexed by cell, and the gateways are also indexed in a uniform grid of buckets,
+    so that placement, occupancy checks and coverage queries don't scan every displacement.\n
+    The positions, the device types and the gateway of each device are stored as typed arrays indexed by the slot of each element,
+    and the displacements are only built on request: the gateways report their connections, to keep the assignments in sync.\n
+    The gateways reachable by each device are cached, and only the rows affected by a change are invalidated.\n
+    The random positions are drawn from pools of the free cells, and of the free cells covered by a gateway, built on demand.\n
+    The elements can be moved or removed: the caches are updated only around the positions involved.
     """
-    def __init__(self, rows, columns):
+    BUCKET_SIZE = 10 # Default side of a gateway bucket [m].
+
+    def __init__(self, rows, columns, bucket_size=BUCKET_SIZE, rng=None):
         """
         Initialize the object given the dimensions: rows and columns.
-        Both dimensions must be integers, grater than zero.
+        Both dimensions must be integers, grater than zero.\n
+        The optional bucket size is the side of the cells of the grid used to index the gateways.\n
+        The random choices use the given generator, or seed: if it is omitted, a new generator is seeded by the system.
         """
         if rows is None or rows <= 0: # The rows must an integer greater than zero.
             raise ValueError("Rows must be greater than zero.")
         if columns is None or columns <= 0: # The columns must an integer greater than zero.
             raise ValueError("Columns must be greater than zero.")
+        if bucket_size is None or bucket_size <= 0: # The bucket size must an integer greater than zero.
+            raise ValueError("Bucket size must be greater than zero.")
 
         # Assign the parameters and the default values.
         self.__rows = rows
         self.__columns = columns
-        self.__positions = []
+        self.__bucket_size = bucket_size
+        self.__rng = rng if isinstance(rng, Random) else Random(rng)
+        self.__elements = [] # Placed elements, by slot.
+        self.__slot_of = {} # Map each element to its slot.
+        self.__xs = array("l") # Coordinates of the elements, by slot.
+        self.__ys = array("l")
+        self.__types = array("b") # Type of the devices, or 0 for the gateways, by slot.
+        self.__assignments = array("q") # Slot of the gateway of each device, or -1, by slot.
+        self.__cells = {} # Map the key y * columns + x of each taken position to the slot of its element.
+        self.__gateway_buckets = {} # Map each bucket to the slots of the gateways inside it.
+        self.__max_radius = 0 # Largest radius of the placed gateways.
+        self.__coverage = {} # Map each device to the cached tuple of the gateways that can reach it.
+        self.__coverage_graph = None # Cached compressed coverage graph, built on demand.
+        self.__covered_devices = None # Cached devices reachable by each gateway, built with the graph.
+        self.__covered = None # Bitmap of the cells within the radius of a gateway, built with the pool of the covered cells.
+        self.__covered_pool = None # Pool of the covered cells, to place the devices.
+        self.__free_pool = None # Pool of all the cells, to place the gateways in a crowded space.
     
-    def add_element(self, element, x=None, y=None):
+    def __bucket(self, x, y):
+        # Return the bucket which contains the position (x, y).
+        return (x // self.__bucket_size, y // self.__bucket_size)
+
+    def __insert(self, element, x, y):
+        # Store the position in a new slot, indexed by element, by position and, for the gateways, by bucket.
+        slot = len(self.__elements)
+        self.__elements.append(element)
+        self.__slot_of[element] = slot
+        self.__xs.append(x)
+        self.__ys.append(y)
+        self.__types.append(element.type if isinstance(element, Device) else 0)
+        self.__assignments.append(-1)
+        self.__cells[y * self.__columns + x] = slot
+        if isinstance(element, Gateway):
+            element.add_connection_callback(self.__connected)
+            self.__gateway_buckets.setdefault(self.__bucket(x, y), []).append(slot)
+            self.__max_radius = max(self.__max_radius, element.radius)
+            self.__invalidate_coverage(x, y, element.radius)
+            if self.__covered is not None:
+                self.__cover(x, y, element.radius)
+
+    def __connected(self, device, gateway):
+        # Store the slot of the gateway a placed device connected to, or -1 after a disconnection.
+        slot = self.__slot_of.get(device)
+        if slot is not None:
+            self.__assignments[slot] = self.__slot_of[gateway] if gateway is not None else -1
+
+    def __invalidate_coverage(self, x, y, radius):
+        # Drop the cached rows of the devices within the radius from the position (x, y).
+        if len(self.__coverage) < (2 * radius + 1) ** 2: # Visit the cached rows, if they are fewer than the cells of the area.
+            devices = [device for device in self.__coverage if self.__in_radius(self.__slot_of[device], x, y, radius)]
+        else: # Otherwise, visit the cells of the area.
+            devices = [self.__elements[slot] for slot in (self.__cells.get(key) for span in self.__spans(x, y, radius) for key in span)
+                        if slot is not None and self.__elements[slot] in self.__coverage]
+        for device in devices:
+            del self.__coverage[device]
+        self.__coverage_graph = None # The compressed graph has to be rebuilt from the rows.
+
+    def __forget_covered(self, gateways):
+        # Drop the cached devices reached by the given gateways, to be collected again on demand.
+        if self.__covered_devices is not None:
+            for gateway in gateways:
+                self.__covered_devices.pop(gateway, None)
+
+    def __devices_within(self, x, y, radius):
+        # Return the devices placed within the radius from the position (x, y), visiting the cells of the area.
+        return [self.__elements[slot] for slot in (self.__cells.get(key) for span in self.__spans(x, y, radius) for key in span)
+                if slot is not None and isinstance(self.__elements[slot], Device)]
+
+    def __spans(self, x, y, radius):
+        # Yield the range of keys of each row within the radius from the position (x, y), clamped to the boundaries.
+        for j in range(max(y - radius, 0), min(y + radius, self.__rows - 1) + 1):
+            width = isqrt(radius ** 2 - (j - y) ** 2)
+            yield range(j * self.__columns + max(x - width, 0), j * self.__columns + min(x + width, self.__columns - 1) + 1)
+
+    def __cover(self, x, y, radius):
+        # Mark the cells within the radius as covered, adding the new ones to the pool.
+        for span in self.__spans(x, y, radius):
+            for key in span:
+                if not self.__covered[key]:
+                    self.__covered[key] = 1
+                    self.__covered_pool.add(key)
+
+    def __uncover(self, x, y, radius):
+        # Clear the cells within the radius, then cover again the rows shared with the disks of the gateways near enough:
+        # the buckets are visited once per call, and the pool drops the cells left uncovered when drawn.
+        spans = list(self.__spans(x, y, radius))
+        first_row = max(y - radius, 0)
+        for span in spans:
+            self.__covered[span.start:span.stop] = bytes(len(span))
+        for slot in self.__gateway_slots(x, y, radius + self.__max_radius):
+            (gateway_x, gateway_y, gateway_radius) = (self.__xs[slot], self.__ys[slot], self.__elements[slot].radius)
+            if not self.__in_radius(slot, x, y, radius + gateway_radius): # The two disks don't intersect.
+                continue
+            for span in self.__spans(gateway_x, gateway_y, gateway_radius):
+                row = span.start // self.__columns - first_row
+                if 0 <= row < len(spans):
+                    (start, stop) = (max(span.start, spans[row].start), min(span.stop, spans[row].stop))
+                    if start < stop:
+                        self.__covered[start:stop] = b"\x01" * (stop - start)
+
+    def __is_free(self, key):
+        # Check if the cell with the given key is free.
+        return key not in self.__cells
+
+    def __is_free_covered(self, key):
+        # Check if the cell with the given key is free and covered by a gateway.
+        return key not in self.__cells and self.__covered[key]
+
+    def __release(self, key):
+        # Free the cell with the given key, returning it to the pools.
+        del self.__cells[key]
+        if self.__free_pool is not None:
+            self.__free_pool.add(key)
+        if self.__covered is not None and self.__covered[key]:
+            self.__covered_pool.add(key)
+
+    def __discard(self, slot):
+        # Free the slot of a removed element, moving the last element in its place.
+        element = self.__elements[slot]
+        self.__release(self.__ys[slot] * self.__columns + self.__xs[slot])
+        del self.__slot_of[element]
+        last = len(self.__elements) - 1
+        if slot != last:
+            moved = self.__elements[last]
+            (self.__elements[slot], self.__xs[slot], self.__ys[slot]) = (moved, self.__xs[last], self.__ys[last])
+            (self.__types[slot], self.__assignments[slot]) = (self.__types[last], self.__assignments[last])
+            self.__slot_of[moved] = slot
+            self.__cells[self.__ys[slot] * self.__columns + self.__xs[slot]] = slot
+            if isinstance(moved, Gateway):
+                bucket = self.__gateway_buckets[self.__bucket(self.__xs[slot], self.__ys[slot])]
+                bucket[bucket.index(last)] = slot
+                for device in moved.devices: # Its devices follow it to the new slot.
+                    self.__assignments[self.__slot_of[device]] = slot
+        self.__elements.pop()
+        self.__xs.pop()
+        self.__ys.pop()
+        self.__types.pop()
+        self.__assignments.pop()
+
+    def __unbucket(self, slot):
+        # Remove the slot of a gateway from its bucket.
+        bucket = self.__bucket(self.__xs[slot], self.__ys[slot])
+        self.__gateway_buckets[bucket].remove(slot)
+        if len(self.__gateway_buckets[bucket]) == 0:
+            del self.__gateway_buckets[bucket]
+
+    def __check_reach(self, gateway, x=None, y=None):
+        # Check that every device reached by the gateway keeps another gateway, or the gateway itself moved to (x, y).
+        (gateway_x, gateway_y) = self.get_position(gateway)
+        for device in self.__devices_within(gateway_x, gateway_y, gateway.radius):
+            if any(near_gateway != gateway for near_gateway in self.get_near_gateways(device)):
+                continue
+            if x is not None and self.__in_radius(self.__slot_of[device], x, y, gateway.radius):
+                continue
+            raise ValueError("The device {} would not be able to connect to any gateway.".format(device.ID))
+
+    def __reconnect(self, gateway):
+        # Connect each device of the gateway that it no longer reaches to a random gateway among the ones reaching it.
+        for device in list(gateway.devices):
+            near_gateways = self.get_near_gateways(device)
+            if gateway not in near_gateways:
+                gateway.disconnect_device(device)
+                near_gateways[self.__rng.randrange(len(near_gateways))].connect_device(device)
+
+    def __random_covered_position(self):
+        # Draw a free position covered by at least one gateway, building the pool on the first call.
+        if self.__covered is None:
+            self.__covered = bytearray(self.__rows * self.__columns)
+            for slots in self.__gateway_buckets.values():
+                for slot in slots:
+                    for span in self.__spans(self.__xs[slot], self.__ys[slot], self.__elements[slot].radius):
+                        self.__covered[span.start:span.stop] = b"\x01" * len(span)
+            self.__covered_pool = CellPool(self.__covered)
+        return self.__covered_pool.choice(self.__rng, self.__is_free_covered)
+
+    def __random_free_position(self):
+        # Draw a free position: by trial while at least half of the space is free, otherwise from the pool of the free cells.
+        if len(self.__cells) >= self.__rows * self.__columns:
+            return None
+        if self.__free_pool is None and 2 * len(self.__cells) < self.__rows * self.__columns:
+            while True:
+                (x, y) = (self.__rng.randrange(self.__columns), self.__rng.randrange(self.__rows))
+                if y * self.__columns + x not in self.__cells:
+                    return y * self.__columns + x
+        if self.__free_pool is None:
+            bitmap = bytearray(b"\x01") * (self.__rows * self.__columns)
+            for key in self.__cells:
+                bitmap[key] = 0
+            self.__free_pool = CellPool(bitmap)
+        return self.__free_pool.choice(self.__rng, self.__is_free)
+
+    def __in_radius(self, slot, x, y, radius):
+        # Check if the element in the slot is within the radius from the position (x, y).
+        return (self.__xs[slot] - x) ** 2 + (self.__ys[slot] - y) ** 2 <= radius ** 2
+
+    def __gateway_slots(self, x, y, distance):
+        # Yield the slots of the gateways in the buckets within the distance from the position (x, y).
+        (first_x, first_y) = self.__bucket(max(x - distance, 0), max(y - distance, 0))
+        (last_x, last_y) = self.__bucket(min(x + distance, self.__columns - 1), min(y + distance, self.__rows - 1))
+        for bucket_x in range(first_x, last_x + 1):
+            for bucket_y in range(first_y, last_y + 1):
+                yield from self.__gateway_buckets.get((bucket_x, bucket_y), ())
+
+    def __gateways_covering(self, x, y):
+        # Return the gateways whose radius covers the position (x, y), visiting only the buckets within the largest radius.
+        near_gateways = [self.__elements[slot] for slot in self.__gateway_slots(x, y, self.__max_radius)
+                         if self.__in_radius(slot, x, y, self.__elements[slot].radius)]
+        near_gateways.sort(key=lambda gateway: gateway.ID) # Keep a stable order, independent from the buckets.
+        return near_gateways
+
+    def add_element(self, element, x=None, y=None, gateway=None):
         """
         Add an element to the space.\n
         If the position (x, y) is omitted, a random one is generated.\n
         If the element is already placed an exception will be raised.\n
         If the position (x, y) is provided, it must be within the boundaries.\n
-        Each device is placed in a position, such that it can connect to at least one gateway.
+        Each device is placed in a position, such that it can connect to at least one gateway.\n
+        A device connects to the given gateway, which must reach it, or to a random one.
         """
         # If the space already contains a position with that element, raise an exception.
-        if len([displacement for displacement in self.__positions if displacement.element == element]) > 0:
+        if element in self.__slot_of:
             raise RuntimeError("The element is already placed.")
         # If the position provided is out of boundaries, raise an exception.
         if (x is not None and (x < 0 or x >= self.__columns)) or (y is not None and (y < 0 or y >= self.__rows)):
             raise IndexError("The position (x, y) must be within the boundaries.")
         if x is not None and y is not None:
-            # Create a new displacement.
-            new_displacement = Displacement(x, y, element)
             # If the position is already taken, raise an exception.
-            if len([displacement for displacement in self.__positions if displacement.x == x and displacement.y == y]) > 0:
+            if y * self.__columns + x in self.__cells:
                 raise ValueError("The position ({},{}) is already taken.".format(x, y))
-            self.__positions.append(new_displacement) # If all of the previous constrains hold, place the element.
             if isinstance(element, Device): # If the element is a device, than it should be near at least one gateway.
-                near_gateways = self.get_near_gateways(element) # Find the nearest gateways of a device.
-                if len(near_gateways) == 0: # If it's isolated, remove the displacement inserted before and raise an exception.
-                    self.__positions.remove(new_displacement)
+                near_gateways = self.__gateways_covering(x, y) # Find the nearest gateways of the position.
+                if len(near_gateways) == 0: # If it's isolated, raise an exception.
                     raise ValueError("The device is not able to connect to any gateway.")
-                else:
-                    # If there is at least one near gateway, select one from the neighbors and setup the connection.
-                    random_gateway_index = randint(0, len(near_gateways) - 1)
-                    near_gateways[random_gateway_index].connect_device(element)
+                if gateway is not None and gateway not in near_gateways: # The given gateway must reach the position.
+                    raise ValueError("The gateway is not able to reach the position ({},{}).".format(x, y))
+                # If there is at least one near gateway, select one from the neighbors and setup the connection.
+                if gateway is None:
+                    gateway = near_gateways[self.__rng.randint(0, len(near_gateways) - 1)]
+            self.__insert(element, x, y) # If all of the previous constrains hold, place the element.
+            if isinstance(element, Device):
+                gateway.connect_device(element)
+                self.__coverage[element] = tuple(near_gateways) # The coverage of the device is already known.
+                self.__coverage_graph = None
+                self.__forget_covered(near_gateways)
             return (x, y) # Return the position of the element.
         else:
-            added = False # The element is not initially added.
-            # Initialize the position.
-            x = 0
-            y = 0
-            while not added: # While the position was not suitable for the element:
-                # Generate a random position.
-                x = randint(0, self.__columns - 1)
-                y = randint(0, self.__rows - 1)
-                try:
-                    # Try to add the element.
-                    (x, y) = self.add_element(element, x=x, y=y)
-                    added = True # Everything gone fine, can exit.
-                except ValueError as error: # If the exception was a value error than we have to retry, until we find a valid position.
-                    continue
-            return (x, y) # Return the position.
+            key = self.__random_position(element, gateway)
+            return self.add_element(element, x=key % self.__columns, y=key // self.__columns, gateway=gateway)
 
-    def get_near_gateways(self, element):
-        if element is None or len([displacement for displacement in self.__positions if displacement.element == element]) == 0:
+    def __random_position(self, element, gateway=None):
+        # Draw the key of a random free position for the element, within the reach of the given gateway or of any gateway for a device.
+        if isinstance(element, Device) and len(self.__gateway_buckets) == 0: # Without gateways no position can be covered.
+            raise ValueError("The device is not able to connect to any gateway.")
+        if isinstance(element, Device) and gateway is not None: # Draw among the free cells the gateway reaches.
+            (gateway_x, gateway_y) = self.get_position(gateway)
+            keys = [key for span in self.__spans(gateway_x, gateway_y, gateway.radius)
+                    for key in span if self.__is_free(key)]
+            key = keys[self.__rng.randrange(len(keys))] if keys else None
+        elif isinstance(element, Device):
+            key = self.__random_covered_position()
+        else:
+            key = self.__random_free_position()
+        if key is None: # There is no valid position left.
+            raise ValueError("There is no free position for the element.")
+        return key
+
+    def remove_element(self, element):
+        """
+        Remove an element from the space, freeing its position.\n
+        A device is disconnected from its gateway. The devices connected to a removed gateway connect to a random gateway
+        among the ones still reaching them: if a device would be left without any gateway, an exception is raised and nothing changes.
+        """
+        slot = self.__slot_of.get(element) if element is not None else None
+        if slot is None:
             raise ValueError("The element is not present or it's null.")
-        gateway_displacements = [displacement for displacement in self.__positions if isinstance(displacement.element, Gateway)]
-        element_displacement = [displacement for displacement in self.__positions if displacement.element == element][0]
-        near_gateways = []
-        for gateway_displacement in gateway_displacements:
-            if  (gateway_displacement.x - element_displacement.x) ** 2 + \
-                (gateway_displacement.y - element_displacement.y) ** 2 <= gateway_displacement.element.radius ** 2:
-                near_gateways.append(gateway_displacement.element)
+        (x, y) = (self.__xs[slot], self.__ys[slot])
+        if isinstance(element, Device):
+            self.get_device_gateway(element).disconnect_device(element)
+            self.__forget_covered(self.get_near_gateways(element))
+            del self.__coverage[element]
+            self.__coverage_graph = None
+            self.__discard(slot)
+        else:
+            self.__check_reach(element)
+            element.remove_connection_callback(self.__connected)
+            self.__unbucket(slot)
+            self.__discard(slot)
+            self.__invalidate_coverage(x, y, element.radius)
+            self.__forget_covered((element,))
+            self.__reconnect(element)
+            if self.__covered is not None:
+                self.__uncover(x, y, element.radius)
+
+    def move_element(self, element, x=None, y=None):
+        """
+        Move a placed element to the position (x, y), or to a random one if it is omitted, and return the new position.\n
+        A device keeps its gateway if it still reaches it, otherwise it connects to a random one; it must reach at least one.
+        The devices connected to a moved gateway that no longer reaches them connect to a random gateway among the others:
+        if a device would be left without any gateway, an exception is raised and nothing changes.
+        """
+        slot = self.__slot_of.get(element) if element is not None else None
+        if slot is None:
+            raise ValueError("The element is not present or it's null.")
+        if (x is not None and (x < 0 or x >= self.__columns)) or (y is not None and (y < 0 or y >= self.__rows)):
+            raise IndexError("The position (x, y) must be within the boundaries.")
+        if x is None or y is None:
+            key = self.__random_position(element)
+            (x, y) = (key % self.__columns, key // self.__columns)
+        (old_x, old_y) = (self.__xs[slot], self.__ys[slot])
+        if (x, y) == (old_x, old_y):
+            return (x, y)
+        if y * self.__columns + x in self.__cells:
+            raise ValueError("The position ({},{}) is already taken.".format(x, y))
+        if isinstance(element, Device):
+            near_gateways = self.__gateways_covering(x, y)
+            if len(near_gateways) == 0:
+                raise ValueError("The device is not able to connect to any gateway.")
+            current_gateway = self.get_device_gateway(element)
+            self.__forget_covered(self.get_near_gateways(element))
+            self.__forget_covered(near_gateways)
+            self.__relocate(slot, x, y)
+            self.__coverage[element] = tuple(near_gateways)
+            self.__coverage_graph = None
+            if current_gateway not in near_gateways:
+                current_gateway.disconnect_device(element)
+                near_gateways[self.__rng.randrange(len(near_gateways))].connect_device(element)
+        else:
+            self.__check_reach(element, x, y)
+            self.__unbucket(slot)
+            self.__relocate(slot, x, y)
+            self.__gateway_buckets.setdefault(self.__bucket(x, y), []).append(slot)
+            self.__invalidate_coverage(old_x, old_y, element.radius)
+            self.__invalidate_coverage(x, y, element.radius)
+            self.__forget_covered((element,))
+            self.__reconnect(element)
+            if self.__covered is not None:
+                self.__cover(x, y, element.radius)
+                self.__uncover(old_x, old_y, element.radius)
+        return (x, y)
+
+    def __relocate(self, slot, x, y):
+        # Move the element in the slot to the free position (x, y).
+        self.__release(self.__ys[slot] * self.__columns + self.__xs[slot])
+        self.__xs[slot] = x
+        self.__ys[slot] = y
+        self.__cells[y * self.__columns + x] = slot
+
+    def add_elements(self, elements):
+        """
+        Add many elements to the space, each one in a random position, and return the list of their positions.\n
+        The gateways should come first, so that the devices are drawn from a single pool of the covered cells.
+        """
+        return [self.add_element(element) for element in elements]
+
+    def get_element(self, x, y):
+        """
+        Return the element placed in the position (x, y), or None if the position is free.
+        """
+        slot = self.__cells.get(y * self.__columns + x) if 0 <= x < self.__columns else None
+        return self.__elements[slot] if slot is not None else None
+
+    def get_position(self, element):
+        """
+        Return the position (x, y) of a placed element.
+        """
+        slot = self.__slot_of.get(element) if element is not None else None
+        if slot is None:
+            raise ValueError("The element is not present or it's null.")
+        return (self.__xs[slot], self.__ys[slot])
+
+    def get_displacement(self, element):
+        """
+        Return the displacement of a placed element, built on request from the stored position.
+        """
+        (x, y) = self.get_position(element)
+        return Displacement(x, y, element)
+
+    def get_near_gateways(self, element):
+        """
+        Return the gateways that can reach the given element.\n
+        The result for a device is cached until a change in its neighborhood.
+        """
+        near_gateways = self.__coverage.get(element)
+        if near_gateways is None:
+            (x, y) = self.get_position(element)
+            near_gateways = tuple(self.__gateways_covering(x, y))
+            if isinstance(element, Device): # Only the devices' rows are cached.
+                self.__coverage[element] = near_gateways
         return near_gateways
+
+    def get_coverage_graph(self):
+        """
+        Return the bipartite coverage graph as a tuple (devices, gateways, offsets, indices), in compressed sparse row form.\n
+        The indices of the gateways reachable by devices[i] are indices[offsets[i]:offsets[i + 1]], referring to the gateways list.\n
+        The graph is rebuilt from the cached rows only after a change, so the distances are never recomputed for untouched devices.
+        """
+        if self.__coverage_graph is None:
+            devices = [element for element in self.__elements if isinstance(element, Device)]
+            gateways = [element for element in self.__elements if isinstance(element, Gateway)]
+            gateway_index = {gateway: index for (index, gateway) in enumerate(gateways)}
+            offsets = array("l", [0])
+            indices = array("l")
+            for device in devices:
+                indices.extend(gateway_index[gateway] for gateway in self.get_near_gateways(device))
+                offsets.append(len(indices))
+            self.__coverage_graph = (devices, gateways, offsets, indices)
+        return self.__coverage_graph
+
+    def get_covered_devices(self, gateway):
+        """
+        Return the devices that the given gateway can reach, from the cached coverage graph.\n
+        After a change, the devices of the gateways involved are collected again from the cells within their radius.
+        """
+        if self.__covered_devices is None:
+            (devices, gateways, offsets, indices) = self.get_coverage_graph()
+            self.__covered_devices = {gateway: [] for gateway in gateways}
+            for (index, device) in enumerate(devices):
+                for gateway_index in indices[offsets[index]:offsets[index + 1]]:
+                    self.__covered_devices[gateways[gateway_index]].append(device)
+        devices = self.__covered_devices.get(gateway)
+        if devices is None:
+            slot = self.__slot_of.get(gateway) if isinstance(gateway, Gateway) else None
+            if slot is None:
+                raise ValueError("The element is not present or it's null.")
+            devices = self.__devices_within(self.__xs[slot], self.__ys[slot], gateway.radius)
+            self.__covered_devices[gateway] = devices
+        return devices
     
     def get_device_gateway(self, element):
-        return [gateway for gateway in self.get_near_gateways(element) if element in gateway][0]
+        """
+        Return the gateway the given device is connected to, from the stored assignments.
+        """
+        slot = self.__slot_of.get(element) if element is not None else None
+        if slot is None:
+            raise ValueError("The element is not present or it's null.")
+        if self.__assignments[slot] < 0:
+            raise ValueError("The device is not connected to any gateway.")
+        return self.__elements[self.__assignments[slot]]
 
+    def snapshot(self):
+        """
+        Return a compact description of the placed scenario, made only of numbers and lists, so that it can be saved as JSON:
+        the dimensions, each gateway as [ID, x, y, radius, bandwidth] and each device as [ID, type, x, y, gateway ID].
+        """
+        gateways = []
+        devices = []
+        for (element, x, y, type, assignment) in zip(self.__elements, self.__xs, self.__ys, self.__types, self.__assignments):
+            if isinstance(element, Gateway):
+                gateways.append([element.ID, x, y, element.radius, element.bandwidth])
+            else:
+                devices.append([element.ID, type, x, y, self.__elements[assignment].ID])
+        return {"rows": self.__rows, "columns": self.__columns, "bucket_size": self.__bucket_size, "gateways": gateways, "devices": devices}
+
+    @classmethod
+    def from_snapshot(cls, snapshot, rng=None):
+        """
+        Build again a scenario from its snapshot, with new elements having the same IDs, positions and connections.\n
+        Return the tuple (space, gateways, devices).
+        """
+        space = cls(snapshot["rows"], snapshot["columns"], bucket_size=snapshot["bucket_size"], rng=rng)
+        gateways = {}
+        for (ID, x, y, radius, bandwidth) in snapshot["gateways"]:
+            gateways[ID] = Gateway(bandwidth, radius=radius, ID=ID)
+            space.add_element(gateways[ID], x=x, y=y)
+        devices = []
+        for (ID, type, x, y, gateway_ID) in snapshot["devices"]:
+            devices.append(Device(DeviceType(type), ID=ID))
+            space.add_element(devices[-1], x=x, y=y, gateway=gateways[gateway_ID])
+        return (space, list(gateways.values()), devices)
+
+    rows = property(lambda self: self.__rows)
+    columns = property(lambda self: self.__columns)
+
+
+class IdAllocator(object):
+    """
+    This class creates gateways and devices with their own IDs, independent from the class counters,
+    so that each scenario numbers its elements from one.
+    """
+    def __init__(self):
+        """
+        Initialize the counters of the gateways and of the devices of each type.
+        """
+        self.__counters = {Gateway: 0, DeviceType.TYPE_A: 0, DeviceType.TYPE_B: 0}
+
+    def __next(self, key):
+        # Increment and return the counter.
+        self.__counters[key] += 1
+        return self.__counters[key]
+
+    def gateway(self, bandwidth, radius=25):
+        """
+        Create a gateway with the next gateway ID.
+        """
+        return Gateway(bandwidth, radius=radius, ID=self.__next(Gateway))
+
+    def device(self, type):
+        """
+        Create a device with the next ID of its type.
+        """
+        if type is None or not isinstance(type, DeviceType):
+            raise TypeError("The device type must be not null.")
+        return Device(type, ID=self.__next(type))
 
 class Device(object):
+    __slots__ = ("__ID", "__type", "__gateway_callback", "__hash")
     COUNTER_A = 0
     COUNTER_B = 0
+    TOLERANCE = 1e-9 # Smallest bandwidth variation [Mbps] considered an improvement, to ignore the rounding errors.
 
-    def __init__(self, type):
+    def __init__(self, type, ID=None):
         if type is None or not isinstance(type, DeviceType):
             raise TypeError("The device type must be not null.")
 
         if type == DeviceType.TYPE_A:
-            Device.COUNTER_A += 1
-            self.__ID = Device.COUNTER_A
+            if ID is None:
+                Device.COUNTER_A += 1
+                ID = Device.COUNTER_A
         elif type == DeviceType.TYPE_B:
-            Device.COUNTER_B += 1
-            self.__ID = Device.COUNTER_B
+            if ID is None:
+                Device.COUNTER_B += 1
+                ID = Device.COUNTER_B
         else:
             raise ValueError("Unsupported device type.")
 
+        self.__ID = ID
         self.__type = type
         self.__gateway_callback = None
+        self.__hash = hash((ID, type)) # The hashed fields never change.
     
     def __eq__(self, other):
         return other.ID == self.ID and other.type == self.type if isinstance(other, Device) else False
     
     def __hash__(self):
-        return hash((self.__ID, self.__type))
+        return self.__hash
 
     def __repr__(self):
         return "Device {} Type {}".format(self.__ID, self.__type)
@@ -225,22 +788,24 @@ class Device(object):
         return self.__repr__
 
     def __bandwidth_variation(self, starting_gateway, destination_gateway):
-        n1 = starting_gateway.get_device_count(self.type)
-        n2 = destination_gateway.get_device_count(self.type)
-        m1 = starting_gateway.devices_count - n1
-        m2 = destination_gateway.devices_count - n2
-        w1 = starting_gateway.bandwidth
-        w2 = destination_gateway.bandwidth
-        if n1 + m1 == 1 and n2 + m2 == 0:
+        # The variation is the sum of the marginal values of leaving the starting gateway and joining the destination one,
+        # except for the only device of a gateway moving to an empty one, as in bandwidth_variation.
+        if starting_gateway.devices_count == 1 and destination_gateway.devices_count == 0:
             return 0
-        elif n1 + m1 == 1 and n2 + m2 > 0:
-            return (n2 + 1) * w2 / (n2 + m2 + 1) - (n1 * w1 / (n1 + m1) + n2 * w2 / (n2 + m2))
-        elif n1 + m1 > 1 and n2 + m2 == 0:
-            return (n1 - 1) * w1 / (n1 + m1 - 1) + (n2 + 1) * w2 / (m2 + n2 + 1) - n1 * w1 / (n1 + m1)
-        else:
-            return  (n1 - 1) * w1 / (n1 + m1 - 1) + (n2 + 1) * w2 / (n2 + m2 + 1) - n1 * w1 / (n1 + m1) - n2 * w2 / (n2 + m2)
+        return starting_gateway.get_marginal_values(self.__type)[1] + destination_gateway.get_marginal_values(self.__type)[0]
 
-    def gateway_selection(self, space):
+    def gateway_selection(self, space, argmax=False):
+        """
+        Let the device move to a gateway improving the bandwidth of its type, and return 1 if it changed gateway, 0 otherwise.\n
+        The candidates are scanned in order, moving at each improvement; if argmax is True, the device moves at once to the best one.
+        """
+        if argmax:
+            (best_gateway, best_delta) = self.best_deviation(space)
+            if best_delta <= Device.TOLERANCE:
+                return 0
+            space.get_device_gateway(self).disconnect_device(self)
+            best_gateway.connect_device(self)
+            return 1
         near_gateways = space.get_near_gateways(self)
         current_gateway = [gateway for gateway in near_gateways if self in gateway][0]
         changed = 0
@@ -249,20 +814,74 @@ class Device(object):
                 if self.__gateway_callback != None:
                     self.__gateway_callback(near_gateway, self)
                 delta = self.__bandwidth_variation(current_gateway, near_gateway)
-                if delta > 0:
+                if delta > Device.TOLERANCE:
                     current_gateway.disconnect_device(self)
                     near_gateway.connect_device(self)
                     current_gateway = near_gateway
                     changed = 1
         return changed
     
+    def best_deviation(self, space):
+        """
+        Return the best gateway the device could move to, and the variation of the bandwidth of its type.\n
+        If the device reaches only its current gateway, (None, 0) is returned.
+        """
+        near_gateways = space.get_near_gateways(self)
+        current_gateway = [gateway for gateway in near_gateways if self in gateway][0]
+        (best_gateway, best_delta) = (None, 0)
+        for near_gateway in near_gateways:
+            if near_gateway != current_gateway:
+                delta = self.__bandwidth_variation(current_gateway, near_gateway)
+                if best_gateway is None or delta > best_delta:
+                    (best_gateway, best_delta) = (near_gateway, delta)
+        return (best_gateway, best_delta)
+
+    def get_variation(self, space, gateway):
+        """
+        Return the variation of the bandwidth of the device's type, if it moved to the given gateway.\n
+        The gateway must be able to reach the device.
+        """
+        if gateway not in space.get_near_gateways(self):
+            raise ValueError("The gateway is not able to reach the device.")
+        current_gateway = space.get_device_gateway(self)
+        return 0 if gateway == current_gateway else self.__bandwidth_variation(current_gateway, gateway)
+
     def set_gateway_callback(self, gateway_callback):
         self.__gateway_callback = gateway_callback
 
     ID = property(lambda self: self.__ID)
     type = property(lambda self: self.__type)
 
-def update_bandwidth(gateways):
+def bandwidth_variation(n1, m1, w1, n2, m2, w2):
+    """
+    Return the variation of the bandwidth of a device's type, when the device moves from a gateway to another.\n
+    n1 and m1 are the devices of the same and of the other type connected to the starting gateway, device included,
+    n2 and m2 are the ones connected to the destination gateway, and w1 and w2 are the bandwidths of the two gateways.
+    """
+    if n1 + m1 == 1 and n2 + m2 == 0:
+        return 0
+    elif n1 + m1 == 1 and n2 + m2 > 0:
+        return (n2 + 1) * w2 / (n2 + m2 + 1) - (n1 * w1 / (n1 + m1) + n2 * w2 / (n2 + m2))
+    elif n1 + m1 > 1 and n2 + m2 == 0:
+        return (n1 - 1) * w1 / (n1 + m1 - 1) + (n2 + 1) * w2 / (m2 + n2 + 1) - n1 * w1 / (n1 + m1)
+    else:
+        return  (n1 - 1) * w1 / (n1 + m1 - 1) + (n2 + 1) * w2 / (n2 + m2 + 1) - n1 * w1 / (n1 + m1) - n2 * w2 / (n2 + m2)
+
+def marginal_values(n, m, w):
+    """
+    Return the variations (join, leave) of the bandwidth of a type, when a device of that type connects to a gateway
+    of bandwidth w, having n devices of the type and m of the other one, and when one of the n devices disconnects from it.
+    """
+    join = (n + 1) * w / (n + m + 1) - (n * w / (n + m) if n + m > 0 else 0)
+    if n == 0:
+        return (join, 0)
+    leave = ((n - 1) * w / (n + m - 1) if n + m > 1 else 0) - n * w / (n + m)
+    return (join, leave)
+
+def get_payoffs(gateways):
+    """
+    Return the total bandwidth (WA, WB) of the type A and type B devices connected to the gateways.
+    """
     payoff_a = 0
     payoff_b = 0
     for gateway in gateways:
@@ -273,7 +892,392 @@ def update_bandwidth(gateways):
         device_bandwidth = gateway.bandwidth / (n + m)
         payoff_a += device_bandwidth * n
         payoff_b += device_bandwidth * m
-    print("WA = {0:.2f} WB = {0:.2f}".format(payoff_a, payoff_b))
+    return (payoff_a, payoff_b)
+
+def update_bandwidth(gateways):
+    (payoff_a, payoff_b) = get_payoffs(gateways)
+    print("WA = {0:.2f} WB = {1:.2f}".format(payoff_a, payoff_b))
+
+class PayoffTracker(object):
+    """
+    This class keeps the total bandwidth (WA, WB) of the type A and type B devices up to date,
+    listening to the counters of the gateways: each connection or disconnection only updates the share of its gateway.\n
+    The recorded payoffs form a time series, for example one point for each round or each move.
+    """
+    def __init__(self, gateways):
+        """
+        Initialize the tracker given the gateways, computing their current shares, and start listening to them.
+        """
+        self.__gateways = list(gateways)
+        self.__shares = {} # Bandwidth of the type A and type B devices connected to each gateway.
+        self.__payoff_a = 0
+        self.__payoff_b = 0
+        self.__series_a = array("d") # Recorded payoffs.
+        self.__series_b = array("d")
+        self.refresh()
+        for gateway in self.__gateways:
+            gateway.add_counter_callback(self.__update)
+
+    def __share(self, gateway):
+        # Return the bandwidth of the type A and type B devices connected to the gateway.
+        n = gateway.get_device_count(DeviceType.TYPE_A)
+        m = gateway.get_device_count(DeviceType.TYPE_B)
+        if n + m == 0:
+            return (0, 0)
+        device_bandwidth = gateway.bandwidth / (n + m)
+        return (device_bandwidth * n, device_bandwidth * m)
+
+    def __update(self, gateway):
+        # Replace the share of the gateway whose counters changed.
+        (old_a, old_b) = self.__shares[gateway]
+        (new_a, new_b) = self.__share(gateway)
+        self.__shares[gateway] = (new_a, new_b)
+        self.__payoff_a += new_a - old_a
+        self.__payoff_b += new_b - old_b
+
+    def refresh(self):
+        """
+        Compute again every share and the totals from the counters, discarding the rounding errors of the updates.
+        """
+        self.__shares = {gateway: self.__share(gateway) for gateway in self.__gateways}
+        self.__payoff_a = sum(share[0] for share in self.__shares.values())
+        self.__payoff_b = sum(share[1] for share in self.__shares.values())
+
+    def get_share(self, gateway):
+        """
+        Return the bandwidth (A, B) of the type A and type B devices connected to the gateway.
+        """
+        if gateway not in self.__shares:
+            raise ValueError("The gateway is not tracked.")
+        return self.__shares[gateway]
+
+    def record(self):
+        """
+        Append the current payoffs to the time series, and return them as (WA, WB).
+        """
+        self.__series_a.append(self.__payoff_a)
+        self.__series_b.append(self.__payoff_b)
+        return (self.__payoff_a, self.__payoff_b)
+
+    def close(self):
+        """
+        Stop listening to the gateways.
+        """
+        for gateway in self.__gateways:
+            gateway.remove_counter_callback(self.__update)
+
+    payoffs = property(lambda self: (self.__payoff_a, self.__payoff_b))
+    series = property(lambda self: (self.__series_a, self.__series_b))
+
+class CancellationToken(object):
+    """
+    This class lets another thread, or a signal handler, stop, pause and resume a solver, which checks it between its rounds.\n
+    Stopping and pausing are cooperative: the current round ends first, so the assignment is always consistent,
+    and a stopped solver runs again from its current assignment.
+    """
+    def __init__(self):
+        """
+        Initialize the token, neither cancelled nor paused.
+        """
+        self.__cancelled = threading.Event()
+        self.__running = threading.Event() # Set unless paused.
+        self.__running.set()
+
+    def cancel(self):
+        """
+        Ask the solver to stop at the end of its current round, waking it up if it is paused.
+        """
+        self.__cancelled.set()
+        self.__running.set()
+
+    def pause(self):
+        """
+        Ask the solver to wait at the end of its current round, until it is resumed or cancelled.
+        """
+        self.__running.clear()
+
+    def resume(self):
+        """
+        Let a paused solver go on.
+        """
+        self.__running.set()
+
+    def reset(self):
+        """
+        Clear the cancellation and the pause, to run the solver again.
+        """
+        self.__cancelled.clear()
+        self.__running.set()
+
+    def checkpoint(self):
+        """
+        Wait while the token is paused, then return True if the solver can go on, False if it was cancelled.
+        """
+        if not self.__running.is_set():
+            self.__running.wait()
+        return not self.__cancelled.is_set()
+
+    def interrupt(self, signum, frame):
+        """
+        Cancel the token, with the signature of a signal handler.
+        """
+        self.cancel()
+
+    cancelled = property(lambda self: self.__cancelled.is_set())
+    paused = property(lambda self: not self.__running.is_set())
+
+class SolverThread(object):
+    """
+    This class runs a solver on a thread of its own, controlled through a cancellation token.\n
+    The solver is any object with a method run(token=token, ...) checking the token between its rounds, as BestResponseDynamics:
+    a stopped solver keeps its state, so starting the thread again resumes from the current assignment.
+    """
+    def __init__(self, solver, **arguments):
+        """
+        Initialize the thread given the solver and the keyword arguments of its method run, such as max_rounds.
+        """
+        self.__solver = solver
+        self.__arguments = arguments
+        self.__token = CancellationToken()
+        self.__thread = None
+        self.__rounds = 0 # Rounds run by the solver, over every start.
+        self.__error = None # Exception raised by the solver, if any.
+
+    def __run(self):
+        # Run the solver, keeping its exception for the thread that joins.
+        try:
+            self.__rounds += self.__solver.run(token=self.__token, **self.__arguments)
+        except Exception as error:
+            self.__error = error
+
+    def start(self):
+        """
+        Start the solver, or resume it from its current assignment after a stop.
+        """
+        if self.alive:
+            raise RuntimeError("The solver is already running.")
+        self.__token.reset()
+        self.__error = None
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def pause(self):
+        """
+        Pause the solver at the end of its current round.
+        """
+        self.__token.pause()
+
+    def resume(self):
+        """
+        Resume a paused solver.
+        """
+        self.__token.resume()
+
+    def join(self, timeout=None):
+        """
+        Wait for the solver to finish, at most timeout seconds, and return True if it finished.
+        The exception raised by the solver, if any, is raised again.
+        """
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        if self.__error is not None:
+            raise self.__error
+        return not self.alive
+
+    def stop(self, timeout=None):
+        """
+        Ask the solver to stop at the end of its current round, wait for it at most timeout seconds,
+        and return True if it stopped.
+        """
+        self.__token.cancel()
+        return self.join(timeout)
+
+    solver = property(lambda self: self.__solver)
+    token = property(lambda self: self.__token)
+    rounds = property(lambda self: self.__rounds)
+    alive = property(lambda self: self.__thread is not None and self.__thread.is_alive())
+
+class BestResponseDynamics(object):
+    """
+    This class runs the best-response dynamics of a set of devices, re-evaluating only the devices whose neighborhood changed.\n
+    A device is dirty until it is evaluated against the current gateways' counters: when it moves,
+    every device reached by its starting or destination gateway becomes dirty again.
+    The dirty devices are evaluated in a fixed order, so a round follows the same path of a sweep over all the devices.
+    The dynamics reach a Nash equilibrium exactly when no device is dirty.
+    The state (assignment and dirty devices) is hashed at the end of each round, to detect the cycles.\n
+    An optional recorder receives each move, through its method move(round, device, starting_gateway, destination_gateway, variation),
+    and each round, through its method end_round(round, moves, dirty).\n
+    Between the rounds, devices can join and leave the dynamics, as they join and leave the space: only their neighborhood
+    becomes dirty, so the next rounds restore the equilibrium starting from the current assignment.
+    """
+    def __init__(self, space, devices, recorder=None, argmax=False):
+        """
+        Initialize the dynamics given the space and the devices allowed to change gateway, all of them initially dirty,
+        and an optional recorder of the trajectory.\n
+        If argmax is True, each device moves to its best gateway, instead of scanning the candidates in order.
+        """
+        self.__space = space
+        self.__devices = list(devices)
+        self.__order = {device: index for (index, device) in enumerate(self.__devices)} # Position of each device in the evaluation order.
+        self.__worklist = set(range(len(self.__devices))) # Positions of the dirty devices.
+        self.__neighbors = {} # Positions of the devices reached by each gateway, cached on demand.
+        self.__heap = None # Positions of the dirty devices still to evaluate in the current round.
+        self.__position = -1 # Position of the last device evaluated in the current round.
+        self.__assignment_hash = 0 # Hash of the current assignment, updated at each move.
+        for device in devices:
+            self.__assignment_hash ^= hash((device, space.get_device_gateway(device)))
+        self.__states = {} # Hash of the state at the end of each round.
+        self.__rounds = 0
+        self.__moves = 0
+        self.__round_moves = 0 # Moves of the current round.
+        self.__cycle = None # Length of the detected cycle, in rounds.
+        self.__recorder = recorder
+        self.__argmax = argmax
+
+    def pending(self):
+        """
+        Yield the dirty devices to evaluate in this round, in their evaluation order.\n
+        The devices that become dirty during the round are yielded too, if they follow the last evaluated one.
+        """
+        self.__heap = list(self.__worklist)
+        heapify(self.__heap)
+        self.__position = -1
+        while self.__heap:
+            position = heappop(self.__heap)
+            if position > self.__position and position in self.__worklist:
+                self.__position = position
+                yield self.__devices[position]
+        self.__heap = None
+
+    def add_device(self, device):
+        """
+        Let a device, just placed in the space, join the dynamics: the device and the ones reached by its gateway become dirty.
+        """
+        if device in self.__order:
+            raise ValueError("The device is already in the dynamics.")
+        gateway = self.__space.get_device_gateway(device)
+        self.__order[device] = len(self.__devices)
+        self.__devices.append(device)
+        self.__assignment_hash ^= hash((device, gateway))
+        self.__forget_neighbors(self.__space.get_near_gateways(device))
+        self.__worklist.add(self.__order[device])
+        self.mark_dirty((gateway,))
+
+    def remove_device(self, device):
+        """
+        Let a device leave the dynamics, before it is removed from the space: the devices reached by its gateway become dirty.
+        """
+        if device not in self.__order:
+            raise ValueError("The device is not in the dynamics.")
+        gateway = self.__space.get_device_gateway(device)
+        position = self.__order.pop(device)
+        self.__devices[position] = None # The positions of the other devices don't change.
+        self.__worklist.discard(position)
+        self.__assignment_hash ^= hash((device, gateway))
+        self.__forget_neighbors(self.__space.get_near_gateways(device))
+        self.mark_dirty((gateway,))
+
+    def mark_dirty(self, gateways):
+        """
+        Mark as dirty the devices reached by the given gateways, whose counters changed outside of the dynamics.\n
+        The states reached so far are forgotten, since the game changed.
+        """
+        for gateway in gateways:
+            self.__worklist |= self.__get_neighbors(gateway)
+        self.__states.clear()
+        self.__cycle = None
+
+    def __forget_neighbors(self, gateways):
+        # Drop the cached neighbors of the gateways, after a device joined or left their reach.
+        for gateway in gateways:
+            self.__neighbors.pop(gateway, None)
+
+    def evaluate(self, device):
+        """
+        Let a device select its gateway, and mark as dirty the neighborhood of the gateways it leaves and joins.\n
+        Return 1 if the device changed gateway, 0 otherwise.
+        """
+        self.__worklist.discard(self.__order[device]) # The device is evaluated against the current counters.
+        starting_gateway = self.__space.get_device_gateway(device)
+        if not device.gateway_selection(self.__space, argmax=self.__argmax):
+            return 0
+        destination_gateway = self.__space.get_device_gateway(device)
+        if self.__recorder is not None: # Moving back would undo the variation of the whole move.
+            n1 = destination_gateway.get_device_count(device.type)
+            n2 = starting_gateway.get_device_count(device.type)
+            variation = -bandwidth_variation(n1, destination_gateway.devices_count - n1, destination_gateway.bandwidth,
+                                             n2, starting_gateway.devices_count - n2, starting_gateway.bandwidth)
+            self.__recorder.move(self.__rounds + 1, device, starting_gateway, destination_gateway, variation)
+        self.__assignment_hash ^= hash((device, starting_gateway)) ^ hash((device, destination_gateway))
+        for gateway in (starting_gateway, destination_gateway):
+            dirty = self.__get_neighbors(gateway) - self.__worklist
+            self.__worklist |= dirty
+            if self.__heap is not None:
+                for position in dirty:
+                    if position > self.__position: # It is still in time for this round.
+                        heappush(self.__heap, position)
+        self.__moves += 1
+        self.__round_moves += 1
+        return 1
+
+    def __get_neighbors(self, gateway):
+        # Return the positions of the devices, among the dynamics' ones, that the gateway reaches.
+        neighbors = self.__neighbors.get(gateway)
+        if neighbors is None:
+            neighbors = frozenset(self.__order[device] for device in self.__space.get_covered_devices(gateway) if device in self.__order)
+            self.__neighbors[gateway] = neighbors
+        return neighbors
+
+    def end_round(self):
+        """
+        Close a round, checking if the state was already reached at the end of a previous round.
+        """
+        self.__rounds += 1
+        if self.__recorder is not None:
+            self.__recorder.end_round(self.__rounds, self.__round_moves, len(self.__worklist))
+        self.__round_moves = 0
+        state = (self.__assignment_hash, hash(frozenset(self.__worklist)))
+        if self.__worklist and state in self.__states: # The dynamics are deterministic, so they will repeat forever.
+            self.__cycle = self.__rounds - self.__states[state]
+        self.__states[state] = self.__rounds
+
+    def round(self):
+        """
+        Evaluate the dirty devices once, and return the number of devices that changed gateway.
+        """
+        changed = sum(self.evaluate(device) for device in self.pending())
+        self.end_round()
+        return changed
+
+    def run(self, max_rounds=None, token=None):
+        """
+        Run rounds until the equilibrium, a cycle or the maximum number of rounds, and return the number of rounds run.\n
+        If a cancellation token is given, it is checked before each round: the dynamics wait while it is paused,
+        and stop if it is cancelled, ready to run again from the current assignment.
+        """
+        rounds = 0
+        while not self.finished and (max_rounds is None or rounds < max_rounds) and (token is None or token.checkpoint()):
+            self.round()
+            rounds += 1
+        return rounds
+
+    def certificate(self):
+        """
+        Check every device, independently from the dirty ones, and return the certificate of the equilibrium as a dictionary:
+        whether it is a Nash equilibrium, and the device with the best deviation, its gateway and the bandwidth variation.
+        """
+        (best_device, best_gateway, best_delta) = (None, None, 0)
+        for device in self.__order:
+            (gateway, delta) = device.best_deviation(self.__space)
+            if gateway is not None and (best_device is None or delta > best_delta):
+                (best_device, best_gateway, best_delta) = (device, gateway, delta)
+        return {"equilibrium": best_delta <= Device.TOLERANCE, "device": best_device, "gateway": best_gateway, "variation": best_delta}
+
+    converged = property(lambda self: len(self.__worklist) == 0)
+    finished = property(lambda self: self.converged or self.__cycle is not None)
+    cycle = property(lambda self: self.__cycle)
+    rounds = property(lambda self: self.__rounds)
+    moves = property(lambda self: self.__moves)
 
 def main():
     N = 100
@@ -290,26 +1294,24 @@ def main():
     for d in devices:
         space.add_element(d)
     
-    not_changed = 0
-    last_value = 0
-    counter = 0
-    while not_changed != len(devices):
-        not_changed = 0
-        for d in devices:
-            if not d.gateway_selection(space):
-                not_changed += 1
-        update_bandwidth(gateways)
-        if not_changed - 2 <= last_value and not_changed <= not_changed + 2:
-            counter += 1
-            if counter == 30:
-                update_bandwidth(gateways)
-                return
-        else:
-            last_value = not_changed
-            counter = 0
-        print(not_changed)
+    dynamics = BestResponseDynamics(space, devices)
+    payoffs = PayoffTracker(gateways)
+    token = CancellationToken()
+    handler = signal.signal(signal.SIGINT, token.interrupt) # Ctrl+C stops at the end of the round.
+    try:
+        while not dynamics.finished and token.checkpoint():
+            changed = dynamics.round()
+            print("WA = {0:.2f} WB = {1:.2f}".format(*payoffs.record()))
+            print(changed)
+    finally:
+        signal.signal(signal.SIGINT, handler)
     
-    print("FINITOOOOOO")
+    if token.cancelled:
+        print("Stopped after {} rounds.".format(dynamics.rounds))
+    elif dynamics.cycle is not None:
+        print("Cycle of {} rounds detected.".format(dynamics.cycle))
+    elif dynamics.certificate()["equilibrium"]:
+        print("FINITOOOOOO")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,476 @@
+import argparse
+import itertools
+import json
+import math
+import random
+import sys
+from array import array
+from gateway_selection import Device, DeviceType, bandwidth_variation, get_payoffs
+from gateway_selection_compressed import coverage_classes, expand_classes
+from gateway_selection_sweep import DEFAULTS, STRATEGIES, place_scenario
+
+WELFARE = (DeviceType.TYPE_A, DeviceType.TYPE_B) # Objective of the planners: the bandwidth of both types.
+
+def gateway_value(n, m, w, types=WELFARE):
+    """
+    Return the bandwidth of the given types of devices on a gateway of bandwidth w, having n type A devices and m type B ones.\n
+    The value is monotone in each count, so its extremes over a range of counts lie at the corners.
+    """
+    if n + m == 0:
+        return 0
+    return w * ((n if DeviceType.TYPE_A in types else 0) + (m if DeviceType.TYPE_B in types else 0)) / (n + m)
+
+def potential(gateways, types):
+    """
+    Return the exact potential of the game where only the devices of the given types change gateway.\n
+    When a single type moves, each move changes the bandwidth of that type exactly by the variation of the device,
+    so the bandwidth is a potential; when both types move, the dynamics can cycle and no potential exists.
+    """
+    if len(set(types)) != 1:
+        raise ValueError("The game has an exact potential only when the devices of a single type move.")
+    (payoff_a, payoff_b) = get_payoffs(gateways)
+    return payoff_a if types[0] == DeviceType.TYPE_A else payoff_b
+
+class PotentialRecorder(object):
+    """
+    This class follows the potential during the best-response dynamics, given as their recorder:
+    the variation of each move is the variation of the potential, so the value is never computed again.
+    """
+    def __init__(self, gateways, types):
+        """
+        Initialize the recorder given the gateways and the types of the moving devices, from the current potential.
+        """
+        self.__value = potential(gateways, types)
+        self.__series = array("d", [self.__value]) # Potential at the end of each round.
+
+    def move(self, round, device, starting_gateway, destination_gateway, variation):
+        """
+        Add the variation of a move.
+        """
+        self.__value += variation
+
+    def end_round(self, round, moves, dirty):
+        """
+        Record the potential at the end of a round.
+        """
+        self.__series.append(self.__value)
+
+    value = property(lambda self: self.__value)
+    series = property(lambda self: self.__series)
+
+def compositions(total, parts):
+    """
+    Yield every tuple of parts non-negative integers summing to total.
+    """
+    if parts == 1:
+        yield (total,)
+        return
+    for first in range(total, -1, -1):
+        for rest in compositions(total - first, parts - 1):
+            yield (first,) + rest
+
+class EquilibriumAnalysis(object):
+    """
+    This class analyses the assignments of the movable devices of a scenario, the other devices staying on their gateways.\n
+    An assignment gives, for each coverage class, how many of its devices connect to each of its gateways: the devices of a class
+    are interchangeable, so the search never visits two assignments differing only by a permutation of them.\n
+    The exact searches are a branch and bound over the classes, bounding the value of each gateway still reachable
+    by the corners of its counters, and checking the equilibrium of a class as soon as all its gateways are settled.
+    The heuristics (annealing and best responses from random assignments) give bounds for the instances too large to search.
+    On small instances, the searches can be checked against the enumeration of every assignment.
+    """
+    EPSILON = 1e-9 # Smallest improvement of the incumbent [Mbps].
+    CHECK_ASSIGNMENTS = 100000 # Largest number of assignments enumerated by default to check the searches.
+
+    def __init__(self, space, devices):
+        """
+        Initialize the analysis given the space and the devices allowed to change gateway, from the current assignment.
+        """
+        (_, gateways, _, _) = space.get_coverage_graph()
+        self.__space = space
+        self.__gateways = list(gateways)
+        gateway_index = {gateway: index for (index, gateway) in enumerate(self.__gateways)}
+        self.__bandwidths = [gateway.bandwidth for gateway in self.__gateways]
+        # Counters of the fixed devices, by type (0 for A, 1 for B) and gateway.
+        self.__fixed = ([gateway.get_device_count(DeviceType.TYPE_A) for gateway in self.__gateways],
+                        [gateway.get_device_count(DeviceType.TYPE_B) for gateway in self.__gateways])
+        self.__classes = []
+        current = []
+        for (type, near_gateways, members) in coverage_classes(space, devices):
+            indices = tuple(gateway_index[gateway] for gateway in near_gateways)
+            counts = [0] * len(indices)
+            for device in members:
+                position = next(position for (position, gateway) in enumerate(near_gateways) if device in gateway)
+                counts[position] += 1
+                self.__fixed[type - DeviceType.TYPE_A][indices[position]] -= 1
+            self.__classes.append((type - DeviceType.TYPE_A, indices, members))
+            current.append(tuple(counts))
+        self.__current = tuple(current)
+
+    def __counts(self, assignment):
+        # Return the counters (A, B) of the gateways for an assignment.
+        counts = (list(self.__fixed[0]), list(self.__fixed[1]))
+        for ((type, indices, _), composition) in zip(self.__classes, assignment):
+            own = counts[type]
+            for (gateway, count) in zip(indices, composition):
+                own[gateway] += count
+        return counts
+
+    def __variation(self, counts, type, starting, destination):
+        # Return the variation of the bandwidth of the type, when one of its devices moves between two gateways.
+        (own, other) = (counts[type], counts[1 - type])
+        return bandwidth_variation(own[starting], other[starting], self.__bandwidths[starting],
+                                   own[destination], other[destination], self.__bandwidths[destination])
+
+    def __class_stable(self, counts, index, composition):
+        # Check that no device of the class has an improving move.
+        (type, indices, _) = self.__classes[index]
+        for (starting, count) in zip(indices, composition):
+            if count > 0:
+                for destination in indices:
+                    if destination != starting and self.__variation(counts, type, starting, destination) > Device.TOLERANCE:
+                        return False
+        return True
+
+    def value(self, assignment, objective=WELFARE):
+        """
+        Return the bandwidth of the objective's types for an assignment.
+        """
+        (counts_a, counts_b) = self.__counts(assignment)
+        return sum(gateway_value(n, m, w, objective) for (n, m, w) in zip(counts_a, counts_b, self.__bandwidths))
+
+    def is_equilibrium(self, assignment):
+        """
+        Check if no movable device has an improving move in the assignment.
+        """
+        counts = self.__counts(assignment)
+        return all(self.__class_stable(counts, index, composition) for (index, composition) in enumerate(assignment))
+
+    def bound(self, objective=WELFARE, maximize=True):
+        """
+        Return a bound of the value of every assignment: no assignment is better, if maximizing, or worse, otherwise.
+        """
+        remaining = ([0] * len(self.__gateways), [0] * len(self.__gateways))
+        for (type, indices, members) in self.__classes:
+            for gateway in indices:
+                remaining[type][gateway] += len(members)
+        return sum(self.__extreme(n, m, w, remaining_a, remaining_b, objective, maximize)
+                   for (n, m, w, remaining_a, remaining_b) in zip(*self.__fixed, self.__bandwidths, *remaining))
+
+    def __extreme(self, n, m, w, remaining_a, remaining_b, objective, maximize):
+        # Return the extreme value of a gateway, adding up to the remaining devices of each type.
+        corners = [gateway_value(n + a, m + b, w, objective) for a in {0, remaining_a} for b in {0, remaining_b}]
+        return max(corners) if maximize else min(corners)
+
+    def __search(self, objective, maximize, equilibrium, max_nodes, incumbent):
+        # Branch and bound over the classes; return the best (value, assignment), or (None, None) if there is none.
+        sign = 1 if maximize else -1
+        classes = self.__classes
+        size = len(classes)
+        counts = (list(self.__fixed[0]), list(self.__fixed[1]))
+        bandwidths = self.__bandwidths
+        values = [gateway_value(n, m, w, objective) for (n, m, w) in zip(counts[0], counts[1], bandwidths)]
+        remaining = ([0] * len(bandwidths), [0] * len(bandwidths)) # Devices of the classes still to assign, by gateway.
+        last = [-1] * len(bandwidths) # Last class reaching each gateway.
+        for (index, (type, indices, members)) in enumerate(classes):
+            for gateway in indices:
+                remaining[type][gateway] += len(members)
+                last[gateway] = index
+        # Gateways still reachable before each class, and classes whose gateways are all settled after it.
+        open_gateways = [[gateway for gateway in range(len(bandwidths)) if last[gateway] >= index] for index in range(size + 1)]
+        checks = [[] for _ in range(size)]
+        for (index, (_, indices, _)) in enumerate(classes):
+            if indices:
+                checks[max(last[gateway] for gateway in indices)].append(index)
+        (best_value, best_assignment) = incumbent if incumbent is not None else (None, None)
+        assignment = [None] * size
+        nodes = 0
+
+        def visit(index, total):
+            nonlocal best_value, best_assignment, nodes
+            if index == size:
+                if best_value is None or sign * total > sign * best_value + EquilibriumAnalysis.EPSILON:
+                    (best_value, best_assignment) = (total, tuple(assignment))
+                return
+            if best_value is not None:
+                bound = total + sum(self.__extreme(counts[0][gateway], counts[1][gateway], bandwidths[gateway],
+                                                   remaining[0][gateway], remaining[1][gateway], objective, maximize) - values[gateway]
+                                    for gateway in open_gateways[index])
+                if sign * bound <= sign * best_value + EquilibriumAnalysis.EPSILON:
+                    return
+            (type, indices, members) = classes[index]
+            (own, own_remaining) = (counts[type], remaining[type])
+            for gateway in indices:
+                own_remaining[gateway] -= len(members)
+            for composition in compositions(len(members), len(indices)):
+                nodes += 1 # Each composition is a node, even if the equilibrium check discards it.
+                if max_nodes is not None and nodes > max_nodes:
+                    raise RuntimeError("The search exceeded the maximum number of nodes.")
+                change = 0
+                for (gateway, count) in zip(indices, composition):
+                    if count:
+                        own[gateway] += count
+                        value = gateway_value(counts[0][gateway], counts[1][gateway], bandwidths[gateway], objective)
+                        change += value - values[gateway]
+                        values[gateway] = value
+                assignment[index] = composition
+                if not equilibrium or all(self.__class_stable(counts, checked, assignment[checked]) for checked in checks[index]):
+                    visit(index + 1, total + change)
+                for (gateway, count) in zip(indices, composition):
+                    if count:
+                        own[gateway] -= count
+                        values[gateway] = gateway_value(counts[0][gateway], counts[1][gateway], bandwidths[gateway], objective)
+            for gateway in indices:
+                own_remaining[gateway] += len(members)
+
+        visit(0, sum(values))
+        return (best_value, best_assignment)
+
+    def optimum(self, objective=WELFARE, max_nodes=None, incumbent=None):
+        """
+        Return the (value, assignment) maximizing the bandwidth of the objective's types, searching every assignment.\n
+        An optional incumbent (value, assignment), such as the result of the annealing, prunes the search from the start.
+        If the search visits more than max_nodes nodes, a RuntimeError is raised.
+        """
+        return self.__search(objective, True, False, max_nodes, incumbent)
+
+    def best_equilibrium(self, objective=WELFARE, max_nodes=None, incumbent=None):
+        """
+        Return the Nash equilibrium (value, assignment) with the largest bandwidth of the objective's types, or (None, None)
+        if there is no equilibrium. If the search visits more than max_nodes nodes, a RuntimeError is raised.
+        """
+        return self.__search(objective, True, True, max_nodes, incumbent)
+
+    def worst_equilibrium(self, objective=WELFARE, max_nodes=None, incumbent=None):
+        """
+        Return the Nash equilibrium (value, assignment) with the smallest bandwidth of the objective's types, or (None, None)
+        if there is no equilibrium. If the search visits more than max_nodes nodes, a RuntimeError is raised.
+        """
+        return self.__search(objective, False, True, max_nodes, incumbent)
+
+    def assignments(self):
+        """
+        Return the number of assignments of the movable devices, up to the permutations of the devices of each class.
+        """
+        return math.prod(math.comb(len(members) + len(indices) - 1, len(indices) - 1) for (_, indices, members) in self.__classes)
+
+    def exhaustive(self, objective=WELFARE, max_assignments=None):
+        """
+        Visit every assignment and return the tuple (optimum, best equilibrium, worst equilibrium) of (value, assignment) pairs,
+        an equilibrium being (None, None) if there is none. If there are more than max_assignments assignments, a RuntimeError is raised.
+        """
+        if max_assignments is not None and self.assignments() > max_assignments:
+            raise RuntimeError("The instance has more than {} assignments.".format(max_assignments))
+        (optimum, best, worst) = ((None, None), (None, None), (None, None))
+        choices = [list(compositions(len(members), len(indices))) for (_, indices, members) in self.__classes]
+        for assignment in itertools.product(*choices):
+            value = self.value(assignment, objective)
+            if optimum[0] is None or value > optimum[0] + EquilibriumAnalysis.EPSILON:
+                optimum = (value, assignment)
+            if self.is_equilibrium(assignment):
+                if best[0] is None or value > best[0] + EquilibriumAnalysis.EPSILON:
+                    best = (value, assignment)
+                if worst[0] is None or value < worst[0] - EquilibriumAnalysis.EPSILON:
+                    worst = (value, assignment)
+        return (optimum, best, worst)
+
+    def check(self, objective=WELFARE, max_assignments=CHECK_ASSIGNMENTS):
+        """
+        Check that the exact searches find the values of the enumeration of every assignment, and return the result.\n
+        If there are more than max_assignments assignments, a RuntimeError is raised.
+        """
+        expected = self.exhaustive(objective, max_assignments)
+        found = (self.optimum(objective), self.best_equilibrium(objective), self.worst_equilibrium(objective))
+        for ((expected_value, _), (found_value, _)) in zip(expected, found):
+            if (expected_value is None) != (found_value is None):
+                return False
+            if expected_value is not None and abs(expected_value - found_value) > EquilibriumAnalysis.EPSILON:
+                return False
+        return True
+
+    def __random_assignment(self, rng):
+        # Return an assignment connecting each movable device to a random gateway of its class.
+        assignment = []
+        for (_, indices, members) in self.__classes:
+            composition = [0] * len(indices)
+            for _ in members:
+                composition[rng.randrange(len(indices))] += 1
+            assignment.append(tuple(composition))
+        return tuple(assignment)
+
+    def best_response(self, assignment, max_rounds=1000):
+        """
+        Run the best-response dynamics on the counters from an assignment, moving a device at a time to the first improving gateway,
+        and return the assignment reached, or None if it is not an equilibrium within the maximum number of rounds.
+        """
+        counts = self.__counts(assignment)
+        assignment = [list(composition) for composition in assignment]
+        for _ in range(max_rounds):
+            changed = False
+            for ((type, indices, _), composition) in zip(self.__classes, assignment):
+                (own, other) = (counts[type], counts[1 - type])
+                for position in range(len(indices)):
+                    moved = True
+                    while composition[position] > 0 and moved:
+                        moved = False
+                        for (destination, gateway) in enumerate(indices):
+                            starting = indices[position]
+                            if gateway != starting and self.__variation(counts, type, starting, gateway) > Device.TOLERANCE:
+                                (own[starting], own[gateway]) = (own[starting] - 1, own[gateway] + 1)
+                                (composition[position], composition[destination]) = (composition[position] - 1, composition[destination] + 1)
+                                (changed, moved) = (True, True)
+                                break
+            if not changed:
+                return tuple(tuple(composition) for composition in assignment)
+        return None
+
+    def sample_equilibria(self, starts=10, rng=None, max_rounds=1000):
+        """
+        Return the equilibria reached by the best responses from the current assignment and from random ones.
+        """
+        rng = rng if isinstance(rng, random.Random) else random.Random(rng)
+        equilibria = []
+        for start in range(starts + 1):
+            equilibrium = self.best_response(self.__current if start == 0 else self.__random_assignment(rng), max_rounds)
+            if equilibrium is not None:
+                equilibria.append(equilibrium)
+        return equilibria
+
+    def anneal(self, objective=WELFARE, steps=20000, rng=None, temperature=None):
+        """
+        Search a good assignment by simulated annealing, moving a random device at a time, and return the best (value, assignment) found.\n
+        The temperature [Mbps] falls linearly to zero; by default, it starts from a tenth of the largest bandwidth.
+        """
+        rng = rng if isinstance(rng, random.Random) else random.Random(rng)
+        temperature = temperature if temperature is not None else max(self.__bandwidths, default=1) / 10
+        movable = [index for (index, (_, indices, _)) in enumerate(self.__classes) if len(indices) > 1]
+        weights = list(itertools.accumulate(len(self.__classes[index][2]) for index in movable)) # A device at a time.
+        assignment = [list(composition) for composition in self.__current]
+        counts = self.__counts(assignment)
+        bandwidths = self.__bandwidths
+        value = self.value(assignment, objective)
+        (best_value, best_assignment) = (value, tuple(tuple(composition) for composition in assignment))
+        if not movable:
+            return (best_value, best_assignment)
+        for step in range(steps):
+            index = rng.choices(movable, cum_weights=weights)[0]
+            (type, indices, members) = self.__classes[index]
+            composition = assignment[index]
+            (member, starting) = (rng.randrange(len(members)), 0) # Find the gateway of a random device of the class.
+            while member >= composition[starting]:
+                member -= composition[starting]
+                starting += 1
+            destination = rng.randrange(len(indices) - 1)
+            destination += destination >= starting
+            (first, second) = (indices[starting], indices[destination])
+            before = gateway_value(counts[0][first], counts[1][first], bandwidths[first], objective) + \
+                     gateway_value(counts[0][second], counts[1][second], bandwidths[second], objective)
+            (counts[type][first], counts[type][second]) = (counts[type][first] - 1, counts[type][second] + 1)
+            change = gateway_value(counts[0][first], counts[1][first], bandwidths[first], objective) + \
+                     gateway_value(counts[0][second], counts[1][second], bandwidths[second], objective) - before
+            current_temperature = temperature * (1 - step / steps)
+            if change >= 0 or (current_temperature > 0 and rng.random() < math.exp(change / current_temperature)):
+                (composition[starting], composition[destination]) = (composition[starting] - 1, composition[destination] + 1)
+                value += change
+                if value > best_value + EquilibriumAnalysis.EPSILON:
+                    (best_value, best_assignment) = (value, tuple(tuple(composition) for composition in assignment))
+            else:
+                (counts[type][first], counts[type][second]) = (counts[type][first] + 1, counts[type][second] - 1)
+        return (best_value, best_assignment)
+
+    def apply(self, assignment):
+        """
+        Connect the movable devices of the space as in the assignment, moving as few of them as possible.
+        """
+        for (device, destination) in expand_classes(self.__classes, self.__gateways, assignment).items():
+            if device not in destination:
+                self.__space.get_device_gateway(device).disconnect_device(device)
+                destination.connect_device(device)
+
+    classes = property(lambda self: len(self.__classes))
+    current = property(lambda self: self.__current)
+
+def analyze(space, devices, objective=WELFARE, max_nodes=10000, starts=10, steps=20000, rng=None, check=False):
+    """
+    Analyse the current assignment of a scenario, where the given devices can change gateway, and return a dictionary:
+    the number of coverage classes, the current value of the objective and potential (if a single type moves), whether it is
+    an equilibrium, the optimum and the best and worst equilibria, the prices of anarchy and stability, and whether each one is exact.\n
+    The exact searches stop at max_nodes nodes: then the heuristics give the optimum found, with an upper bound,
+    and the best and worst of the sampled equilibria.\n
+    If check is True, "checked" tells whether the exact searches agree with the enumeration of every assignment,
+    or it is None when the instance is too large to enumerate.
+    """
+    rng = rng if isinstance(rng, random.Random) else random.Random(rng)
+    analysis = EquilibriumAnalysis(space, devices)
+    types = tuple(sorted({device.type for device in devices}))
+    result = {"classes": analysis.classes, "value": analysis.value(analysis.current, objective),
+              "potential": potential(space.get_coverage_graph()[1], types) if len(types) == 1 else None,
+              "equilibrium": analysis.is_equilibrium(analysis.current)}
+
+    incumbent = analysis.anneal(objective, steps=steps, rng=rng)
+    try:
+        (result["optimum"], _) = analysis.optimum(objective, max_nodes=max_nodes, incumbent=incumbent)
+        result["optimum_exact"] = True
+        result["optimum_bound"] = result["optimum"]
+    except RuntimeError:
+        result["optimum"] = incumbent[0]
+        result["optimum_exact"] = False
+        result["optimum_bound"] = analysis.bound(objective)
+
+    sampled = sorted((analysis.value(equilibrium, objective), equilibrium) for equilibrium in analysis.sample_equilibria(starts, rng))
+    try:
+        (result["best_equilibrium"], _) = analysis.best_equilibrium(objective, max_nodes=max_nodes, incumbent=sampled[-1] if sampled else None)
+        (result["worst_equilibrium"], _) = analysis.worst_equilibrium(objective, max_nodes=max_nodes, incumbent=sampled[0] if sampled else None)
+        result["equilibria_exact"] = True
+    except RuntimeError:
+        result["best_equilibrium"] = sampled[-1][0] if sampled else None
+        result["worst_equilibrium"] = sampled[0][0] if sampled else None
+        result["equilibria_exact"] = False
+
+    worst = result["worst_equilibrium"]
+    best = result["best_equilibrium"]
+    result["price_of_anarchy"] = result["optimum"] / worst if worst else None
+    result["price_of_stability"] = result["optimum"] / best if best else None
+    if check:
+        try:
+            result["checked"] = analysis.check(objective)
+        except RuntimeError:
+            result["checked"] = None
+    return result
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Compare the results of a sweep with the optimum and the equilibria of their scenarios.")
+    parser.add_argument("results", help="JSON lines file of the sweep results, - for the standard input")
+    parser.add_argument("--max-nodes", type=int, default=10000, help="nodes of each exact search before using the heuristics")
+    parser.add_argument("--starts", type=int, default=10, help="random starts of the sampled equilibria")
+    parser.add_argument("--steps", type=int, default=20000, help="steps of the annealing")
+    parser.add_argument("--check", action="store_true", help="check the exact searches against the enumeration of every assignment, on small instances")
+    parser.add_argument("--output", default="-", help="JSON lines file of the analyses, by default the standard output")
+    arguments = parser.parse_args(arguments)
+
+    source = sys.stdin if arguments.results == "-" else open(arguments.results)
+    output = sys.stdout if arguments.output == "-" else open(arguments.output, "w")
+    try:
+        for line in source:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            scenario = {name: result.get(name, value) for (name, value) in DEFAULTS.items()}
+            (space, gateways, devices) = place_scenario(scenario, result["seed"])
+            movable = [device for device in devices if device.type in STRATEGIES[scenario["strategies"]]]
+            analysis = analyze(space, movable, max_nodes=arguments.max_nodes, starts=arguments.starts, steps=arguments.steps, rng=result["seed"],
+                               check=arguments.check)
+            for name in ("value", "potential", "equilibrium"): # They describe the initial placement: the result holds the reached one.
+                analysis.pop(name)
+            analysis["reached"] = result["WA"] + result["WB"]
+            analysis["reached_ratio"] = analysis["optimum"] / analysis["reached"] if analysis["reached"] else None
+            output.write(json.dumps(dict(result, analysis=analysis)) + "\n")
+            output.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
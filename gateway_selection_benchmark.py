@@ -0,0 +1,148 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from gateway_selection import BestResponseDynamics, get_payoffs
+from gateway_selection_sweep import place_scenario
+try:
+    import resource
+except ImportError: # The peak of the resident memory is available only on Unix.
+    resource = None
+
+SIZES = { # Space side [m], gateways and devices of each type, from small to a million devices.
+    "small": (100, 50, 100),
+    "medium": (300, 400, 5000),
+    "large": (1000, 4000, 50000),
+    "huge": (3000, 40000, 500000)
+}
+
+REGIMES = { # Radius [m] of the gateways, and factor of the number of gateways, to keep the coverage comparable.
+    "sparse": (5, 4),
+    "dense": (25, 1)
+}
+
+BANDWIDTH = 100 # Bandwidth of the gateways [Mbps].
+
+def scenarios(sizes, regimes):
+    """
+    Return the benchmark scenarios, one for each combination of size and radius/density regime.
+    """
+    result = []
+    for size in sizes:
+        (side, gateways, devices) = SIZES[size]
+        for regime in regimes:
+            (radius, factor) = REGIMES[regime]
+            result.append({"name": "{}-{}".format(size, regime), "rows": side, "columns": side, "gateways": gateways * factor,
+                           "a_devices": devices, "b_devices": devices, "radius": radius, "bandwidth": BANDWIDTH})
+    return result
+
+def _measure(phases, name, memory, function, *arguments):
+    # Run a phase, storing its time and, if required, the peak of the memory it allocated.
+    if memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function(*arguments)
+    phases[name] = {"seconds": time.perf_counter() - start}
+    if memory:
+        phases[name]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    return result
+
+def _rounds(dynamics, max_rounds):
+    # Run the remaining best-response rounds.
+    return dynamics.run(max_rounds=max_rounds)
+
+def run_benchmark(scenario, seed=0, max_rounds=20, memory=False):
+    """
+    Run a scenario, timing separately the placement, the coverage graph, the first best-response round,
+    the following rounds (at most max_rounds) and the payoff aggregation.\n
+    If memory is True, the peak of the memory allocated by each phase is traced too, slowing down the run.
+    """
+    if memory:
+        tracemalloc.start()
+    phases = {}
+    (space, gateways, devices) = _measure(phases, "placement", memory, place_scenario, scenario, seed)
+    _measure(phases, "coverage", memory, space.get_coverage_graph)
+    dynamics = BestResponseDynamics(space, devices)
+    moves = _measure(phases, "first_round", memory, dynamics.round)
+    rounds = _measure(phases, "rounds", memory, _rounds, dynamics, max_rounds - 1)
+    _measure(phases, "payoffs", memory, get_payoffs, gateways)
+    if memory:
+        tracemalloc.stop()
+    result = {"scenario": scenario, "seed": seed, "phases": phases, "first_round_moves": moves, "rounds": rounds + 1,
+              "moves": dynamics.moves, "converged": dynamics.converged, "cycle": dynamics.cycle}
+    if resource is not None:
+        result["max_rss_kilobytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def _run_task(task):
+    # Unpack the arguments of a benchmark for the pool.
+    return run_benchmark(*task)
+
+def _commit():
+    # Return the current git commit, if any.
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """
+    Return the phases whose time grew more than threshold times with respect to the baseline, as (scenario, phase, before, after).
+    """
+    before = {(result["scenario"]["name"], result["seed"]): result["phases"] for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        key = (result["scenario"]["name"], result["seed"])
+        for (phase, measure) in result["phases"].items():
+            if key in before and phase in before[key]:
+                (old, new) = (before[key][phase]["seconds"], measure["seconds"])
+                if new > old * threshold:
+                    regressions.append((key[0], phase, old, new))
+    return regressions
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the placement, the best-response rounds and the payoffs of the gateway selection game.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"], help="sizes of the scenarios")
+    parser.add_argument("--regimes", nargs="+", choices=list(REGIMES), default=list(REGIMES), help="radius/density regimes")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0], help="seeds of the scenarios")
+    parser.add_argument("--max-rounds", type=int, default=20, help="best-response rounds to time")
+    parser.add_argument("--memory", action="store_true", help="trace the peak memory of each phase")
+    parser.add_argument("--output", default="-", help="JSON file of the results, by default the standard output")
+    parser.add_argument("--compare", default=None, help="JSON file of a previous run, to report the regressions")
+    parser.add_argument("--threshold", type=float, default=1.5, help="slowdown of a phase reported as a regression")
+    arguments = parser.parse_args(arguments)
+
+    tasks = [(scenario, seed, arguments.max_rounds, arguments.memory)
+             for scenario in scenarios(arguments.sizes, arguments.regimes) for seed in arguments.seeds]
+    # Each benchmark runs in a fresh process, so that the peak memory is its own.
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        runs = []
+        for result in pool.imap(_run_task, tasks):
+            runs.append(result)
+            print("{} seed {}: {}".format(result["scenario"]["name"], result["seed"],
+                  ", ".join("{} {:.3f} s".format(phase, measure["seconds"]) for (phase, measure) in result["phases"].items())), file=sys.stderr)
+    results = {"commit": _commit(), "python": platform.python_version(), "results": runs}
+
+    if arguments.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if arguments.compare is not None:
+        with open(arguments.compare) as baseline:
+            regressions = compare(results, json.load(baseline), arguments.threshold)
+        for (name, phase, old, new) in regressions:
+            print("Regression in {} {}: {:.3f} s -> {:.3f} s".format(name, phase, old, new), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
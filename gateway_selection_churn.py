@@ -0,0 +1,156 @@
+import argparse
+import json
+import random
+import time
+from gateway_selection import BestResponseDynamics, Device, DeviceType
+from gateway_selection_sweep import DEFAULTS, STRATEGIES, place_scenario
+
+JOIN = "join" # A new device is placed and connects to a gateway.
+LEAVE = "leave" # A device is removed from the space.
+MOVE = "move" # A device moves to another position, keeping its gateway if it still reaches it.
+EVENTS = (JOIN, LEAVE, MOVE)
+
+class ChurnSimulator(object):
+    """
+    This class keeps a scenario at the equilibrium while its devices join, leave and move.\n
+    Each event (kind, device, x, y) is applied to the space, then the best-response dynamics run again from the current
+    assignment: only the neighborhood of the event is dirty, and the evaluations spread only as far as the moves reach.
+    """
+    def __init__(self, space, devices, types=tuple(DeviceType), argmax=False):
+        """
+        Initialize the simulator given the space, the placed devices and the types of the devices allowed to change gateway.
+        """
+        self.__space = space
+        self.__types = tuple(types)
+        self.__present = [] # Devices in the space, to draw the events from.
+        self.__index = {} # Position of each device in the present list.
+        for device in devices:
+            self.__add(device)
+        self.__dynamics = BestResponseDynamics(space, [device for device in self.__present if device.type in self.__types], argmax=argmax)
+        self.__events = 0
+
+    def __add(self, device):
+        # Append the device to the present ones.
+        self.__index[device] = len(self.__present)
+        self.__present.append(device)
+
+    def __discard(self, device):
+        # Remove the device from the present ones, moving the last one in its place.
+        index = self.__index.pop(device)
+        last = self.__present.pop()
+        if last != device:
+            self.__present[index] = last
+            self.__index[last] = index
+
+    def solve(self, max_rounds=None):
+        """
+        Run the dynamics until the equilibrium, a cycle or the maximum number of rounds, and return the number of rounds run.
+        """
+        return self.__dynamics.run(max_rounds=max_rounds)
+
+    def apply(self, event, max_rounds=None):
+        """
+        Apply an event (kind, device, x, y) and restore the equilibrium, returning the tuple (rounds, moves) it took.\n
+        The position of a joining or moving device is drawn at random if it is omitted.
+        """
+        (kind, device, x, y) = event
+        moves = self.__dynamics.moves
+        movable = device.type in self.__types
+        if kind == JOIN:
+            self.__space.add_element(device, x=x, y=y)
+            self.__add(device)
+            if movable:
+                self.__dynamics.add_device(device)
+            else:
+                self.__dynamics.mark_dirty((self.__space.get_device_gateway(device),))
+        elif kind == LEAVE:
+            if device not in self.__index:
+                raise ValueError("The device is not present.")
+            if movable:
+                self.__dynamics.remove_device(device)
+            else:
+                self.__dynamics.mark_dirty((self.__space.get_device_gateway(device),))
+            self.__space.remove_element(device)
+            self.__discard(device)
+        elif kind == MOVE:
+            if device not in self.__index:
+                raise ValueError("The device is not present.")
+            if movable:
+                self.__dynamics.remove_device(device)
+                try:
+                    self.__space.move_element(device, x=x, y=y)
+                finally: # The device joins again, even if it could not move.
+                    self.__dynamics.add_device(device)
+            else:
+                starting_gateway = self.__space.get_device_gateway(device)
+                self.__space.move_element(device, x=x, y=y)
+                self.__dynamics.mark_dirty((starting_gateway, self.__space.get_device_gateway(device)))
+        else:
+            raise ValueError("Unsupported event {}.".format(kind))
+        self.__events += 1
+        rounds = self.__dynamics.run(max_rounds=max_rounds)
+        return (rounds, self.__dynamics.moves - moves)
+
+    def random_events(self, rng=None, weights=(1, 1, 1)):
+        """
+        Yield an endless stream of random events over the present devices, with the given weights of joining, leaving and moving.\n
+        Each event is drawn when requested, so it should be applied before the next one.
+        A joining device has a random type and the next ID of its type; the positions are drawn by the space.
+        """
+        rng = rng if isinstance(rng, random.Random) else random.Random(rng)
+        counters = {type: max((device.ID for device in self.__present if device.type == type), default=0) for type in DeviceType}
+        while True:
+            kind = rng.choices(EVENTS, weights)[0]
+            if kind == JOIN or len(self.__present) == 0:
+                type = rng.choice(tuple(DeviceType))
+                counters[type] += 1
+                yield (JOIN, Device(type, ID=counters[type]), None, None)
+            else:
+                yield (kind, self.__present[rng.randrange(len(self.__present))], None, None)
+
+    dynamics = property(lambda self: self.__dynamics)
+    devices = property(lambda self: tuple(self.__present))
+    events = property(lambda self: self.__events)
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Apply a stream of random churn events to a scenario, restoring the equilibrium after each one.")
+    parser.add_argument("--rows", type=int, default=DEFAULTS["rows"], help="height of the space [m]")
+    parser.add_argument("--columns", type=int, default=DEFAULTS["columns"], help="width of the space [m]")
+    parser.add_argument("--gateways", type=int, default=DEFAULTS["gateways"], help="number of gateways")
+    parser.add_argument("--a-devices", type=int, default=DEFAULTS["a_devices"], help="number of type A devices")
+    parser.add_argument("--b-devices", type=int, default=DEFAULTS["b_devices"], help="number of type B devices")
+    parser.add_argument("--bandwidth", type=int, default=DEFAULTS["bandwidth"], help="bandwidth of the gateways [Mbps]")
+    parser.add_argument("--radius", type=int, default=DEFAULTS["radius"], help="radius of the gateways [m]")
+    parser.add_argument("--strategies", choices=list(STRATEGIES), default=DEFAULTS["strategies"], help="devices allowed to move")
+    parser.add_argument("--max-rounds", type=int, default=DEFAULTS["max_rounds"], help="rounds before giving up the equilibrium")
+    parser.add_argument("--events", type=int, default=1000, help="number of churn events")
+    parser.add_argument("--weights", type=float, nargs=3, default=[1, 1, 1], metavar=("JOIN", "LEAVE", "MOVE"), help="weights of the events")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the placement and of the events")
+    arguments = parser.parse_args(arguments)
+
+    scenario = dict(DEFAULTS, rows=arguments.rows, columns=arguments.columns, gateways=arguments.gateways, a_devices=arguments.a_devices,
+                    b_devices=arguments.b_devices, bandwidth=arguments.bandwidth, radius=arguments.radius, strategies=arguments.strategies)
+    (space, gateways, devices) = place_scenario(scenario, arguments.seed)
+    simulator = ChurnSimulator(space, devices, types=STRATEGIES[arguments.strategies])
+    start = time.perf_counter()
+    cold_rounds = simulator.solve(max_rounds=arguments.max_rounds)
+    cold_seconds = time.perf_counter() - start
+
+    (rounds, moves, skipped) = (0, 0, 0)
+    events = simulator.random_events(rng=arguments.seed, weights=arguments.weights)
+    start = time.perf_counter()
+    for _ in range(arguments.events):
+        try:
+            (event_rounds, event_moves) = simulator.apply(next(events), max_rounds=arguments.max_rounds)
+        except ValueError: # The space has no free covered position left.
+            skipped += 1
+            continue
+        rounds += event_rounds
+        moves += event_moves
+    seconds = time.perf_counter() - start
+    print(json.dumps({"cold_rounds": cold_rounds, "cold_seconds": cold_seconds, "events": simulator.events, "skipped": skipped,
+                      "rounds": rounds, "moves": moves, "seconds_per_event": seconds / max(simulator.events, 1),
+                      "converged": simulator.dynamics.converged}))
+
+if __name__ == "__main__":
+    main()
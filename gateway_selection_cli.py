@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import signal
+import sys
+from gateway_selection import CancellationToken
+from gateway_selection_profiling import Profiler
+from gateway_selection_sweep import DEFAULTS, ENGINES, RECORDING_ENGINES, STRATEGIES, run_scenario
+try:
+    import tomllib
+except ImportError: # Python before 3.11 reads TOML only with the tomli package.
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+EXIT_EQUILIBRIUM = 0 # Every run reached the equilibrium.
+EXIT_NOT_CONVERGED = 1 # At least one run stopped on a cycle or at the maximum rounds.
+EXIT_INVALID = 2 # The configuration is not valid, as for the errors of the arguments.
+EXIT_CANCELLED = 130 # Interrupted by Ctrl+C, as a shell reports it: the results so far are written anyway.
+
+def load_config(path):
+    """
+    Load a configuration from a JSON or TOML file, chosen by its extension.\n
+    The file must hold a table of parameters.
+    """
+    if os.path.splitext(path)[1].lower() == ".toml":
+        if tomllib is None:
+            raise ValueError("Reading TOML files requires Python 3.11 or the tomli package.")
+        with open(path, "rb") as config:
+            config = tomllib.load(config)
+    else:
+        with open(path) as config:
+            config = json.load(config)
+    if not isinstance(config, dict):
+        raise ValueError("The configuration must be a table of parameters.")
+    return config
+
+def _is_integer(value):
+    # Check if a value is an integer, excluding the booleans.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def expand_config(config):
+    """
+    Return the (scenario, seed, trajectory) runs described by a configuration.\n
+    The configuration is a scenario, or holds a list of them under "scenarios": its other parameters are the defaults
+    of every scenario. The seeds are given by "seeds", a list, or by "seed"; a scenario can override them.
+    An optional "trajectories" directory records each run in a numbered subdirectory.\n
+    Every parameter is checked, so that a malformed configuration raises a ValueError.
+    """
+    if not isinstance(config, dict):
+        raise ValueError("The configuration must be a table of parameters.")
+    config = dict(config)
+    entries = config.pop("scenarios", [{}])
+    trajectories = config.pop("trajectories", None)
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError("The scenarios must be a list of tables of parameters.")
+    if trajectories is not None and not isinstance(trajectories, str):
+        raise ValueError("The trajectories must be the path of a directory.")
+    runs = []
+    for entry in entries:
+        parameters = dict(config)
+        parameters.update(entry)
+        seeds = parameters.pop("seeds", [parameters.pop("seed", 0)])
+        parameters.pop("seed", None)
+        if not isinstance(seeds, list) or not all(_is_integer(seed) for seed in seeds):
+            raise ValueError("The seeds must be a list of integers, and the seed an integer.")
+        for (name, value) in parameters.items():
+            if name not in DEFAULTS:
+                raise ValueError("Unsupported parameter {}.".format(name))
+            if isinstance(DEFAULTS[name], str) and not isinstance(value, str):
+                raise ValueError("The parameter {} must be a name.".format(name))
+            if _is_integer(DEFAULTS[name]) and not _is_integer(value):
+                raise ValueError("The parameter {} must be an integer.".format(name))
+        scenario = dict(DEFAULTS)
+        scenario.update(parameters)
+        if scenario["strategies"] not in STRATEGIES:
+            raise ValueError("Unsupported strategies {}.".format(scenario["strategies"]))
+        if scenario["engine"] not in ENGINES:
+            raise ValueError("Unsupported engine {}.".format(scenario["engine"]))
+        if trajectories is not None and scenario["engine"] not in RECORDING_ENGINES:
+            raise ValueError("Only the dynamics engines record the trajectory.")
+        for seed in seeds:
+            trajectory = os.path.join(trajectories, "{:06d}".format(len(runs))) if trajectories is not None else None
+            runs.append((scenario, seed, trajectory))
+    return runs
+
+def run_config(config, token=None):
+    """
+    Run every scenario of a configuration, in order, and return the list of their results.\n
+    If a cancellation token is given, the running scenario stops at the end of its round when it is cancelled,
+    and the following ones are not started: the results include the partial one.
+    """
+    results = []
+    for (scenario, seed, trajectory) in expand_config(config):
+        if token is not None and token.cancelled:
+            break
+        results.append(run_scenario(scenario, seed, trajectory=trajectory, token=token))
+    return results
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Run the gateway selection game without the window, from JSON or TOML configurations.")
+    parser.add_argument("configs", nargs="+", help="JSON or TOML files of the scenarios")
+    parser.add_argument("--engine", choices=ENGINES, default=None, help="solver of every scenario, instead of the configured one")
+    parser.add_argument("--strategies", choices=list(STRATEGIES), default=None, help="devices allowed to move, instead of the configured ones")
+    parser.add_argument("--output", default="-", help="JSON file of the results, by default the standard output")
+    parser.add_argument("--profile", action="store_true", help="add the counters of the solver's hot functions to the results")
+    parser.add_argument("--metrics", default=None, help="file where the counters are written in the Prometheus text format")
+    arguments = parser.parse_args(arguments)
+
+    overrides = {name: value for (name, value) in (("engine", arguments.engine), ("strategies", arguments.strategies)) if value is not None}
+    profiler = Profiler() if arguments.profile or arguments.metrics is not None else None
+    token = CancellationToken()
+    handler = signal.signal(signal.SIGINT, token.interrupt) # Ctrl+C stops the running scenario at the end of its round.
+    try:
+        results = []
+        if profiler is not None:
+            profiler.enable()
+        for path in arguments.configs:
+            if token.cancelled:
+                break
+            config = load_config(path)
+            config.update(overrides)
+            results.extend(run_config(config, token=token))
+    except (OSError, ValueError, KeyError) as error:
+        print("Invalid configuration: {}".format(error), file=sys.stderr)
+        sys.exit(EXIT_INVALID)
+    finally:
+        signal.signal(signal.SIGINT, handler)
+        if profiler is not None:
+            profiler.disable()
+
+    converged = all(result["converged"] for result in results)
+    document = {"converged": converged, "results": results}
+    if token.cancelled:
+        document["cancelled"] = True
+    if arguments.profile:
+        document["profile"] = profiler.report()
+    if arguments.metrics is not None:
+        with open(arguments.metrics, "w") as metrics:
+            metrics.write(profiler.prometheus())
+    if arguments.output == "-":
+        json.dump(document, sys.stdout, indent=2)
+        print()
+    else:
+        with open(arguments.output, "w") as output:
+            json.dump(document, output, indent=2)
+    if token.cancelled:
+        sys.exit(EXIT_CANCELLED)
+    sys.exit(EXIT_EQUILIBRIUM if converged else EXIT_NOT_CONVERGED)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+from array import array
+from gateway_selection import Device, DeviceType, bandwidth_variation
+
+def coverage_classes(space, devices):
+    """
+    Group the devices by type and set of reachable gateways: the devices of a class are interchangeable,
+    since the bandwidth of a type depends only on the counters of the gateways.\n
+    Return the list of (type, gateways, devices) classes, in order of first appearance.
+    """
+    classes = {}
+    for device in devices:
+        classes.setdefault((device.type, space.get_near_gateways(device)), []).append(device)
+    return [(type, gateways, members) for ((type, gateways), members) in classes.items()]
+
+def expand_classes(classes, gateways, compositions):
+    """
+    Return the gateway of each device, as a dictionary, for the given number of devices of each class on each of its gateways.\n
+    The classes are (type, gateway indices, devices) tuples: the devices stay on their current gateway as long as its count allows,
+    so that applying the result moves as few devices as possible.
+    """
+    assignment = {}
+    for ((_, indices, members), composition) in zip(classes, compositions):
+        class_gateways = [gateways[gateway] for gateway in indices]
+        surplus = list(composition) # Devices still to connect to each gateway.
+        moving = []
+        for device in members:
+            position = next(position for (position, gateway) in enumerate(class_gateways) if device in gateway)
+            if surplus[position] > 0:
+                surplus[position] -= 1
+                assignment[device] = class_gateways[position]
+            else:
+                moving.append(device)
+        positions = (position for (position, count) in enumerate(surplus) for _ in range(count))
+        for (device, position) in zip(moving, positions):
+            assignment[device] = class_gateways[position]
+    return assignment
+
+class CompressedGame(object):
+    """
+    This class runs the best-response dynamics on a game compressed into coverage classes, with their multiplicities.\n
+    The devices of the same type reaching the same gateways are interchangeable, so the state is the number of devices
+    of each class on each of its gateways, and a dense deployment has far fewer classes than devices.
+    A class moves k devices at once from a gateway to its best destination: as many as improve the bandwidth of their type
+    one after the other, so the path is the one of k single moves.\n
+    As in BestResponseDynamics, only the classes reaching a gateway whose counters changed are evaluated again,
+    and the state is hashed at the end of each round, to detect the cycles.
+    """
+    def __init__(self, space, devices):
+        """
+        Initialize the game given the space and the devices allowed to change gateway, from their current connections.
+        The other devices stay on their gateways.
+        """
+        (_, gateways, _, _) = space.get_coverage_graph()
+        self.__space = space
+        self.__gateways = list(gateways)
+        gateway_index = {gateway: index for (index, gateway) in enumerate(self.__gateways)}
+        self.__bandwidths = array("d", [gateway.bandwidth for gateway in self.__gateways])
+        # Number of devices of each type (0 for A, 1 for B) connected to each gateway.
+        self.__counts = (array("l", [gateway.get_device_count(DeviceType.TYPE_A) for gateway in self.__gateways]),
+                         array("l", [gateway.get_device_count(DeviceType.TYPE_B) for gateway in self.__gateways]))
+        self.__classes = []
+        self.__compositions = [] # Devices of each class on each of its gateways.
+        self.__reaching = [[] for _ in self.__gateways] # Classes reaching each gateway.
+        for (type, near_gateways, members) in coverage_classes(space, devices):
+            indices = tuple(gateway_index[gateway] for gateway in near_gateways)
+            composition = array("l", [0] * len(indices))
+            for device in members:
+                composition[next(position for (position, gateway) in enumerate(near_gateways) if device in gateway)] += 1
+            for gateway in indices:
+                self.__reaching[gateway].append(len(self.__classes))
+            self.__classes.append((type - DeviceType.TYPE_A, indices, members))
+            self.__compositions.append(composition)
+        self.__devices = sum(len(members) for (_, _, members) in self.__classes)
+        self.__worklist = set(range(len(self.__classes))) # Dirty classes.
+        self.__states = {} # Hash of the state at the end of each round.
+        self.__rounds = 0
+        self.__moves = 0 # Devices moved.
+        self.__transfers = 0 # Groups of devices moved at once.
+        self.__cycle = None
+
+    def __variation(self, own, other, starting, destination):
+        # Return the variation of the bandwidth of a type, when one of its devices moves between two gateways.
+        return bandwidth_variation(own[starting], other[starting], self.__bandwidths[starting],
+                                   own[destination], other[destination], self.__bandwidths[destination])
+
+    def evaluate(self, index):
+        """
+        Let the devices of a class move until none of them improves, marking as dirty the classes reaching the gateways involved.
+        Return the number of devices moved.
+        """
+        self.__worklist.discard(index)
+        (type, indices, _) = self.__classes[index]
+        composition = self.__compositions[index]
+        (own, other) = (self.__counts[type], self.__counts[1 - type])
+        (moved, touched, changed) = (0, set(), True)
+        while changed:
+            changed = False
+            for (position, starting) in enumerate(indices):
+                if composition[position] == 0:
+                    continue
+                (best, best_delta) = (None, Device.TOLERANCE)
+                for (candidate, destination) in enumerate(indices):
+                    if destination != starting:
+                        delta = self.__variation(own, other, starting, destination)
+                        if delta > best_delta:
+                            (best, best_delta) = (candidate, delta)
+                if best is None:
+                    continue
+                destination = indices[best]
+                count = 0
+                while composition[position] > 0 and self.__variation(own, other, starting, destination) > Device.TOLERANCE:
+                    own[starting] -= 1
+                    own[destination] += 1
+                    count += 1
+                    composition[position] -= 1
+                composition[best] += count
+                moved += count
+                self.__transfers += 1
+                touched.update((starting, destination))
+                changed = True
+        for gateway in touched:
+            self.__worklist.update(self.__reaching[gateway])
+        self.__worklist.discard(index) # The class is stable against the current counters.
+        self.__moves += moved
+        return moved
+
+    def round(self):
+        """
+        Evaluate the dirty classes once, in order, and return the number of devices moved.
+        """
+        moved = sum(self.evaluate(index) for index in sorted(self.__worklist))
+        self.__rounds += 1
+        state = (hash(tuple(bytes(composition) for composition in self.__compositions)), hash(frozenset(self.__worklist)))
+        if self.__worklist and state in self.__states: # The dynamics are deterministic, so they will repeat forever.
+            self.__cycle = self.__rounds - self.__states[state]
+        self.__states[state] = self.__rounds
+        return moved
+
+    def run(self, max_rounds=None, token=None):
+        """
+        Run rounds until the equilibrium, a cycle or the maximum number of rounds, and return the number of rounds run.
+        An optional cancellation token is checked before each round.
+        """
+        rounds = 0
+        while not self.finished and (max_rounds is None or rounds < max_rounds) and (token is None or token.checkpoint()):
+            self.round()
+            rounds += 1
+        return rounds
+
+    def is_equilibrium(self):
+        """
+        Check every class, independently from the dirty ones, for a device with an improving move.
+        """
+        for ((type, indices, _), composition) in zip(self.__classes, self.__compositions):
+            (own, other) = (self.__counts[type], self.__counts[1 - type])
+            for (starting, count) in zip(indices, composition):
+                if count > 0 and any(destination != starting and self.__variation(own, other, starting, destination) > Device.TOLERANCE
+                                     for destination in indices):
+                    return False
+        return True
+
+    def payoffs(self):
+        """
+        Return the total bandwidth (WA, WB) of the type A and type B devices.
+        """
+        (payoff_a, payoff_b) = (0, 0)
+        for (n, m, w) in zip(self.__counts[0], self.__counts[1], self.__bandwidths):
+            if n + m > 0:
+                payoff_a += w / (n + m) * n
+                payoff_b += w / (n + m) * m
+        return (payoff_a, payoff_b)
+
+    def expand(self):
+        """
+        Return the gateway of each movable device, as a dictionary, keeping the devices on their current gateway when possible.
+        """
+        return expand_classes(self.__classes, self.__gateways, self.__compositions)
+
+    def apply(self):
+        """
+        Connect each movable device of the space to the gateway selected by the game.
+        """
+        for (device, destination) in self.expand().items():
+            if device not in destination:
+                self.__space.get_device_gateway(device).disconnect_device(device)
+                destination.connect_device(device)
+
+    classes = property(lambda self: len(self.__classes))
+    devices = property(lambda self: self.__devices)
+    rounds = property(lambda self: self.__rounds)
+    moves = property(lambda self: self.__moves)
+    transfers = property(lambda self: self.__transfers)
+    converged = property(lambda self: len(self.__worklist) == 0)
+    cycle = property(lambda self: self.__cycle)
+    finished = property(lambda self: self.converged or self.__cycle is not None)
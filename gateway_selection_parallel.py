@@ -0,0 +1,249 @@
+import math
+import multiprocessing
+import signal
+from array import array
+from gateway_selection import BestResponseDynamics, Device, DeviceType, bandwidth_variation
+
+# State of the game shared by the processes, set by _attach: the type of each device (0 for A, 1 for B), the bandwidth of each gateway,
+# the gateway of each device, the number of devices of each type connected to each gateway (gateway * 2 + type), and the tiles.
+_types = None
+_bandwidths = None
+_assignment = None
+_counts = None
+_tiles = None
+
+def _attach(types, bandwidths, assignment, counts, tiles):
+    # Keep the shared state in the process, once for all its tasks.
+    global _types, _bandwidths, _assignment, _counts, _tiles
+    (_types, _bandwidths, _assignment, _counts, _tiles) = (types, bandwidths, assignment, counts, tiles)
+
+def _attach_worker(*state):
+    # Keep the shared state in a worker, leaving Ctrl+C to the main process, which checks its cancellation token between the phases.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _attach(*state)
+
+def _variation(type, starting, destination):
+    # Return the bandwidth variation of a device of the type moving between two gateways, as Device.gateway_selection computes it.
+    return bandwidth_variation(_counts[2 * starting + type], _counts[2 * starting + 1 - type], _bandwidths[starting],
+                               _counts[2 * destination + type], _counts[2 * destination + 1 - type], _bandwidths[destination])
+
+def _sweep(devices, offsets, indices, touched=None):
+    # Let each device select its gateway once, scanning its candidates in order, and return the number of devices that moved.
+    # The gateways left or joined are added to touched, if it is given.
+    moves = 0
+    for (position, device) in enumerate(devices):
+        type = _types[device]
+        current = _assignment[device]
+        starting = current
+        for gateway in indices[offsets[position]:offsets[position + 1]]:
+            if gateway != current and _variation(type, current, gateway) > Device.TOLERANCE:
+                _counts[2 * current + type] -= 1
+                _counts[2 * gateway + type] += 1
+                current = gateway
+        if current != starting:
+            _assignment[device] = current
+            moves += 1
+            if touched is not None:
+                touched.update((starting, current))
+    return moves
+
+def _solve_tile(task):
+    # Run sweeps over the devices of a tile until none of them moves, a cycle or the maximum number of sweeps,
+    # and return (tile, moves, settled, cycle, touched), with the gateways whose counters changed.
+    # The rest of the game stands still, so the tile's assignment is its whole state.
+    (tile, max_rounds) = task
+    (devices, offsets, indices) = _tiles[tile]
+    moves = 0
+    states = set()
+    touched = set()
+    for _ in range(max_rounds):
+        changed = _sweep(devices, offsets, indices, touched=touched)
+        if changed == 0:
+            return (tile, moves, True, False, touched)
+        moves += changed
+        state = hash(tuple([_assignment[device] for device in devices]))
+        if state in states:
+            return (tile, moves, False, True, touched)
+        states.add(state)
+    return (tile, moves, False, False, touched)
+
+class TiledSolver(object):
+    """
+    This class solves a single large game on several processes, splitting the space into square tiles.\n
+    Each movable device belongs to the tile of its position, and the tiles are coloured as a checkerboard of 2 x 2 colours.
+    The tiles are at least as large as the gateways' reach, twice their radius, so the tiles of one colour share no gateway:
+    they run best-response sweeps in parallel, on the state kept in shared memory, while the other colours stand still.
+    The colours take turns in each phase, and only the tiles reaching the gateways touched by another tile are solved again.
+    When no tile is left to solve, no device can improve: the assignment is a pure Nash equilibrium of the whole game.\n
+    The pool of processes is created by the first run and kept for the next ones, until the solver is closed.
+    With a single process, the solver runs the best-response dynamics on the space.
+    """
+    COLOURS = 4 # Colours of the checkerboard of tiles.
+
+    def __init__(self, space, devices=None, tile_size=None, processes=None):
+        """
+        Initialize the solver given the space and the devices allowed to change gateway (by default, all of them),
+        the side of the tiles [m] and the number of processes (by default, one per core).\n
+        If the tile size is omitted, it is chosen to have at least a tile per process in each colour,
+        each one as large as the gateways' reach.
+        """
+        (self.__devices, self.__gateways, offsets, indices) = space.get_coverage_graph()
+        self.__space = space
+        self.__processes = processes if processes is not None else multiprocessing.cpu_count()
+        if multiprocessing.current_process().daemon: # A worker of a pool can't start its own pool.
+            self.__processes = 1
+        self.__pool = None # Pool of processes, created by the first run.
+        self.__phases = 0
+        self.__moves = 0
+        self.__converged = False
+        self.__cycle = None # Length of the detected cycle, in phases.
+        self.__states = {} # Phase at the end of which each state was reached.
+
+        self.__dynamics = None
+        if self.__processes == 1: # Without parallelism, the worklist of the dynamics beats the sweeps of the tiles.
+            self.__dynamics = BestResponseDynamics(space, devices if devices is not None else self.__devices)
+            self.__tiles = []
+            return
+
+        reach = 2 * max((gateway.radius for gateway in self.__gateways), default=1)
+        if tile_size is None:
+            tiles_per_side = 2 * math.ceil(math.sqrt(self.__processes))
+            tile_size = max(reach, math.ceil(max(space.rows, space.columns) / tiles_per_side))
+        if tile_size < reach: # Two tiles of the same colour could share a gateway.
+            raise ValueError("Tile size must be at least twice the radius of the gateways.")
+        gateway_index = {gateway: index for (index, gateway) in enumerate(self.__gateways)}
+
+        # Shared state: written by the workers, each one on the devices of its tile and on the gateways they reach.
+        self.__types = array("b", [device.type - DeviceType.TYPE_A for device in self.__devices])
+        self.__bandwidths = array("d", [gateway.bandwidth for gateway in self.__gateways])
+        self.__assignment = multiprocessing.RawArray("q", [gateway_index[space.get_device_gateway(device)] for device in self.__devices])
+        self.__counts = multiprocessing.RawArray("q", 2 * len(self.__gateways))
+        for (device, gateway) in enumerate(self.__assignment):
+            self.__counts[2 * gateway + self.__types[device]] += 1
+
+        # Split the movable devices, reaching more than one gateway, into the tiles of their positions.
+        movable = set(devices) if devices is not None else None
+        tile_ids = {}
+        tiles = []
+        self.__colours = [[] for _ in range(TiledSolver.COLOURS)] # Tiles of each colour.
+        self.__reaching = [set() for _ in self.__gateways] # Tiles with a device reached by each gateway.
+        for (position, device) in enumerate(self.__devices):
+            row = indices[offsets[position]:offsets[position + 1]]
+            if len(row) < 2 or (movable is not None and device not in movable):
+                continue
+            (x, y) = space.get_position(device)
+            (tile_x, tile_y) = (x // tile_size, y // tile_size)
+            tile = tile_ids.get((tile_x, tile_y))
+            if tile is None:
+                tile = tile_ids[(tile_x, tile_y)] = len(tiles)
+                tiles.append(([], array("l", [0]), array("l")))
+                self.__colours[tile_x % 2 + 2 * (tile_y % 2)].append(tile)
+            (members, row_offsets, row_indices) = tiles[tile]
+            members.append(position)
+            row_indices.extend(row)
+            row_offsets.append(len(row_indices))
+            for gateway in row:
+                self.__reaching[gateway].add(tile)
+        self.__tiles = [(array("l", members), row_offsets, row_indices) for (members, row_offsets, row_indices) in tiles]
+
+    def __run_tiles(self, tiles, max_rounds):
+        # Solve the given tiles, in the pool if there is one, and return the ones that did not settle
+        # and the ones reaching the gateways that another tile touched. A tile whose sweeps cycle stays unsettled,
+        # until the phases repeat a state of the whole game.
+        tasks = [(tile, max_rounds) for tile in tiles]
+        results = self.__pool.imap_unordered(_solve_tile, tasks) if self.__pool is not None else map(_solve_tile, tasks)
+        (unsettled, dirty) = (set(), set())
+        for (tile, moves, settled, _, touched) in results:
+            self.__moves += moves
+            if not settled:
+                unsettled.add(tile)
+            for gateway in touched:
+                dirty.update(self.__reaching[gateway])
+            dirty.discard(tile) # A settled tile already saw its own moves.
+        return unsettled | dirty
+
+    def run(self, max_phases=100, max_rounds=1000, token=None):
+        """
+        Run phases, in which the colours of tiles take turns, until the equilibrium, a cycle or the maximum number of phases,
+        and return the number of phases run.\n
+        Each tile runs at most max_rounds sweeps per phase. As for the sequential dynamics, the equilibrium is reached
+        when the devices of only one type move, while the devices of both types may cycle.
+        With a single process, each phase is a round of the dynamics.\n
+        An optional cancellation token is checked before each phase.
+        """
+        if self.__dynamics is not None:
+            phases = self.__dynamics.run(max_rounds=max_phases, token=token)
+            (self.__moves, self.__converged) = (self.__dynamics.moves, self.__dynamics.converged)
+            self.__cycle = self.__dynamics.cycle
+            self.__phases += phases
+            return phases
+        _attach(self.__types, self.__bandwidths, self.__assignment, self.__counts, self.__tiles)
+        if self.__pool is None and self.__processes > 1 and len(self.__tiles) > 1:
+            self.__pool = multiprocessing.Pool(self.__processes, initializer=_attach_worker,
+                                               initargs=(self.__types, self.__bandwidths, self.__assignment, self.__counts, self.__tiles))
+        dirty = set(range(len(self.__tiles))) # Tiles whose devices may not be settled.
+        phases = 0
+        while phases < max_phases and not self.finished and (token is None or token.checkpoint()):
+            for colour in self.__colours:
+                tiles = [tile for tile in colour if tile in dirty]
+                dirty.difference_update(tiles)
+                dirty |= self.__run_tiles(tiles, max_rounds)
+            self.__converged = len(dirty) == 0
+            phases += 1
+            self.__phases += 1
+            state = hash((bytes(memoryview(self.__assignment)), frozenset(dirty)))
+            if not self.__converged and state in self.__states: # The phases repeat a state of the whole game.
+                self.__cycle = self.__phases - self.__states[state]
+            self.__states[state] = self.__phases
+        return phases
+
+    def close(self):
+        """
+        Stop the pool of processes, if a run created it.
+        """
+        if self.__pool is not None:
+            self.__pool.close()
+            self.__pool.join()
+            self.__pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def is_equilibrium(self):
+        """
+        Check that no movable device has an improving move, from the shared state or, with a single process, from the space.
+        """
+        if self.__dynamics is not None:
+            return self.__dynamics.certificate()["equilibrium"]
+        _attach(self.__types, self.__bandwidths, self.__assignment, self.__counts, self.__tiles)
+        for (devices, offsets, indices) in self.__tiles:
+            for (position, device) in enumerate(devices):
+                (type, current) = (self.__types[device], self.__assignment[device])
+                for gateway in indices[offsets[position]:offsets[position + 1]]:
+                    if gateway != current and _variation(type, current, gateway) > Device.TOLERANCE:
+                        return False
+        return True
+
+    def apply(self):
+        """
+        Connect each device of the space to the gateway selected by the solver.\n
+        With a single process, the dynamics already moved the devices in the space.
+        """
+        if self.__dynamics is not None:
+            return
+        for (device, index) in zip(self.__devices, self.__assignment):
+            destination = self.__gateways[index]
+            if device not in destination:
+                self.__space.get_device_gateway(device).disconnect_device(device)
+                destination.connect_device(device)
+
+    phases = property(lambda self: self.__phases)
+    moves = property(lambda self: self.__moves)
+    converged = property(lambda self: self.__converged)
+    cycle = property(lambda self: self.__cycle)
+    finished = property(lambda self: self.__converged or self.__cycle is not None)
+    tiles = property(lambda self: len(self.__tiles))
+    processes = property(lambda self: self.__processes)
@@ -0,0 +1,187 @@
+import sys
+from array import array
+from functools import wraps
+from time import perf_counter
+import gateway_selection
+from gateway_selection import BestResponseDynamics, Device, Gateway, PayoffTracker, Space
+
+TARGETS = ( # Instrumented functions: (owner, attribute, name), the owner being a class or a module.
+    (Space, "get_near_gateways", "Space.get_near_gateways"),
+    (Space, "_Space__gateways_covering", "Space.gateways_covering"),
+    (Device, "gateway_selection", "Device.gateway_selection"),
+    (Device, "_Device__bandwidth_variation", "Device.bandwidth_variation"),
+    (Gateway, "get_marginal_values", "Gateway.get_marginal_values"),
+    (gateway_selection, "marginal_values", "marginal_values"),
+    (gateway_selection, "bandwidth_variation", "bandwidth_variation"),
+    (gateway_selection, "get_payoffs", "get_payoffs"),
+    (PayoffTracker, "refresh", "PayoffTracker.refresh"),
+    (PayoffTracker, "record", "PayoffTracker.record"),
+    (BestResponseDynamics, "round", "BestResponseDynamics.round")
+)
+
+CACHES = { # Caches whose hit rate is measured: the cached function, and the one it calls only on a miss.
+    "coverage": ("Space.get_near_gateways", "Space.gateways_covering"),
+    "marginals": ("Gateway.get_marginal_values", "marginal_values")
+}
+
+class Profiler(object):
+    """
+    This class counts the calls of the hot functions of the solver, and optionally times them, while it is enabled.\n
+    The functions are replaced by counting wrappers only when the profiler is enabled, and restored when it is disabled,
+    so a run without the profiler executes the original code. The module functions are replaced in every gateway_selection
+    module that imported them.\n
+    Besides the calls and the cumulative (inclusive) times, it measures the hit rates of the coverage and marginal values caches,
+    the moves of each round of the dynamics and the bandwidth variations evaluated per move.
+    Only one profiler can be enabled at a time.
+    """
+    ACTIVE = None # Profiler currently enabled.
+
+    def __init__(self, timings=True):
+        """
+        Initialize the profiler, with the timing of the calls or only their counts.
+        """
+        self.__timings = timings
+        self.__patched = [] # Replaced (owner, attribute, original) functions.
+        self.__calls = {name: 0 for (_, _, name) in TARGETS}
+        self.__seconds = {name: 0.0 for (_, _, name) in TARGETS}
+        self.__hits = {cache: 0 for cache in CACHES}
+        self.__misses = {cache: 0 for cache in CACHES}
+        self.__round_moves = array("l") # Moves of each round.
+
+    def reset(self):
+        """
+        Clear every counter, in place, since the wrappers hold them.
+        """
+        for counters in (self.__calls, self.__seconds, self.__hits, self.__misses):
+            for name in counters:
+                counters[name] = 0
+        del self.__round_moves[:]
+
+    def __wrap(self, function, name):
+        # Return the counting wrapper of a function.
+        calls = self.__calls
+        seconds = self.__seconds
+        cache = next((cache for (cache, (cached, _)) in CACHES.items() if cached == name), None)
+        if cache is not None: # A call is a miss if it calls the function computing the value.
+            (hits, misses, inner) = (self.__hits, self.__misses, CACHES[cache][1])
+            def counted(*args, **kwargs):
+                before = calls[inner]
+                result = function(*args, **kwargs)
+                if calls[inner] == before:
+                    hits[cache] += 1
+                else:
+                    misses[cache] += 1
+                return result
+        elif name == "BestResponseDynamics.round":
+            round_moves = self.__round_moves
+            def counted(*args, **kwargs):
+                result = function(*args, **kwargs)
+                round_moves.append(result)
+                return result
+        else:
+            counted = function
+        if self.__timings:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return counted(*args, **kwargs)
+                finally:
+                    seconds[name] += perf_counter() - start
+                    calls[name] += 1
+        else:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                calls[name] += 1
+                return counted(*args, **kwargs)
+        return wrapper
+
+    def enable(self):
+        """
+        Start counting, replacing the instrumented functions.
+        """
+        if Profiler.ACTIVE is self:
+            return
+        if Profiler.ACTIVE is not None:
+            raise RuntimeError("Another profiler is already enabled.")
+        for (owner, attribute, name) in TARGETS:
+            original = getattr(owner, attribute)
+            wrapper = self.__wrap(original, name)
+            owners = [owner]
+            if owner is gateway_selection: # Replace the function also where it was imported by name.
+                owners += [module for (module_name, module) in list(sys.modules.items())
+                           if module_name.startswith("gateway_selection_") and getattr(module, attribute, None) is original]
+            for patched in owners:
+                setattr(patched, attribute, wrapper)
+                self.__patched.append((patched, attribute, original))
+        Profiler.ACTIVE = self
+
+    def disable(self):
+        """
+        Stop counting, restoring the original functions. The counters are kept.
+        """
+        if Profiler.ACTIVE is not self:
+            return
+        for (owner, attribute, original) in reversed(self.__patched):
+            setattr(owner, attribute, original)
+        self.__patched = []
+        Profiler.ACTIVE = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exception):
+        self.disable()
+
+    def report(self):
+        """
+        Return the counters as a dictionary: the calls and the seconds of each function, the hits, misses and hit rate
+        of each cache, the moves of each round, and the bandwidth variations evaluated by the devices per move.
+        """
+        moves = sum(self.__round_moves)
+        caches = {}
+        for cache in CACHES:
+            lookups = self.__hits[cache] + self.__misses[cache]
+            caches[cache] = {"hits": self.__hits[cache], "misses": self.__misses[cache],
+                             "hit_rate": self.__hits[cache] / lookups if lookups else None}
+        return {
+            "calls": dict(self.__calls),
+            "seconds": dict(self.__seconds) if self.__timings else None,
+            "caches": caches,
+            "rounds": len(self.__round_moves),
+            "moves": moves,
+            "moves_per_round": self.__round_moves.tolist(),
+            "evaluations_per_move": self.__calls["Device.bandwidth_variation"] / moves if moves else None
+        }
+
+    def prometheus(self, prefix="gateway_selection"):
+        """
+        Return the counters in the Prometheus text exposition format.
+        """
+        report = self.report()
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help))
+            lines.append("# TYPE {}_{} {}".format(prefix, name, kind))
+            for (labels, value) in samples:
+                label = "{" + ",".join('{}="{}"'.format(key, text) for (key, text) in labels) + "}" if labels else ""
+                lines.append("{}_{}{} {}".format(prefix, name, label, repr(float(value)) if isinstance(value, float) else value))
+        metric("calls_total", "counter", "Calls of the instrumented functions.",
+               [((("function", name),), calls) for (name, calls) in report["calls"].items()])
+        if report["seconds"] is not None:
+            metric("seconds_total", "counter", "Cumulative time of the instrumented functions, callees included.",
+                   [((("function", name),), seconds) for (name, seconds) in report["seconds"].items()])
+        metric("cache_hits_total", "counter", "Lookups answered by a cache.",
+               [((("cache", cache),), values["hits"]) for (cache, values) in report["caches"].items()])
+        metric("cache_misses_total", "counter", "Lookups computed again.",
+               [((("cache", cache),), values["misses"]) for (cache, values) in report["caches"].items()])
+        metric("rounds_total", "counter", "Rounds of the best-response dynamics.", [((), report["rounds"])])
+        metric("moves_total", "counter", "Moves of the best-response dynamics.", [((), report["moves"])])
+        if report["evaluations_per_move"] is not None:
+            metric("evaluations_per_move", "gauge", "Bandwidth variations evaluated by the devices per move.",
+                   [((), report["evaluations_per_move"])])
+        return "\n".join(lines) + "\n"
+
+    enabled = property(lambda self: Profiler.ACTIVE is self)
+    timings = property(lambda self: self.__timings)
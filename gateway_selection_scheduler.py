@@ -0,0 +1,297 @@
+from collections import deque
+from heapq import heappop, heappush
+from random import Random
+from gateway_selection import Device
+
+class Scheduler(object):
+    """
+    This class runs asynchronous best-response updates, driven by the events of the devices' moves.\n
+    Each evaluation lets a single device run Device.gateway_selection; when it moves, only the devices reached
+    by the two gateways touched by the move are requeued. The order of the queue is given by the subclasses.
+    The equilibrium is reached when the queue is empty.\n
+    A pass ends when every device queued at its start left the queue, or after as many evaluations as the devices,
+    since an order may keep some of them queued: then the assignment, the queued devices and the order of the queue
+    are hashed, to detect the cycles. The random order keeps no memory of its generator, so a state it repeats
+    is reported as a cycle too, although the next passes might leave it.
+    """
+    def __init__(self, space, devices):
+        """
+        Initialize the scheduler given the space and the devices allowed to change gateway, all of them initially queued.\n
+        The subclasses must initialize their queue before calling this method.
+        """
+        self.__space = space
+        self.__devices = list(devices)
+        self.__order = {device: index for (index, device) in enumerate(self.__devices)} # Position of each device.
+        self.__neighbors = {} # Positions of the devices reached by each gateway, cached on demand.
+        self.__queued = set() # Positions of the queued devices.
+        self.__evaluations = 0
+        self.__moves = 0
+        self.__assignment_hash = 0 # Hash of the current assignment, updated at each move.
+        for device in self.__devices:
+            self.__assignment_hash ^= hash((device, space.get_device_gateway(device)))
+        self.__pending = set() # Positions queued at the start of the pass, still in the queue.
+        self.__pass_start = 0 # Evaluations before the start of the pass.
+        self.__states = {} # Pass at the end of which each state was reached.
+        self.__passes = 0
+        self.__cycle = None # Length of the detected cycle, in passes.
+        for position in range(len(self.__devices)):
+            self.__enqueue(position)
+        self.__pending = set(self.__queued)
+
+    def _enqueue(self, position, queued, gateways):
+        """
+        Insert the position of a device in the queue, given whether it is already queued
+        and the gateways touched by the move which requeued it (None for the initial insertion).\n
+        Return True if the device is in the queue after the call.
+        """
+        raise NotImplementedError()
+
+    def _dequeue(self):
+        """
+        Remove and return the position of the next device to evaluate, or None if the queue is empty.
+        """
+        raise NotImplementedError()
+
+    def _order(self):
+        """
+        Return a hashable description of the order of the queue, beyond the queued devices, checked with the state at the end of each pass.
+        """
+        return None
+
+    def _discard(self, position):
+        """
+        Remove a device from the queue, without evaluating it.
+        """
+        self.__queued.discard(position)
+        self.__pending.discard(position)
+
+    def __enqueue(self, position, gateways=None):
+        # Requeue a device, keeping track of the queued ones.
+        if self._enqueue(position, position in self.__queued, gateways):
+            self.__queued.add(position)
+        else:
+            self.__queued.discard(position)
+            self.__pending.discard(position)
+
+    def __get_neighbors(self, gateway):
+        # Return the positions of the devices, among the scheduler's ones, that the gateway reaches.
+        neighbors = self.__neighbors.get(gateway)
+        if neighbors is None:
+            neighbors = [self.__order[device] for device in self.__space.get_covered_devices(gateway) if device in self.__order]
+            self.__neighbors[gateway] = neighbors
+        return neighbors
+
+    def step(self):
+        """
+        Evaluate the next queued device and return it, or return None if the queue is empty.
+        """
+        position = self._dequeue()
+        while position is not None and position not in self.__queued: # Skip the entries left behind by a requeue.
+            position = self._dequeue()
+        if position is None:
+            return None
+        self.__queued.discard(position)
+        self.__pending.discard(position)
+        device = self.__devices[position]
+        starting_gateway = self.__space.get_device_gateway(device)
+        self.__evaluations += 1
+        if device.gateway_selection(self.__space):
+            self.__moves += 1
+            destination_gateway = self.__space.get_device_gateway(device)
+            self.__assignment_hash ^= hash((device, starting_gateway)) ^ hash((device, destination_gateway))
+            gateways = (starting_gateway, destination_gateway) # Only the two touched gateways change their counters.
+            for gateway in gateways:
+                for neighbor in self.__get_neighbors(gateway):
+                    self.__enqueue(neighbor, gateways)
+        if not self.__pending or self.__evaluations - self.__pass_start == len(self.__devices):
+            self.__end_pass()
+        return device
+
+    def __end_pass(self):
+        # Close a pass, checking if the state was already reached at the end of a previous pass.
+        self.__passes += 1
+        state = (self.__assignment_hash, hash(frozenset(self.__queued)), hash(self._order()))
+        if self.__queued and state in self.__states: # The scheduler would repeat the same passes.
+            self.__cycle = self.__passes - self.__states[state]
+        self.__states[state] = self.__passes
+        self.__pending = set(self.__queued)
+        self.__pass_start = self.__evaluations
+
+    def run(self, max_evaluations=None, token=None):
+        """
+        Evaluate the queued devices until the queue is empty, a cycle or the maximum number of evaluations,
+        and return the number of evaluations.
+        An optional cancellation token is checked before each evaluation.
+        """
+        evaluations = 0
+        while ((max_evaluations is None or evaluations < max_evaluations) and self.__cycle is None
+               and (token is None or token.checkpoint()) and self.step() is not None):
+            evaluations += 1
+        return evaluations
+
+    def gain(self, position):
+        """
+        Return the best bandwidth variation that the device at the given position could obtain by moving.
+        """
+        return self.__devices[position].best_deviation(self.__space)[1]
+
+    def variation(self, position, gateway):
+        """
+        Return the bandwidth variation that the device at the given position would obtain by moving to the gateway.
+        """
+        return self.__devices[position].get_variation(self.__space, gateway)
+
+    def reaches(self, position, gateway):
+        """
+        Check if the device at the given position can connect to the gateway.
+        """
+        return gateway in self.__space.get_near_gateways(self.__devices[position])
+
+    def gateway(self, position):
+        """
+        Return the gateway the device at the given position is connected to.
+        """
+        return self.__space.get_device_gateway(self.__devices[position])
+
+    converged = property(lambda self: len(self.__queued) == 0)
+    finished = property(lambda self: self.converged or self.__cycle is not None)
+    cycle = property(lambda self: self.__cycle)
+    passes = property(lambda self: self.__passes)
+    evaluations = property(lambda self: self.__evaluations)
+    moves = property(lambda self: self.__moves)
+    devices = property(lambda self: self.__devices)
+
+class RoundRobinScheduler(Scheduler):
+    """
+    This scheduler evaluates the queued devices cyclically, in the order they were given.
+    """
+    def __init__(self, space, devices):
+        self.__current = [] # Positions after the last evaluated one, in this pass.
+        self.__next = [] # Positions before the last evaluated one, for the next pass.
+        self.__position = -1 # Position of the last evaluated device.
+        Scheduler.__init__(self, space, devices)
+
+    def _enqueue(self, position, queued, gateways):
+        if not queued:
+            heappush(self.__current if position > self.__position else self.__next, position)
+        return True
+
+    def _dequeue(self):
+        if not self.__current: # Start a new pass.
+            (self.__current, self.__next) = (self.__next, [])
+            self.__position = -1
+        if not self.__current:
+            return None
+        self.__position = heappop(self.__current)
+        return self.__position
+
+    def _order(self):
+        # The queued devices after the last evaluated one are in this pass, the others in the next one.
+        return self.__position
+
+class RandomScheduler(Scheduler):
+    """
+    This scheduler evaluates the queued devices in a new random permutation at each pass.
+    """
+    def __init__(self, space, devices, rng=None):
+        """
+        Initialize the scheduler given the space, the devices and an optional random number generator.
+        """
+        self.__rng = rng if rng is not None else Random()
+        self.__current = [] # Positions still to evaluate in this pass.
+        self.__next = [] # Positions queued for the next pass.
+        Scheduler.__init__(self, space, devices)
+
+    def _enqueue(self, position, queued, gateways):
+        if not queued:
+            self.__next.append(position)
+        return True
+
+    def _dequeue(self):
+        if not self.__current: # Start a new pass, in a random order.
+            (self.__current, self.__next) = (self.__next, [])
+            self.__rng.shuffle(self.__current)
+        return self.__current.pop() if self.__current else None
+
+class PriorityScheduler(Scheduler):
+    """
+    This scheduler evaluates first the queued device with the largest gain, using a heap keyed on the bandwidth variation.\n
+    Only the devices which can improve are queued. A device out of the queue had no improving move, so when a move
+    touches two gateways and the device is connected to neither, only the variations towards them have to be computed.
+    A queued device keeps its entry when requeued, and its gain is computed again only when it reaches the top:
+    if it is not the largest anymore, the device is pushed back with the new gain.
+    """
+    def __init__(self, space, devices):
+        self.__heap = [] # Entries (-gain, position), one for each queued device.
+        self.__fresh = set() # Positions whose gain in the heap is up to date.
+        Scheduler.__init__(self, space, devices)
+
+    def _enqueue(self, position, queued, gateways):
+        if queued:
+            self.__fresh.discard(position) # The gain may have changed.
+            return True
+        if gateways is not None and self.gateway(position) not in gateways:
+            gain = max(self.variation(position, gateway) for gateway in gateways if self.reaches(position, gateway))
+        else:
+            gain = self.gain(position)
+        if gain <= Device.TOLERANCE: # The device has no improving move: it is not queued.
+            return False
+        self.__fresh.add(position)
+        heappush(self.__heap, (-gain, position))
+        return True
+
+    def _dequeue(self):
+        while self.__heap:
+            (key, position) = heappop(self.__heap)
+            if position not in self.__fresh:
+                gain = self.gain(position)
+                if gain <= Device.TOLERANCE: # The device can't improve anymore.
+                    self._discard(position)
+                    continue
+                if self.__heap and -self.__heap[0][0] > gain: # Push the device back, if another one may have a larger gain.
+                    self.__fresh.add(position)
+                    heappush(self.__heap, (-gain, position))
+                    continue
+            self.__fresh.discard(position)
+            return position
+        return None
+
+    def _order(self):
+        # The entries out of date are popped in the order of their old gains.
+        return (tuple(sorted(self.__heap)), frozenset(self.__fresh))
+
+class GatewayBatchScheduler(Scheduler):
+    """
+    This scheduler evaluates the queued devices in batches, one for each gateway, with all the queued devices connected to it.\n
+    The gateways are visited in the order their first device was queued.
+    """
+    def __init__(self, space, devices):
+        self.__batches = {} # Queued positions of each gateway, in insertion order.
+        self.__gateways = deque() # Gateways with a batch, in order.
+        self.__batch = deque() # Positions of the batch being evaluated.
+        Scheduler.__init__(self, space, devices)
+
+    def _enqueue(self, position, queued, gateways):
+        if not queued:
+            gateway = self.gateway(position)
+            if gateway not in self.__batches:
+                self.__batches[gateway] = []
+                self.__gateways.append(gateway)
+            self.__batches[gateway].append(position)
+        return True
+
+    def _dequeue(self):
+        if not self.__batch and self.__gateways: # Take the next gateway's batch.
+            self.__batch.extend(sorted(self.__batches.pop(self.__gateways.popleft())))
+        return self.__batch.popleft() if self.__batch else None
+
+    def _order(self):
+        # The queued devices of each gateway follow from the queued set, once the order of the gateways is known.
+        return (tuple(self.__gateways), tuple(self.__batch))
+
+SCHEDULERS = { # Update orders by name.
+    "round-robin": RoundRobinScheduler,
+    "random": RandomScheduler,
+    "priority": PriorityScheduler,
+    "gateway": GatewayBatchScheduler
+}
@@ -0,0 +1,231 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import signal
+import sys
+from gateway_selection import BestResponseDynamics, DeviceType, IdAllocator, PayoffTracker, Space, get_payoffs
+from gateway_selection_compressed import CompressedGame
+from gateway_selection_parallel import TiledSolver
+from gateway_selection_scheduler import SCHEDULERS, RandomScheduler
+from gateway_selection_trajectory import TrajectoryRecorder
+from gateway_selection_vectorized import VectorizedGame
+
+STRATEGIES = { # Types of devices allowed to change gateway, as the strategies of the window.
+    "Both": (DeviceType.TYPE_A, DeviceType.TYPE_B),
+    "A": (DeviceType.TYPE_A,),
+    "B": (DeviceType.TYPE_B,)
+}
+
+ENGINES = ( # Solvers of a scenario: the round-based dynamics, scanning the candidates or moving to the best one,
+            # the vectorized game in its two modes, the tiled solver over several processes, the game compressed into coverage classes,
+            # and the event-driven schedulers.
+    "dynamics",
+    "best-response",
+    "vectorized",
+    "vectorized-simultaneous",
+    "tiled",
+    "compressed"
+) + tuple(SCHEDULERS)
+
+RECORDING_ENGINES = ("dynamics", "best-response") # Engines whose moves and rounds can be recorded as a trajectory.
+
+DEFAULTS = { # Parameters of a scenario, as in gateway_selection.main.
+    "rows": 100,
+    "columns": 100,
+    "gateways": 50,
+    "a_devices": 100,
+    "b_devices": 100,
+    "bandwidth": 100,
+    "radius": 25,
+    "strategies": "Both",
+    "engine": "dynamics",
+    "max_rounds": 1000
+}
+
+def parameter_grid(**values):
+    """
+    Return the list of the scenarios given by every combination of the parameters' values.\n
+    Each keyword is a parameter name, with a list of values; the missing parameters take the default value.
+    """
+    for name in values:
+        if name not in DEFAULTS:
+            raise ValueError("Unsupported parameter {}.".format(name))
+    names = list(values.keys())
+    scenarios = []
+    for combination in itertools.product(*[values[name] for name in names]):
+        scenario = dict(DEFAULTS)
+        scenario.update(zip(names, combination))
+        scenarios.append(scenario)
+    return scenarios
+
+def place_scenario(scenario, seed):
+    """
+    Place the gateways and the devices of a scenario with the given seed, and return the tuple (space, gateways, devices).\n
+    The elements are numbered from one in each scenario, so the same seed always gives the same placement.
+    """
+    allocator = IdAllocator()
+    gateways = [allocator.gateway(scenario["bandwidth"], radius=scenario["radius"]) for _ in range(scenario["gateways"])]
+    devices = [allocator.device(DeviceType.TYPE_A) for _ in range(scenario["a_devices"])] + \
+              [allocator.device(DeviceType.TYPE_B) for _ in range(scenario["b_devices"])]
+    space = Space(scenario["rows"], scenario["columns"], rng=seed)
+    space.add_elements(gateways + devices)
+    return (space, gateways, devices)
+
+def run_scenario(scenario, seed, snapshot=None, trajectory=None, token=None):
+    """
+    Build and solve a scenario with the given seed, and return its result as a dictionary:
+    the parameters, the seed, the payoffs WA and WB, the rounds and the moves done, whether the equilibrium was reached
+    and the length of the cycle, if one was detected. Every engine reports the rounds, besides its own counters
+    (the phases of the tiled solver, the evaluations of the schedulers).\n
+    If a snapshot of the space is given, the placement is replayed from it instead of being drawn again.\n
+    If a trajectory directory is given, the moves and the rounds are recorded in it, together with the initial snapshot.\n
+    If a cancellation token is given, the engine checks it between its rounds: a cancelled run returns its partial result,
+    marked as cancelled.
+    """
+    if scenario["strategies"] not in STRATEGIES:
+        raise ValueError("Unsupported strategies {}.".format(scenario["strategies"]))
+    if scenario["engine"] not in ENGINES:
+        raise ValueError("Unsupported engine {}.".format(scenario["engine"]))
+    if trajectory is not None and scenario["engine"] not in RECORDING_ENGINES:
+        raise ValueError("Only the dynamics engines record the trajectory.")
+    if snapshot is None:
+        (space, gateways, devices) = place_scenario(scenario, seed)
+    else:
+        (space, gateways, devices) = Space.from_snapshot(snapshot, rng=seed)
+
+    # Run the engine, only for the devices allowed by the strategies, until the equilibrium, a cycle or the maximum rounds.
+    movable = [device for device in devices if device.type in STRATEGIES[scenario["strategies"]]]
+    recorder = TrajectoryRecorder(trajectory, space=space, payoffs=PayoffTracker(gateways)) if trajectory is not None else None
+    try:
+        outcome = _solve(scenario, space, movable, seed, recorder, token)
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+    (payoff_a, payoff_b) = get_payoffs(gateways) # Exact totals, without the rounding errors of the updates.
+    result = dict(scenario)
+    result.update({"seed": seed, "WA": payoff_a, "WB": payoff_b})
+    result.update(outcome)
+    if trajectory is not None:
+        result["trajectory"] = trajectory
+    if token is not None and token.cancelled:
+        result["cancelled"] = True
+    return result
+
+def _solve(scenario, space, devices, seed, recorder, token=None):
+    # Run the engine of the scenario, and return the rounds, the moves, whether the equilibrium was reached and the cycle, if any,
+    # with the counters of the engine. Every engine reports its rounds: the phases of the tiled solver, and the evaluations
+    # of the schedulers divided by the devices, rounded up.
+    engine = scenario["engine"]
+    if engine in ("dynamics", "best-response"):
+        dynamics = BestResponseDynamics(space, devices, recorder=recorder, argmax=engine == "best-response")
+        dynamics.run(max_rounds=scenario["max_rounds"], token=token)
+        return {"rounds": dynamics.rounds, "moves": dynamics.moves, "converged": dynamics.converged, "cycle": dynamics.cycle}
+    elif engine in ("vectorized", "vectorized-simultaneous"):
+        game = VectorizedGame.from_space(space)
+        mode = VectorizedGame.SEQUENTIAL if engine == "vectorized" else VectorizedGame.SIMULTANEOUS
+        types = STRATEGIES[scenario["strategies"]]
+        (rounds, moves, changed) = (0, 0, None)
+        while (changed != 0 and game.cycle is None and rounds < scenario["max_rounds"]
+               and (token is None or token.checkpoint())):
+            changed = game.round(mode, types=types)
+            (rounds, moves) = (rounds + 1, moves + changed)
+        game.apply()
+        return {"rounds": rounds, "moves": moves, "converged": changed == 0, "cycle": game.cycle}
+    elif engine == "tiled": # Inside a sweep, the solver runs the dynamics in its worker; max_rounds bounds both the phases and the sweeps of a tile.
+        with TiledSolver(space, devices) as solver:
+            phases = solver.run(max_phases=scenario["max_rounds"], max_rounds=scenario["max_rounds"], token=token)
+            solver.apply()
+        return {"rounds": phases, "phases": phases, "moves": solver.moves, "converged": solver.converged, "cycle": solver.cycle}
+    elif engine == "compressed":
+        game = CompressedGame(space, devices)
+        game.run(max_rounds=scenario["max_rounds"], token=token)
+        game.apply()
+        return {"rounds": game.rounds, "moves": game.moves, "classes": game.classes, "converged": game.converged, "cycle": game.cycle}
+    else: # The schedulers evaluate a device at a time: max_rounds bounds the evaluations of each device.
+        scheduler_class = SCHEDULERS[engine]
+        if scheduler_class is RandomScheduler:
+            scheduler = scheduler_class(space, devices, rng=random.Random(seed))
+        else:
+            scheduler = scheduler_class(space, devices)
+        scheduler.run(max_evaluations=scenario["max_rounds"] * max(len(devices), 1), token=token)
+        rounds = -(-scheduler.evaluations // max(len(devices), 1))
+        return {"rounds": rounds, "evaluations": scheduler.evaluations, "moves": scheduler.moves, "converged": scheduler.converged,
+                "cycle": scheduler.cycle}
+
+def _ignore_interrupt():
+    # Leave Ctrl+C to the main process, which stops the sweep: the workers are terminated with the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _run_task(task):
+    # Unpack a (scenario, seed, snapshot, trajectory) task for the pool.
+    return run_scenario(*task)
+
+def sweep(scenarios, seeds, processes=None, chunksize=None, trajectories=None):
+    """
+    Run every scenario with every seed over a pool of processes, and yield the results as soon as they are ready.
+    Closing the generator, or interrupting it, terminates the workers at once.\n
+    The tasks are dispatched to the workers in chunks; if the chunk size is omitted, it is chosen from the number of tasks.\n
+    If a directory of trajectories is given, each run is recorded in its own numbered subdirectory: every scenario must then
+    use an engine recording the trajectory, which is checked before any task is dispatched.
+    """
+    scenarios = list(scenarios)
+    if trajectories is not None and any(scenario["engine"] not in RECORDING_ENGINES for scenario in scenarios):
+        raise ValueError("Only the dynamics engines record the trajectory.")
+    tasks = [(scenario, seed) for scenario in scenarios for seed in seeds]
+    tasks = [(scenario, seed, None, os.path.join(trajectories, "{:06d}".format(index)) if trajectories is not None else None)
+             for (index, (scenario, seed)) in enumerate(tasks)]
+    if len(tasks) == 0:
+        return
+    processes = processes if processes is not None else multiprocessing.cpu_count()
+    if chunksize is None: # About four chunks per process, to balance the load without flooding the queue.
+        chunksize = max(1, len(tasks) // (processes * 4))
+    with multiprocessing.Pool(processes, initializer=_ignore_interrupt) as pool:
+        for result in pool.imap_unordered(_run_task, tasks, chunksize):
+            yield result
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of the gateway selection game.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[DEFAULTS["rows"]], help="height of the space [m]")
+    parser.add_argument("--columns", type=int, nargs="+", default=[DEFAULTS["columns"]], help="width of the space [m]")
+    parser.add_argument("--gateways", type=int, nargs="+", default=[DEFAULTS["gateways"]], help="number of gateways")
+    parser.add_argument("--a-devices", type=int, nargs="+", default=[DEFAULTS["a_devices"]], help="number of type A devices")
+    parser.add_argument("--b-devices", type=int, nargs="+", default=[DEFAULTS["b_devices"]], help="number of type B devices")
+    parser.add_argument("--bandwidth", type=int, nargs="+", default=[DEFAULTS["bandwidth"]], help="bandwidth of the gateways [Mbps]")
+    parser.add_argument("--radius", type=int, nargs="+", default=[DEFAULTS["radius"]], help="radius of the gateways [m]")
+    parser.add_argument("--strategies", nargs="+", choices=list(STRATEGIES), default=[DEFAULTS["strategies"]], help="devices allowed to move")
+    parser.add_argument("--engine", nargs="+", choices=ENGINES, default=[DEFAULTS["engine"]], help="solvers of the scenarios")
+    parser.add_argument("--max-rounds", type=int, default=DEFAULTS["max_rounds"], help="rounds before giving up the equilibrium")
+    parser.add_argument("--seeds", type=int, default=1, help="number of seeds per scenario")
+    parser.add_argument("--first-seed", type=int, default=0, help="first seed")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, by default one per core")
+    parser.add_argument("--chunksize", type=int, default=None, help="tasks sent to a worker at once")
+    parser.add_argument("--output", default="-", help="JSON lines file of the results, by default the standard output")
+    parser.add_argument("--trajectories", default=None, help="directory where the moves and the rounds of each run are recorded")
+    arguments = parser.parse_args(arguments)
+    if arguments.trajectories is not None and any(engine not in RECORDING_ENGINES for engine in arguments.engine):
+        parser.error("--trajectories requires the engines {}.".format(" or ".join(RECORDING_ENGINES)))
+
+    scenarios = parameter_grid(rows=arguments.rows, columns=arguments.columns, gateways=arguments.gateways,
+                               a_devices=arguments.a_devices, b_devices=arguments.b_devices, bandwidth=arguments.bandwidth,
+                               radius=arguments.radius, strategies=arguments.strategies, engine=arguments.engine,
+                               max_rounds=[arguments.max_rounds])
+    seeds = range(arguments.first_seed, arguments.first_seed + arguments.seeds)
+    output = sys.stdout if arguments.output == "-" else open(arguments.output, "w")
+    try:
+        for result in sweep(scenarios, seeds, processes=arguments.processes, chunksize=arguments.chunksize,
+                            trajectories=arguments.trajectories):
+            output.write(json.dumps(result) + "\n")
+            output.flush() # Stream each result as soon as it arrives.
+    except KeyboardInterrupt: # The results written so far are kept.
+        print("Sweep interrupted.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import json
+import os
+import struct
+from gateway_selection import DeviceType, Space
+try:
+    import numpy as np
+except ImportError: # NumPy is optional: only the reader needs it.
+    np = None
+
+MOVE_FIELDS = ( # Columns of a move record: the round, the device, the gateways it left and joined, and its variation [Mbps].
+    ("round", "<u4"),
+    ("device", "<u4"),
+    ("type", "u1"),
+    ("source", "<u4"),
+    ("destination", "<u4"),
+    ("variation", "<f8")
+)
+
+ROUND_FIELDS = ( # Columns of a round record: the round, its moves, the dirty devices left and the payoffs [Mbps].
+    ("round", "<u4"),
+    ("moves", "<u4"),
+    ("dirty", "<u4"),
+    ("WA", "<f8"),
+    ("WB", "<f8")
+)
+
+STRUCT_CODES = {"u1": "B", "<u4": "I", "<f8": "d"} # Packing code of each column type.
+
+MOVES_FILE = "moves.npy"
+ROUNDS_FILE = "rounds.npy"
+SNAPSHOT_FILE = "snapshot.json"
+
+class RecordWriter(object):
+    """
+    This class appends fixed-size records to a file in the .npy format, as a one-dimensional array of a structured type.\n
+    The records are packed in a buffer and written in chunks; the header reserves room for any length,
+    and it is rewritten at each flush, so the file is always a valid array of the records written so far.
+    """
+    MAGIC = b"\x93NUMPY\x01\x00" # Format version 1.0.
+
+    def __init__(self, path, fields, chunk=4096):
+        """
+        Create the file given its path, the (name, type) pairs of the columns and the number of records per chunk.
+        """
+        self.__fields = list(fields)
+        self.__struct = struct.Struct("<" + "".join(STRUCT_CODES[type] for (_, type) in self.__fields))
+        self.__chunk = chunk
+        self.__buffer = bytearray()
+        self.__buffered = 0
+        self.__count = 0
+        # Room for the longest shape, aligned to 64 bytes as NumPy does.
+        self.__header_size = -(-(len(RecordWriter.MAGIC) + 2 + len(self.__describe(2 ** 64)) + 1) // 64) * 64
+        self.__file = open(path, "wb")
+        self.__file.write(self.__header(0))
+
+    def __describe(self, count):
+        # Return the description of an array of count records.
+        return "{{'descr': {}, 'fortran_order': False, 'shape': ({},), }}".format(self.__fields, count)
+
+    def __header(self, count):
+        # Return the header of an array of count records, padded with spaces to the reserved size.
+        description = self.__describe(count).ljust(self.__header_size - len(RecordWriter.MAGIC) - 2 - 1) + "\n"
+        return RecordWriter.MAGIC + struct.pack("<H", len(description)) + description.encode("latin1")
+
+    def append(self, *values):
+        """
+        Append a record, given the values of its columns.
+        """
+        self.__buffer += self.__struct.pack(*values)
+        self.__buffered += 1
+        if self.__buffered >= self.__chunk:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered records and update the length in the header.
+        """
+        if self.__buffered:
+            self.__file.write(self.__buffer)
+            self.__count += self.__buffered
+            self.__buffer = bytearray()
+            self.__buffered = 0
+            self.__file.seek(0)
+            self.__file.write(self.__header(self.__count))
+            self.__file.seek(0, os.SEEK_END)
+        self.__file.flush()
+
+    def close(self):
+        """
+        Write the buffered records and close the file.
+        """
+        if not self.__file.closed:
+            self.flush()
+            self.__file.close()
+
+    count = property(lambda self: self.__count + self.__buffered)
+
+class TrajectoryRecorder(object):
+    """
+    This class records the trajectory of the best-response dynamics in a directory: every move, every round summary
+    and, optionally, the snapshot of the initial scenario, so that the run can be replayed.\n
+    It is given as the recorder of BestResponseDynamics.
+    """
+    def __init__(self, directory, space=None, payoffs=None, chunk=4096):
+        """
+        Initialize the recorder given the directory of the files, created if needed.\n
+        If the space is given, its snapshot is saved before any move; if a PayoffTracker is given, the payoffs are saved with each round.
+        """
+        os.makedirs(directory, exist_ok=True)
+        if space is not None:
+            with open(os.path.join(directory, SNAPSHOT_FILE), "w") as snapshot:
+                json.dump(space.snapshot(), snapshot)
+        self.__payoffs = payoffs
+        self.__moves = RecordWriter(os.path.join(directory, MOVES_FILE), MOVE_FIELDS, chunk)
+        self.__rounds = RecordWriter(os.path.join(directory, ROUNDS_FILE), ROUND_FIELDS, chunk)
+
+    def move(self, round, device, starting_gateway, destination_gateway, variation):
+        """
+        Record that the device moved between two gateways, with the variation of the bandwidth of its type.
+        """
+        self.__moves.append(round, device.ID, int(device.type), starting_gateway.ID, destination_gateway.ID, variation)
+
+    def end_round(self, round, moves, dirty):
+        """
+        Record the summary of a round, with the current payoffs if they are tracked.
+        """
+        (payoff_a, payoff_b) = self.__payoffs.payoffs if self.__payoffs is not None else (float("nan"), float("nan"))
+        self.__rounds.append(round, moves, dirty, payoff_a, payoff_b)
+
+    def flush(self):
+        """
+        Write the buffered records, leaving valid files.
+        """
+        self.__moves.flush()
+        self.__rounds.flush()
+
+    def close(self):
+        """
+        Write the buffered records and close the files.
+        """
+        self.__moves.close()
+        self.__rounds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+class TrajectoryReader(object):
+    """
+    This class reads a recorded trajectory, mapping its files in memory, so that a run is never loaded whole.
+    """
+    def __init__(self, directory):
+        """
+        Open the trajectory recorded in the given directory.
+        """
+        if np is None:
+            raise ImportError("The trajectory reader requires NumPy.")
+        self.__directory = directory
+        self.__moves = np.load(os.path.join(directory, MOVES_FILE), mmap_mode="r")
+        self.__rounds = np.load(os.path.join(directory, ROUNDS_FILE), mmap_mode="r")
+
+    def get_round_moves(self, round):
+        """
+        Return the moves of the given round, as a view of the mapped file.
+        """
+        (first, last) = np.searchsorted(self.__moves["round"], [round, round + 1])
+        return self.__moves[first:last]
+
+    def snapshot(self):
+        """
+        Return the snapshot of the initial scenario, or None if it was not recorded.
+        """
+        path = os.path.join(self.__directory, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as snapshot:
+            return json.load(snapshot)
+
+    def replay(self, rounds=None, chunk=65536):
+        """
+        Build the initial scenario from the snapshot and apply the recorded moves, up to the given number of rounds,
+        reading them in chunks. Return the tuple (space, gateways, devices).
+        """
+        snapshot = self.snapshot()
+        if snapshot is None:
+            raise RuntimeError("The trajectory has no snapshot to replay.")
+        (space, gateways, devices) = Space.from_snapshot(snapshot)
+        gateway_of = {gateway.ID: gateway for gateway in gateways}
+        device_of = {(device.ID, device.type): device for device in devices}
+        last = len(self.__moves) if rounds is None else int(np.searchsorted(self.__moves["round"], rounds + 1))
+        for first in range(0, last, chunk):
+            moves = self.__moves[first:min(first + chunk, last)]
+            for (device_ID, type, source, destination) in zip(moves["device"].tolist(), moves["type"].tolist(),
+                                                               moves["source"].tolist(), moves["destination"].tolist()):
+                device = device_of[(device_ID, DeviceType(type))]
+                if device not in gateway_of[source]:
+                    raise ValueError("The device {} is not connected to the gateway {}.".format(device, source))
+                gateway_of[source].disconnect_device(device)
+                gateway_of[destination].connect_device(device)
+        return (space, gateways, devices)
+
+    moves = property(lambda self: self.__moves)
+    rounds = property(lambda self: self.__rounds)
@@ -0,0 +1,279 @@
+from array import array
+from gateway_selection import Device, DeviceType, bandwidth_variation
+try:
+    import numpy as np
+except ImportError: # NumPy is optional: only this solver needs it.
+    np = None
+
+class VectorizedGame(object):
+    """
+    This class holds the state of a gateway selection game as arrays, and runs best-response dynamics on them.\n
+    The bandwidth variation of every (device, candidate gateway) pair is computed in one batched pass, with the formulas of
+    bandwidth_variation evaluated on the arrays of counters: they are the same cases of the object-based path, which reads them
+    through the cached marginal values of the gateways, so a variation may differ from it in the last bits.\n
+    As in BestResponseDynamics, only the dirty devices are evaluated: a device is dirty until it is evaluated against
+    the current counters, and becomes dirty again when a gateway it reaches is left or joined.
+    """
+    SIMULTANEOUS = "simultaneous" # The improving devices are evaluated at once, and move in order of improvement while they still improve.
+    SEQUENTIAL = "sequential" # The improving devices move one at a time, Gauss-Seidel style.
+    CHUNK = 64 # Devices evaluated together in a sequential round.
+
+    def __init__(self, types, assignment, bandwidths, offsets, indices):
+        """
+        Initialize the game given the type of each device, the index of its current gateway,
+        the bandwidth of each gateway and the coverage adjacency in compressed sparse row form.\n
+        The gateways reachable by device i are indices[offsets[i]:offsets[i + 1]]. Every device is initially dirty.
+        """
+        if np is None:
+            raise ImportError("The vectorized solver requires NumPy.")
+
+        self.__types = np.asarray(types, dtype=np.int64) - DeviceType.TYPE_A # Row of the type in the counts: 0 for A, 1 for B.
+        self.__assignment = np.array(assignment, dtype=np.int64)
+        self.__bandwidths = np.asarray(bandwidths, dtype=np.float64)
+        self.__offsets = np.asarray(offsets, dtype=np.int64)
+        self.__indices = np.asarray(indices, dtype=np.int64)
+
+        if len(self.__offsets) != len(self.__types) + 1 or len(self.__assignment) != len(self.__types):
+            raise ValueError("The types, the assignment and the offsets must describe the same devices.")
+        if np.any(np.diff(self.__offsets) <= 0): # Each device must reach at least one gateway.
+            raise ValueError("The device is not able to connect to any gateway.")
+
+        self.__rows = np.repeat(np.arange(len(self.__types)), np.diff(self.__offsets)) # Device of each edge.
+        # Devices reached by each gateway, in compressed sparse row form: the transpose of the coverage adjacency.
+        self.__reached = self.__rows[np.argsort(self.__indices, kind="stable")]
+        self.__reached_offsets = np.zeros(len(self.__bandwidths) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.__indices, minlength=len(self.__bandwidths)), out=self.__reached_offsets[1:])
+        # Number of devices of each type connected to each gateway, as an array shared with a flat one, read faster one item at a time.
+        self.__flat_counts = array("q", [0]) * (len(DeviceType) * len(self.__bandwidths))
+        self.__counts = np.frombuffer(self.__flat_counts, dtype=np.int64).reshape(len(DeviceType), len(self.__bandwidths))
+        self.__bandwidth_list = self.__bandwidths.tolist()
+        self.__type_list = self.__types.tolist()
+        np.add.at(self.__counts, (self.__types, self.__assignment), 1)
+        self.__dirty = np.ones(len(self.__types), dtype=bool)
+        self.__states = {} # Hash of the state at the end of each round.
+        self.__rounds = 0
+        self.__cycle = None # Length of the detected cycle, in rounds.
+        self.__space = None
+        self.__devices = None
+        self.__gateways = None
+
+    @classmethod
+    def from_space(cls, space):
+        """
+        Build the game from the devices and gateways placed in a space, keeping their current connections.
+        """
+        (devices, gateways, offsets, indices) = space.get_coverage_graph()
+        gateway_index = {gateway: index for (index, gateway) in enumerate(gateways)}
+        assignment = [gateway_index[space.get_device_gateway(device)] for device in devices]
+        game = cls([device.type for device in devices], assignment, [gateway.bandwidth for gateway in gateways], offsets, indices)
+        game.__space = space
+        game.__devices = devices
+        game.__gateways = gateways
+        return game
+
+    def __edge_deltas(self, rows, candidates):
+        # Compute the bandwidth variation of moving each device in rows to the corresponding candidate gateway.
+        types = self.__types[rows]
+        starting = self.__assignment[rows]
+        n1 = self.__counts[types, starting]
+        n2 = self.__counts[types, candidates]
+        t1 = self.__counts[0, starting] + self.__counts[1, starting]
+        t2 = self.__counts[0, candidates] + self.__counts[1, candidates]
+        w1 = self.__bandwidths[starting]
+        w2 = self.__bandwidths[candidates]
+        with np.errstate(divide="ignore", invalid="ignore"): # The degenerate cases are masked below.
+            leave = (n1 - 1) * w1 / (t1 - 1)
+            stay = n1 * w1 / t1
+            arrive = (n2 + 1) * w2 / (t2 + 1)
+            present = n2 * w2 / t2
+            # Same four cases, and same order of the operations, of bandwidth_variation.
+            deltas = np.where(t1 == 1,
+                              np.where(t2 == 0, 0.0, arrive - (stay + present)),
+                              np.where(t2 == 0, leave + arrive - stay, leave + arrive - stay - present))
+        deltas[candidates == starting] = -np.inf # Staying is not a move.
+        return deltas
+
+    def __delta(self, type, starting, candidate):
+        # Compute the bandwidth variation of moving a single device of the type to the candidate gateway, with bandwidth_variation.
+        (counts, bandwidths) = (self.__flat_counts, self.__bandwidth_list)
+        (own, other) = (type * len(bandwidths), (1 - type) * len(bandwidths))
+        return bandwidth_variation(counts[own + starting], counts[other + starting], bandwidths[starting],
+                                   counts[own + candidate], counts[other + candidate], bandwidths[candidate])
+
+    def __edges(self, devices):
+        # Return the edges of the given devices, in order, and the position of the first edge of each device among them.
+        lengths = self.__offsets[devices + 1] - self.__offsets[devices]
+        firsts = np.cumsum(lengths) - lengths
+        edges = np.arange(lengths.sum()) - np.repeat(firsts, lengths) + np.repeat(self.__offsets[devices], lengths)
+        return (edges, firsts)
+
+    def __best_deltas(self, devices):
+        # Return the edges of the given devices, the position of the first one of each device, their variations,
+        # and the best variation of each device.
+        (edges, firsts) = self.__edges(devices)
+        deltas = self.__edge_deltas(self.__rows[edges], self.__indices[edges])
+        return (edges, firsts, deltas, np.maximum.reduceat(deltas, firsts))
+
+    def __best_moves(self, devices):
+        # Return the best candidate gateway of each of the given devices, and its variation.
+        if len(devices) == 0:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0))
+        (edges, firsts, deltas, best) = self.__best_deltas(devices)
+        # First best candidate of each device: the first of its edges reaching the maximum.
+        hits = np.flatnonzero(deltas == np.repeat(best, np.diff(np.append(firsts, len(edges)))))
+        first_hits = hits[np.unique(np.searchsorted(firsts, hits, side="right") - 1, return_index=True)[1]]
+        return (self.__indices[edges[first_hits]], best)
+
+    def __move(self, device, type, starting, destination):
+        # Move a device of the type from its gateway to the destination, updating the counters.
+        row = type * len(self.__bandwidth_list)
+        self.__flat_counts[row + starting] -= 1
+        self.__flat_counts[row + destination] += 1
+        self.__assignment[device] = destination
+
+    def __mark_dirty(self, gateways):
+        # Mark as dirty the devices reaching the given gateways.
+        gateways = np.unique(gateways)
+        lengths = self.__reached_offsets[gateways + 1] - self.__reached_offsets[gateways]
+        firsts = np.cumsum(lengths) - lengths
+        self.__dirty[self.__reached[np.arange(lengths.sum()) - np.repeat(firsts, lengths) + np.repeat(self.__reached_offsets[gateways], lengths)]] = True
+
+    def __movable(self, types):
+        # Return the mask of the devices allowed to change gateway.
+        if types is None:
+            return np.ones(len(self.__types), dtype=bool)
+        return np.isin(self.__types, [type - DeviceType.TYPE_A for type in types])
+
+    def __batch_round(self, movable):
+        # Evaluate the dirty devices at once, then apply their best moves in order of decreasing variation, each one checked again
+        # against the counters changed by the previous ones: the moves no longer improving are evaluated again, in the next batch.
+        (pending, moves) = (np.flatnonzero(self.__dirty & movable), 0)
+        self.__dirty[pending] = False
+        touched = set() # Gateways left or joined in this round.
+        while len(pending) > 0:
+            (destinations, deltas) = self.__best_moves(pending)
+            improving = deltas > Device.TOLERANCE
+            order = np.argsort(-deltas[improving], kind="stable")
+            rejected = []
+            for (device, destination) in zip(pending[improving][order].tolist(), destinations[improving][order].tolist()):
+                (type, starting) = (self.__type_list[device], int(self.__assignment[device]))
+                if self.__delta(type, starting, destination) > Device.TOLERANCE:
+                    touched.update((starting, destination))
+                    self.__move(device, type, starting, destination)
+                    moves += 1
+                else:
+                    rejected.append(device)
+            if len(rejected) == len(order): # No move left improving, up to the rounding of the batched variations.
+                break
+            pending = np.array(rejected, dtype=np.int64)
+        if touched:
+            self.__mark_dirty(np.array(list(touched))) # The devices made dirty are evaluated in the next round.
+        return moves
+
+    def __sequential_round(self, movable, chunk):
+        # Evaluate the dirty devices in order, a chunk at a time, against the same counters: they stay exact for the devices
+        # of the chunk up to the first device, following a move, which reaches one of the gateways it touched.
+        (moves, position) = (0, 0)
+        while True:
+            devices = np.flatnonzero(self.__dirty[position:] & movable[position:])[:chunk] + position
+            if len(devices) == 0:
+                return moves
+            best = self.__best_deltas(devices)[3]
+            (starts, ends) = (self.__offsets[devices].tolist(), self.__offsets[devices + 1].tolist())
+            candidates = self.__indices[starts[0]:ends[-1]].tolist() # Edges of the devices, and of the ones between them.
+            (position, limit) = (int(devices[-1]) + 1, len(self.__types)) # First device made dirty after a move of the chunk.
+            for (index, device) in enumerate(devices.tolist()):
+                if device >= limit: # Evaluate the chunk again from it, against the current counters.
+                    position = limit
+                    break
+                self.__dirty[device] = False
+                if best[index] <= Device.TOLERANCE:
+                    continue
+                (type, starting) = (self.__type_list[device], int(self.__assignment[device]))
+                current = starting
+                for candidate in candidates[starts[index] - starts[0]:ends[index] - starts[0]]:
+                    # Scan the candidates in order, as Device.gateway_selection does.
+                    if candidate != current and self.__delta(type, current, candidate) > Device.TOLERANCE:
+                        self.__move(device, type, current, candidate)
+                        current = candidate
+                if current != starting:
+                    moves += 1
+                    reached = np.concatenate([self.__reached[self.__reached_offsets[gateway]:self.__reached_offsets[gateway + 1]]
+                                              for gateway in (starting, current)])
+                    self.__dirty[reached] = True # The device itself too, for the next round.
+                    following = reached[reached > device]
+                    if len(following) > 0:
+                        limit = min(limit, int(following.min()))
+
+    def round(self, mode=SEQUENTIAL, types=None, chunk=CHUNK):
+        """
+        Run a best-response round over the dirty devices and return the number of devices that changed gateway.\n
+        In the sequential mode the dirty devices are evaluated in order, in chunks against the current counters,
+        and each improving one scans its candidates as Device.gateway_selection does. The devices made dirty by a move
+        are evaluated in the same round if they follow it, and in the next round otherwise.\n
+        In the simultaneous mode the dirty devices are evaluated at once, against the same counters, and their best moves
+        are applied in order of decreasing variation, each one only if it still improves against the counters changed by the previous
+        ones, so several moves can share a gateway. The devices whose move was dropped are evaluated again, in another batch,
+        and the devices made dirty by the moves are evaluated in the next round.\n
+        If types is given, only the devices of those types can change gateway.
+        """
+        movable = self.__movable(types)
+        if mode == VectorizedGame.SIMULTANEOUS:
+            moves = self.__batch_round(movable)
+        elif mode == VectorizedGame.SEQUENTIAL:
+            moves = self.__sequential_round(movable, chunk)
+        else:
+            raise ValueError("Unsupported update mode.")
+        self.__rounds += 1
+        dirty = self.__dirty & movable
+        state = hash((self.__assignment.tobytes(), dirty.tobytes()))
+        if moves > 0 and state in self.__states: # The rounds are deterministic, so they will repeat forever.
+            self.__cycle = self.__rounds - self.__states[state]
+        self.__states[state] = self.__rounds
+        return moves
+
+    def solve(self, mode=SEQUENTIAL, types=None, max_rounds=1000, chunk=CHUNK):
+        """
+        Run best-response rounds until no device can improve, and return the number of rounds.\n
+        If the equilibrium is not reached within max_rounds, or the rounds cycle, a RuntimeError is raised.
+        """
+        for rounds in range(1, max_rounds + 1):
+            if self.round(mode, types=types, chunk=chunk) == 0:
+                return rounds
+            if self.__cycle is not None:
+                raise RuntimeError("The rounds cycle every {} rounds.".format(self.__cycle))
+        raise RuntimeError("The equilibrium was not reached in {} rounds.".format(max_rounds))
+
+    def is_equilibrium(self, types=None):
+        """
+        Check that no device, of the given types, has an improving move.
+        """
+        return not np.any(self.__best_moves(np.flatnonzero(self.__movable(types)))[1] > Device.TOLERANCE)
+
+    def payoffs(self):
+        """
+        Return the total bandwidth (WA, WB) of the type A and type B devices.
+        """
+        totals = self.__counts.sum(axis=0)
+        shares = np.divide(self.__bandwidths, totals, out=np.zeros_like(self.__bandwidths), where=totals > 0)
+        (payoff_a, payoff_b) = (self.__counts * shares).sum(axis=1)
+        return (float(payoff_a), float(payoff_b))
+
+    def apply(self):
+        """
+        Connect each device of the space, the game was built from, to the gateway selected by the solver.
+        """
+        if self.__devices is None:
+            raise RuntimeError("The game was not built from a space.")
+        for (device, index) in zip(self.__devices, self.__assignment.tolist()):
+            destination = self.__gateways[index]
+            if device not in destination:
+                self.__space.get_device_gateway(device).disconnect_device(device)
+                destination.connect_device(device)
+
+    assignment = property(lambda self: self.__assignment)
+    counts = property(lambda self: self.__counts)
+    rounds = property(lambda self: self.__rounds)
+    cycle = property(lambda self: self.__cycle)
+    devices = property(lambda self: self.__devices)
+    gateways = property(lambda self: self.__gateways)
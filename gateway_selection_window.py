@@ -1,27 +1,126 @@
 import tkinter as tk
 import tkinter.messagebox as mb
 #from PIL import Image, ImageTk
-from gateway_selection import Device, Space, Gateway, DeviceType
+from gateway_selection import Device, Space, Gateway, DeviceType, BestResponseDynamics, PayoffTracker, CancellationToken, IdAllocator
+import itertools
+import math
+import os
 import threading
-import time
-import multiprocessing
+
+ICONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons") # The icons folder next to the module.
+
+class IconCache(object):
+    """
+    This class loads the icons lazily, from the icons folder next to the module, and keeps them scaled to the sizes of the cells.\n
+    A file is read only the first time its icon is drawn, and each size is scaled only the first time it is drawn,
+    so the window opens without reading any image, and zooming back to a size reuses its icons.
+    """
+    def __init__(self, master=None, directory=ICONS_DIRECTORY):
+        """
+        Initialize the cache given the Tk widget owning the images and the folder of the icons.
+        """
+        self.__master = master
+        self.__directory = directory
+        self.__sources = {} # Image read from each file, or None if it can't be read.
+        self.__images = {} # Image of each (name, size).
+
+    def __source(self, name):
+        # Return the image read from the file of the icon, reading it on the first call.
+        if name not in self.__sources:
+            try:
+                self.__sources[name] = tk.PhotoImage(master=self.__master, file=os.path.join(self.__directory, name + ".gif"))
+            except tk.TclError: # A missing or unreadable icon is drawn as a square.
+                self.__sources[name] = None
+        return self.__sources[name]
+
+    def get(self, name, size):
+        """
+        Return the icon of the given name scaled to a square of the given size [px], or None if it can't be read.
+        """
+        key = (name, size)
+        if key not in self.__images:
+            source = self.__source(name)
+            image = source
+            if source is not None and source.width() != size:
+                # Tk scales only by integer factors: zoom by the size and subsample by the side of the file, both reduced.
+                divisor = math.gcd(size, source.width())
+                if size // divisor > 1:
+                    image = image.zoom(size // divisor)
+                if source.width() // divisor > 1:
+                    image = image.subsample(source.width() // divisor)
+            self.__images[key] = image
+        return self.__images[key]
+
+class RenderQueue(object):
+    """
+    This class carries the changes of the state, from the thread of the dynamics to the Tk main loop.\n
+    It is the recorder of the dynamics: each move overwrites the last gateway of its device, and each round the last payoffs,
+    so its memory is bounded by the devices however far the window falls behind, and a frame draws only the latest state.
+    """
+    def __init__(self, payoffs):
+        """
+        Initialize the queue given the tracker of the payoffs, read only by the thread of the dynamics.
+        """
+        self.__lock = threading.Lock()
+        self.__moves = {} # Last gateway of each device moved since the last frame.
+        self.__status = None # Last payoffs and message.
+        self.__ended = False
+        self.__payoffs = payoffs
+
+    def move(self, round, device, starting_gateway, destination_gateway, variation):
+        """
+        Record the move of a device to its new gateway.
+        """
+        with self.__lock:
+            self.__moves[device] = destination_gateway
+
+    def end_round(self, round, moves, dirty):
+        """
+        Record the payoffs at the end of a round.
+        """
+        self.publish()
+
+    def publish(self, message=""):
+        """
+        Record the current payoffs, with a message for the title.
+        """
+        status = (self.__payoffs.record(), message)
+        with self.__lock:
+            self.__status = status
+
+    def finish(self, message):
+        """
+        Record the final payoffs and the end of the dynamics.
+        """
+        self.publish(message)
+        with self.__lock:
+            self.__ended = True
+
+    def drain(self):
+        """
+        Return and clear the changes since the last call, as the tuple (moves, status, ended): the last gateway of each device moved,
+        the last (payoffs, message) published, or None, and whether the dynamics ended.
+        """
+        with self.__lock:
+            (moves, status) = (self.__moves, self.__status)
+            (self.__moves, self.__status) = ({}, None)
+            return (moves, status, self.__ended)
 
 class GatewaySelectionWindow(object):
     BOTH = ("Both", 1)
     ONLY_A = ("A", 2)
     ONLY_B = ("B", 3)
+    FRAME = 40 # Time between two frames [ms].
+    ZOOMS = (40, 20, 10, 4, 2, 1) # Sizes of a cell [px], from the closest zoom level.
+    DETAIL_SIZE = 10 # Smallest cell [px] showing each element: below, each gateway is drawn as a heat spot of its devices.
+    VIEW_SIZE = (1000, 700) # Largest size of the canvas [px].
+    STOP_POLL = 50 # Time between two checks of the thread of a stopping simulation [ms].
+    PLACEMENT_CHUNK = 2000 # Elements placed between two updates of the window, while the scenario is populated.
 
     def __init__(self, root):
         self.__main_frame = tk.Frame(root)
         self.__controls_frame = tk.Frame(self.__main_frame)
-        #)
-        self.__images = {
-            "black_gateway" : tk.PhotoImage(file="./icons/black_gateway.gif"),
-            "red_gateway" : tk.PhotoImage(file="./icons/red_gateway.gif"),
-            "blue_sensor" : tk.PhotoImage(file="./icons/blue_sensor.gif"),
-            "red_sensor" : tk.PhotoImage(file="./icons/red_sensor.gif"),
-            "yellow_sensor" : tk.PhotoImage(file="./icons/yellow_sensor.gif")
-        }
+        self.__icons = IconCache(root) # Shared by the simulations: the icons are read when first drawn.
         
         self.__build_first_controls_row()
         self.__build_second_controls_row()
@@ -56,6 +155,11 @@ class GatewaySelectionWindow(object):
         self.__b_devices_entry.insert(tk.END, "10")
         self.__b_devices_entry.grid(row=0, column=9, padx=5, pady=5, sticky=tk.E + tk.W)
 
+        # Moves highlighted in each frame: the dynamics run at full speed, and each frame shows the latest gateway of every device.
+        tk.Label(self.__controls_frame, text="Highlights/frame:").grid(row=0, column=10, padx=5, pady=5, sticky=tk.E + tk.W)
+        self.__speed_scale = tk.Scale(self.__controls_frame, from_=1, to=500, orient=tk.HORIZONTAL, showvalue=True)
+        self.__speed_scale.grid(row=0, column=11, rowspan=2, padx=5, pady=5, sticky=tk.E + tk.W)
+
     def __build_second_controls_row(self):
         tk.Label(self.__controls_frame, text="Bandwidth [Mbps]:").grid(row=1, column=0, padx=5, pady=5, sticky=tk.E + tk.W)
         self.__bandwidth_entry = tk.Entry(self.__controls_frame, width=5, justify=tk.CENTER)
@@ -82,6 +186,9 @@ class GatewaySelectionWindow(object):
         self.__start_stop_simulation = tk.Button(self.__controls_frame, text="Start simulation", command=self.__start_stop_simulation)
         self.__start_stop_simulation.grid(row=1, column=8, columnspan=2, padx=5, pady=5, sticky=tk.E + tk.W)
 
+        self.__pause_resume_simulation = tk.Button(self.__controls_frame, text="Pause", command=self.__pause_resume_simulation, state=tk.DISABLED)
+        self.__pause_resume_simulation.grid(row=1, column=10, padx=5, pady=5, sticky=tk.E + tk.W)
+
     def __validate_entry(self, entry, name):
         try:
             entry_value = int(entry.get())
@@ -111,69 +218,136 @@ class GatewaySelectionWindow(object):
                 else:
                     control["state"] = tk.NORMAL
     
-    def __update_scrollregion(self, event):
+    def __update_scrollregion(self, event=None):
         self.__space_canvas.configure(scrollregion=(0, 0, self.__canvas_width, self.__canvas_height))
-
-    def __update_payoffs(self, message=""):
-        payoff_a = 0
-        payoff_b = 0
-        for gateway in self.__gateways:
-            n = gateway.get_device_count(DeviceType.TYPE_A)
-            m = gateway.get_device_count(DeviceType.TYPE_B)
-            
-            if n + m == 0:
-                continue
-            device_bandwidth = gateway.bandwidth / (n + m)
-            print(n, m, device_bandwidth)
-            payoff_a += device_bandwidth * n
-            payoff_b += device_bandwidth * m
-        self.__main_frame.winfo_toplevel().title("WA = {0:.2f} WB = {1:.2f} {2}".format(payoff_a, payoff_b, message))
+        self.__schedule_redraw()
+
+    def __center(self, position):
+        # Return the canvas coordinates of the center of the cell of the given position.
+        return (position[0] * self.__cell_size + self.__cell_size / 2, position[1] * self.__cell_size + self.__cell_size / 2)
+
+    def __scroll_x(self, first, last):
+        # Follow every change of the visible area, whatever caused it.
+        self.__horizontal_scroll_bar.set(first, last)
+        self.__schedule_redraw()
+
+    def __scroll_y(self, first, last):
+        self.__vertical_scroll_bar.set(first, last)
+        self.__schedule_redraw()
+
+    def __zoom(self, event):
+        # Change the size of the cells, keeping the center of the view in place.
+        index = GatewaySelectionWindow.ZOOMS.index(self.__cell_size)
+        index += 1 if event.num == 5 or event.delta < 0 else -1
+        if index < 0 or index >= len(GatewaySelectionWindow.ZOOMS):
+            return
+        center_x = (self.__space_canvas.xview()[0] + self.__space_canvas.xview()[1]) / 2
+        center_y = (self.__space_canvas.yview()[0] + self.__space_canvas.yview()[1]) / 2
+        self.__cell_size = GatewaySelectionWindow.ZOOMS[index]
+        self.__canvas_width = self.__cell_size * self.__space.columns
+        self.__canvas_height = self.__cell_size * self.__space.rows
+        self.__clear_focus()
+        self.__update_scrollregion()
+        (width, height) = (self.__space_canvas.winfo_width(), self.__space_canvas.winfo_height())
+        self.__space_canvas.xview_moveto(max(center_x - width / self.__canvas_width / 2, 0))
+        self.__space_canvas.yview_moveto(max(center_y - height / self.__canvas_height / 2, 0))
+
+    def __schedule_redraw(self):
+        # Redraw the visible area once, when Tk is idle, however many changes asked for it.
+        if self.__redraw is None:
+            self.__redraw = self.__space_canvas.after_idle(self.__draw_viewport)
+
+    def __draw_element(self, element, x, y, tags, highlight=False):
+        # Draw an element in its cell, as an icon scaled to the cell or, if the icon can't be read, as a square.
+        if isinstance(element, Gateway):
+            image = self.__icons.get("red_gateway" if highlight else "black_gateway", self.__cell_size)
+        else:
+            image = self.__icons.get("blue_sensor" if element.type == DeviceType.TYPE_A else "red_sensor", self.__cell_size)
+        if image is not None:
+            return self.__space_canvas.create_image(x * self.__cell_size, y * self.__cell_size, image=image, anchor=tk.NW, tags=tags)
+        if isinstance(element, Gateway):
+            color = "red" if highlight else "black"
+        else:
+            color = "blue" if element.type == DeviceType.TYPE_A else "red"
+        return self.__space_canvas.create_rectangle(x * self.__cell_size, y * self.__cell_size, (x + 1) * self.__cell_size,
+                                                    (y + 1) * self.__cell_size, fill=color, outline="", tags=tags)
+
+    def __draw_viewport(self):
+        # Draw only what lies in the visible area: the grid lines, the gateways' circles and the elements of the visible cells,
+        # or, when zoomed out, a heat spot for each gateway.
+        self.__redraw = None
+        self.__space_canvas.delete("view")
+        (left, top) = (self.__space_canvas.canvasx(0), self.__space_canvas.canvasy(0))
+        (right, bottom) = (left + self.__space_canvas.winfo_width(), top + self.__space_canvas.winfo_height())
+        (right, bottom) = (min(right, self.__canvas_width), min(bottom, self.__canvas_height))
+        (first_x, first_y) = (max(int(left) // self.__cell_size, 0), max(int(top) // self.__cell_size, 0))
+        (last_x, last_y) = (min(int(right) // self.__cell_size, self.__space.columns - 1), min(int(bottom) // self.__cell_size, self.__space.rows - 1))
+
+        most_devices = max(max((sum(counts) for counts in self.__view_counts.values()), default=0), 1) # Scale of the heat spots.
+        for gateway in self.__view_counts: # The gateways placed so far.
+            (x_center, y_center) = self.__center(self.__positions[gateway])
+            r = gateway.radius * self.__cell_size
+            if x_center + r < left or x_center - r > right or y_center + r < top or y_center - r > bottom:
+                continue # The circle is not visible.
+            if self.__cell_size >= GatewaySelectionWindow.DETAIL_SIZE:
+                self.__space_canvas.create_oval(x_center - r, y_center - r, x_center + r, y_center + r, tags="view")
+            else:
+                # The area of the spot grows with the connected devices, and its color goes from blue to red with the share of the B ones.
+                (a_devices, b_devices) = self.__view_counts[gateway]
+                spot = r * ((a_devices + b_devices) / most_devices) ** 0.5
+                red = int(255 * b_devices / (a_devices + b_devices)) if a_devices + b_devices > 0 else 0
+                self.__space_canvas.create_oval(x_center - r, y_center - r, x_center + r, y_center + r, outline="gray", tags="view")
+                self.__space_canvas.create_oval(x_center - spot, y_center - spot, x_center + spot, y_center + spot,
+                                                fill="#{:02x}00{:02x}".format(red, 255 - red), outline="", tags="view")
+
+        if self.__cell_size >= GatewaySelectionWindow.DETAIL_SIZE:
+            for x in range(first_x, last_x + 2): # The grid is drawn with lines, instead of a rectangle for each cell.
+                self.__space_canvas.create_line(x * self.__cell_size, first_y * self.__cell_size, x * self.__cell_size, (last_y + 1) * self.__cell_size, fill="gray", tags="view")
+            for y in range(first_y, last_y + 2):
+                self.__space_canvas.create_line(first_x * self.__cell_size, y * self.__cell_size, (last_x + 1) * self.__cell_size, y * self.__cell_size, fill="gray", tags="view")
+            for x in range(first_x, last_x + 1):
+                for y in range(first_y, last_y + 1):
+                    element = self.__space.get_element(x, y)
+                    if element is not None:
+                        self.__draw_element(element, x, y, "view")
+        self.__space_canvas.tag_lower("view") # The moves and the hover lines stay on top.
+
+    def __clear_focus(self):
+        # Delete the lines of the hovered element.
+        for idd in self.__line_id:
+            self.__space_canvas.delete(idd)
+        self.__line_id.clear()
+        self.__element_focus = None
 
     def __mouse_hover(self, event):
-        for element in self.__positions.keys():
-            (x, y) = self.__positions[element]
-            #print(event.x, event.y, x, x + self.__cell_size, y, y + self.__cell_size)
-            xs, ys = x * self.__cell_size, y * self.__cell_size
-            xe, ye = (x + 1) * self.__cell_size, (y + 1) * self.__cell_size
-            if (xs <= event.x and event.x <= xe) and (ys <= event.y and event.y <= ye):
-                print(x, y)
-                if not self.__on_element:
-                    self.__on_element = True
-                    self.__element_focus = element
-                    
-                    if isinstance(element, Device):
-                        gateway = self.__space.get_device_gateway(element)
-                        gateway_position = self.__positions[gateway]
-                        x1, y1 = x * self.__cell_size + self.__cell_size / 2, y * self.__cell_size + self.__cell_size / 2
-                        x2, y2 = gateway_position[0] * self.__cell_size + self.__cell_size / 2, gateway_position[1] * self.__cell_size + self.__cell_size / 2
-                        self.__line_id.append(self.__space_canvas.create_line(x1, y1, x2, y2))
-                    else:
-                        x1, y1 = x * self.__cell_size + self.__cell_size / 2, y * self.__cell_size + self.__cell_size / 2
-                        for device in element.devices:
-                            device_position = self.__positions[device]
-                            x2, y2 = device_position[0] * self.__cell_size + self.__cell_size / 2, device_position[1] * self.__cell_size + self.__cell_size / 2
-                            self.__line_id.append(self.__space_canvas.create_line(x1, y1, x2, y2))
-                if self.__element_focus == element:
-                    return
-                elif self.__element_focus != element:
-                    self.__element_focus = element
-                print(x, y)
-        if self.__on_element:
-            self.__on_element = False
-            for idd in self.__line_id:
-                self.__space_canvas.delete(idd)
-            self.__line_id.clear()
+        # Find the hovered element from its cell, and link it to its gateway or to its devices.
+        (x, y) = (int(self.__space_canvas.canvasx(event.x)) // self.__cell_size, int(self.__space_canvas.canvasy(event.y)) // self.__cell_size)
+        element = self.__space.get_element(x, y) if 0 <= x < self.__space.columns and 0 <= y < self.__space.rows else None
+        if element is self.__element_focus:
+            return
+        self.__clear_focus()
+        if element is None or self.__cell_size < GatewaySelectionWindow.DETAIL_SIZE:
+            return
+        self.__element_focus = element
+        if isinstance(element, Device):
+            targets = [self.__positions[self.__view_gateways[element]]]
+        else:
+            targets = [self.__positions[device] for device in self.__view_devices[element]]
+        for target in targets:
+            self.__line_id.append(self.__space_canvas.create_line(*self.__center((x, y)), *self.__center(target)))
 
     def __build_space(self, parameters):
-        self.__cell_size = 40
+        self.__cell_size = GatewaySelectionWindow.ZOOMS[0]
         self.__canvas_width = self.__cell_size * parameters["columns"]
         self.__canvas_height = self.__cell_size * parameters["rows"]
 
-        self.__on_element = False
         self.__element_focus = None
         self.__line_id = []
+        self.__redraw = None
         
-        self.__space_canvas = tk.Canvas(self.__main_frame, width=self.__canvas_width, height=self.__canvas_height, scrollregion=(0, 0, self.__canvas_width, self.__canvas_height))
+        (view_width, view_height) = GatewaySelectionWindow.VIEW_SIZE
+        self.__space_canvas = tk.Canvas(self.__main_frame, width=min(self.__canvas_width, view_width), height=min(self.__canvas_height, view_height),
+                                        scrollregion=(0, 0, self.__canvas_width, self.__canvas_height))
 
         self.__horizontal_scroll_bar = tk.Scrollbar(self.__main_frame, orient=tk.HORIZONTAL)
         self.__horizontal_scroll_bar.pack(side=tk.BOTTOM, fill=tk.X)
@@ -183,89 +357,124 @@ class GatewaySelectionWindow(object):
         self.__vertical_scroll_bar.pack(side=tk.RIGHT, fill=tk.Y)
         self.__vertical_scroll_bar.config(command=self.__space_canvas.yview)
 
-        self.__gateways = [Gateway(parameters["bandwidth"], radius=parameters["radius"]) for _ in range(parameters["gateways"])]
-        self.__a_devices = [Device(DeviceType.TYPE_A) for _ in range(parameters["a_devices"])]
-        self.__b_devices = [Device(DeviceType.TYPE_B) for _ in range(parameters["b_devices"])]
+        allocator = IdAllocator() # Each simulation numbers its elements from one.
+        self.__gateways = [allocator.gateway(parameters["bandwidth"], radius=parameters["radius"]) for _ in range(parameters["gateways"])]
+        self.__a_devices = [allocator.device(DeviceType.TYPE_A) for _ in range(parameters["a_devices"])]
+        self.__b_devices = [allocator.device(DeviceType.TYPE_B) for _ in range(parameters["b_devices"])]
         self.__space = Space(parameters["rows"], parameters["columns"])
         
         self.__positions = {}
-        
-        for element in self.__gateways + self.__a_devices + self.__b_devices:
-            (x, y) = self.__space.add_element(element)
-            self.__positions[element] = (x, y)
-            if isinstance(element, Device):
-                element.set_gateway_callback(self.__gateway_callback)
-                if element.type == DeviceType.TYPE_A:
-                    self.__space_canvas.create_image(x * self.__cell_size, y * self.__cell_size, image=self.__images["blue_sensor"], anchor=tk.NW)
-                else:
-                    self.__space_canvas.create_image(x * self.__cell_size, y * self.__cell_size, image=self.__images["red_sensor"], anchor=tk.NW)
-            elif isinstance(element, Gateway):
-                x_center = x * self.__cell_size + (self.__cell_size / 2.0)
-                y_center = y * self.__cell_size + (self.__cell_size / 2.0)
-                r = element.radius * self.__cell_size
-                self.__space_canvas.create_oval(x_center - r, y_center - r, x_center + r, y_center + r)
-                self.__space_canvas.create_image(x * self.__cell_size, y * self.__cell_size, image=self.__images["black_gateway"], anchor=tk.NW)
-        
-        for i in range(parameters["rows"]):
-            for j in range(parameters["columns"]):
-                box = (i * self.__cell_size, j * self.__cell_size, (i + 1) * self.__cell_size, (j + 1) * self.__cell_size)
-                self.__space_canvas.create_rectangle(box)
-                  
+        self.__view_gateways = {} # Gateway of each device, as drawn: the window never reads the state changed by the dynamics.
+        self.__view_devices = {} # Drawn devices of each placed gateway.
+        self.__view_counts = {} # Drawn A and B devices of each placed gateway.
+
+        self.__highlights = [] # Items drawn for the moves of the last frame.
+        self.__finished = False
+        self.__status = "" # Title of the last payoffs.
+        self.__token = CancellationToken() # Stops and pauses the dynamics between the evaluations, without blocking the window.
+        self.__selection_algorithm_thread = None
+        self.__frame = None
+
         self.__space_canvas.bind("<Configure>", self.__update_scrollregion)
         self.__space_canvas.bind("<Motion>", self.__mouse_hover)
-        self.__space_canvas.configure(scrollregion=(0, 0, self.__canvas_width, self.__canvas_height))#self.__space_canvas.bbox("all"))
-        self.__space_canvas.configure(width=self.__canvas_width, height=self.__canvas_height)
-        self.__space_canvas.config(xscrollcommand=self.__horizontal_scroll_bar.set, yscrollcommand=self.__vertical_scroll_bar.set)
-        self.__space_canvas.pack(expand=tk.TRUE, fill=tk.NONE, anchor=tk.CENTER, side=tk.TOP)
-
-        self.__stop = False
-        self.__selection_algorithm_thread = threading.Thread(target=self.__selection_algorithm)#multiprocessing.Process(target=self.__selection_algorithm)
-        self.__selection_algorithm_thread.start()
-    
-    def __selection_algorithm(self):
-        strategy = self.__strategies_variable.get()
-        devices = []
-        loop_detected = False
-        not_changed = 0
-        last_value = 0
-        counter = 0
-        if strategy == self.BOTH[1]:
+        self.__space_canvas.bind("<Control-MouseWheel>", self.__zoom)
+        self.__space_canvas.bind("<Control-Button-4>", self.__zoom)
+        self.__space_canvas.bind("<Control-Button-5>", self.__zoom)
+        self.__space_canvas.config(xscrollcommand=self.__scroll_x, yscrollcommand=self.__scroll_y)
+        self.__space_canvas.pack(expand=tk.TRUE, fill=tk.BOTH, anchor=tk.CENTER, side=tk.TOP)
+
+        # The window is shown now, and the elements are placed a chunk at a time by the Tk main loop, the gateways first.
+        elements = self.__gateways + self.__a_devices + self.__b_devices
+        if parameters["strategies"] == self.BOTH[1]: # The devices allowed to move are chosen here, in the Tk main loop.
             devices = self.__a_devices + self.__b_devices
-        elif strategy == self.ONLY_A[1]:
+        elif parameters["strategies"] == self.ONLY_A[1]:
             devices = self.__a_devices
         else:
             devices = self.__b_devices
-        while not self.__stop and not loop_detected and not_changed != len(devices):
-            not_changed = 0
-            self.__update_payoffs()
-            for device in devices:
-                (x, y) = self.__positions[device]
-                device_temporary_image = self.__space_canvas.create_image(self.__cell_size * x, self.__cell_size * y, image=self.__images["yellow_sensor"], anchor=tk.NW)
-                if not device.gateway_selection(self.__space):
-                    not_changed += 1
-                self.__space_canvas.delete(device_temporary_image)
-            if not_changed - 2 <= last_value and last_value <= not_changed + 2:
-                counter += 1
-                if counter == 10:
-                    loop_detected = True
-            else:
-                last_value = not_changed
-                counter = 0
-        self.__update_payoffs("finished")
-        self.__stop = False
-
-
-    def __gateway_callback(self, gateway, device):
-        if not self.__stop:
-            (x1, y1) = self.__positions[gateway]
-            (x2, y2) = self.__positions[device]
-            (xs, ys) = (x2 * self.__cell_size + self.__cell_size / 2, y2 * self.__cell_size + self.__cell_size / 2)
-            (xe, ye) = (x1 * self.__cell_size + self.__cell_size / 2, y1 * self.__cell_size + self.__cell_size / 2)
-            gateway_temporary_image = self.__space_canvas.create_image(self.__cell_size * x1, self.__cell_size * y1, image=self.__images["red_gateway"], anchor=tk.NW)
-            line_temporary = self.__space_canvas.create_line(xs, ys, xe, ye)
-            time.sleep(0.1)
-            self.__space_canvas.delete(gateway_temporary_image)
-            self.__space_canvas.delete(line_temporary)
+        self.__placement = self.__space_canvas.after_idle(self.__place_elements, elements, devices, 0)
+
+    def __place_elements(self, elements, devices, start):
+        # Place a chunk of the elements, then schedule the next one or, when they are all placed, start the dynamics of the devices.
+        end = min(start + GatewaySelectionWindow.PLACEMENT_CHUNK, len(elements))
+        try:
+            for element in elements[start:end]:
+                (x, y) = self.__space.add_element(element)
+                self.__positions[element] = (x, y)
+                if isinstance(element, Gateway):
+                    self.__view_devices[element] = set()
+                    self.__view_counts[element] = [0, 0]
+                else:
+                    self.__connect_view(element, self.__space.get_device_gateway(element))
+        except ValueError as placementException: # No free position left for an element.
+            self.__placement = None
+            mb.showerror("Placement error!", placementException.args[0])
+            self.__start_stop_simulation.invoke() # Stop the simulation, through the button.
+            return
+        self.__schedule_redraw()
+        if end < len(elements):
+            self.__main_frame.winfo_toplevel().title("Placing the elements {}/{}".format(end, len(elements)))
+            self.__placement = self.__space_canvas.after(1, self.__place_elements, elements, devices, end)
+            return
+        self.__placement = None
+        self.__render_queue = RenderQueue(PayoffTracker(self.__gateways)) # Track the payoffs from the initial connections.
+        self.__selection_algorithm_thread = threading.Thread(target=self.__selection_algorithm, args=(devices,), daemon=True)
+        self.__selection_algorithm_thread.start()
+        self.__pause_resume_simulation["state"] = tk.NORMAL
+        self.__frame = self.__space_canvas.after(GatewaySelectionWindow.FRAME, self.__draw_frame)
+
+    def __connect_view(self, device, gateway):
+        # Record the connection of a device, as drawn.
+        previous = self.__view_gateways.get(device)
+        if previous is not None:
+            self.__view_devices[previous].discard(device)
+            self.__view_counts[previous][device.type - DeviceType.TYPE_A] -= 1
+        self.__view_gateways[device] = gateway
+        self.__view_devices[gateway].add(device)
+        self.__view_counts[gateway][device.type - DeviceType.TYPE_A] += 1
+    
+    def __selection_algorithm(self, devices):
+        # Run the dynamics of the given devices on their own thread: they never touch Tk, and only push their changes to the render queue.
+        dynamics = BestResponseDynamics(self.__space, devices, recorder=self.__render_queue)
+        self.__render_queue.publish()
+        while not dynamics.finished:
+            if not self.__token.checkpoint(): # A pause waits here, between two rounds; a stop leaves the space to be destroyed.
+                return
+            for device in dynamics.pending():
+                if self.__token.cancelled: # The round is left half done: it is neither closed nor published.
+                    return
+                dynamics.evaluate(device)
+            dynamics.end_round()
+        if dynamics.cycle is not None:
+            self.__render_queue.finish("cycle of {} rounds".format(dynamics.cycle))
+        else:
+            self.__render_queue.finish("equilibrium")
+
+    def __draw_frame(self):
+        # Draw the changes since the last frame, in the Tk main loop, highlighting at most the moves per frame.
+        for item in self.__highlights:
+            self.__space_canvas.delete(item)
+        self.__highlights.clear()
+        (moved, status, ended) = self.__render_queue.drain() # The intermediate gateways of a device are never seen.
+        if ended and not self.__finished: # A finished run can't be paused.
+            self.__pause_resume_simulation["state"] = tk.DISABLED
+        self.__finished = ended
+        for (device, gateway) in moved.items():
+            self.__connect_view(device, gateway)
+        if self.__cell_size >= GatewaySelectionWindow.DETAIL_SIZE:
+            for (device, gateway) in itertools.islice(moved.items(), self.__speed_scale.get()):
+                self.__highlights.append(self.__draw_element(gateway, *self.__positions[gateway], (), highlight=True))
+                self.__highlights.append(self.__space_canvas.create_line(*self.__center(self.__positions[device]), *self.__center(self.__positions[gateway])))
+        elif moved:
+            self.__schedule_redraw() # The heat spots changed.
+        if status is not None:
+            self.__status = "WA = {0:.2f} WB = {1:.2f} {2}".format(status[0][0], status[0][1], status[1])
+            self.__show_status()
+        if moved or not self.__finished: # Draw until the last moves are cleared.
+            self.__frame = self.__space_canvas.after(GatewaySelectionWindow.FRAME, self.__draw_frame)
+
+    def __show_status(self):
+        # Show the last payoffs in the title, and the pause until the dynamics are resumed.
+        self.__main_frame.winfo_toplevel().title(self.__status + (" (paused)" if self.__token.paused and not self.__finished else ""))
 
     def __start_stop_simulation(self):
         if self.__start_stop_simulation["text"] == "Start simulation":
@@ -280,14 +489,41 @@ class GatewaySelectionWindow(object):
                 mb.showerror("Input parameter error!", parameterException.args[0])
                 parameterException.args[1].delete(0, tk.END)
         else:
-            if self.__selection_algorithm_thread.isAlive:
-                self.__stop = True
-                time.sleep(5)
-            self.__space_canvas.destroy()
-            self.__horizontal_scroll_bar.destroy()
-            self.__vertical_scroll_bar.destroy()
-            self.__toggle_controls()
-            self.__start_stop_simulation["text"] = "Start simulation"
+            # Ask the dynamics to stop, and wait for their thread from the Tk main loop, which keeps drawing meanwhile.
+            if self.__placement is not None:
+                self.__space_canvas.after_cancel(self.__placement)
+                self.__placement = None
+            self.__token.cancel()
+            self.__start_stop_simulation["state"] = tk.DISABLED
+            self.__pause_resume_simulation["state"] = tk.DISABLED
+            self.__wait_stop()
+
+    def __wait_stop(self):
+        # Destroy the space once the thread of the dynamics ended, checking it again later if it is still running.
+        if self.__selection_algorithm_thread is not None and self.__selection_algorithm_thread.is_alive():
+            self.__space_canvas.after(GatewaySelectionWindow.STOP_POLL, self.__wait_stop)
+            return
+        if self.__frame is not None:
+            self.__space_canvas.after_cancel(self.__frame)
+        if self.__redraw is not None:
+            self.__space_canvas.after_cancel(self.__redraw)
+        self.__space_canvas.destroy()
+        self.__horizontal_scroll_bar.destroy()
+        self.__vertical_scroll_bar.destroy()
+        self.__toggle_controls()
+        self.__start_stop_simulation["text"] = "Start simulation"
+        self.__start_stop_simulation["state"] = tk.NORMAL
+        self.__pause_resume_simulation["text"] = "Pause"
+
+    def __pause_resume_simulation(self):
+        # Pause the dynamics at the end of their round, or let them go on from the current assignment.
+        if self.__token.paused:
+            self.__token.resume()
+            self.__pause_resume_simulation["text"] = "Pause"
+        elif not self.__finished:
+            self.__token.pause()
+            self.__pause_resume_simulation["text"] = "Resume"
+        self.__show_status()
 
 
 def main():